@@ -1,8 +1,30 @@
+from contextlib import asynccontextmanager
+
+from api.config import APP_WARMUP_ENABLED
+from api.container import AppContainer
 from api.routes import router
+from api.telemetry.logs import configure_logging
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 
-app = FastAPI()
+
+configure_logging()
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    container = AppContainer()
+    app.state.container = container
+    try:
+        await container.start_async()
+        if APP_WARMUP_ENABLED:
+            await container.warm_up_async()
+        yield
+    finally:
+        await container.aclose()
+
+
+app = FastAPI(lifespan=lifespan)
 
 app.add_middleware(
     CORSMiddleware,
@@ -0,0 +1,82 @@
+import argparse
+import asyncio
+import json
+import sys
+
+from api.config import BATCH_CONCURRENCY
+from api.container import AppContainer
+from api.research.batch_runner import BatchReport
+from api.telemetry.logs import configure_logging
+
+
+def read_prompts(path: str) -> list[str]:
+    # One prompt per line, either as is or as a JSON object with a "prompt"
+    prompts = []
+    with open(path) as file:
+        for line in file:
+            line = line.strip()
+            if not line or line.startswith("#"):
+                continue
+            if line.startswith("{"):
+                line = json.loads(line)["prompt"]
+            prompts.append(line)
+    return prompts
+
+
+async def run_batch(prompts: list[str], output, concurrency: int) -> BatchReport:
+    container = AppContainer(research_workers=0)
+    try:
+        await container.warm_up_async()
+        batch_runner = container.build_batch_runner(concurrency)
+        async for line in batch_runner.run_async(prompts):
+            if isinstance(line, BatchReport):
+                return line
+
+            # Written as soon as each one is done, so a long batch can be followed (or salvaged)
+            output.write(line.model_dump_json() + "\n")
+            output.flush()
+            print(
+                f"[{line.index + 1}/{len(prompts)}] {line.status.value} in {line.seconds:.1f}s: {line.prompt}",
+                file=sys.stderr,
+            )
+    finally:
+        await container.aclose()
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Research every prompt in a file, writing a JSON line per research"
+    )
+    parser.add_argument("prompts", help="File with one prompt per line")
+    parser.add_argument(
+        "-o", "--output", help="Where to write the JSON lines (default: stdout)"
+    )
+    parser.add_argument(
+        "--report", help="Where to write the throughput report (default: stderr)"
+    )
+    parser.add_argument(
+        "--concurrency",
+        type=int,
+        default=BATCH_CONCURRENCY,
+        help="How many prompts are researched at once",
+    )
+    args = parser.parse_args()
+
+    configure_logging()
+    prompts = read_prompts(args.prompts)
+    output = open(args.output, "w") if args.output else sys.stdout
+    try:
+        report = asyncio.run(run_batch(prompts, output, args.concurrency))
+    finally:
+        if output is not sys.stdout:
+            output.close()
+
+    if args.report:
+        with open(args.report, "w") as file:
+            file.write(report.model_dump_json(indent=2))
+    else:
+        print(report.model_dump_json(indent=2), file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
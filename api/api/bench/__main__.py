@@ -0,0 +1,136 @@
+import argparse
+import asyncio
+import os
+import sys
+import tempfile
+
+# Set before anything reads the config: every run starts with empty caches of its own, and the
+# search and LLM rate limits are for Google's and OpenAI's sake, which the stand-ins don't need
+os.environ["CACHE_DIR"] = tempfile.mkdtemp(prefix="bench-cache-")
+os.environ["DATA_DIR"] = tempfile.mkdtemp(prefix="bench-data-")
+os.environ.setdefault("SEARCH_RATE_LIMIT_INITIAL_PER_MINUTE", "6000")
+os.environ.setdefault("SEARCH_RATE_LIMIT_MAX_PER_MINUTE", "6000")
+os.environ.setdefault("SEARCH_RATE_LIMIT_BURST", "100")
+os.environ.setdefault("LLM_TOKENS_PER_MINUTE", "100000000")
+os.environ.setdefault("LLM_REQUESTS_PER_MINUTE", "1000000")
+# The made-up papers aren't about any of the prompts, they'd all be skipped as irrelevant
+os.environ.setdefault("RELEVANCE_FILTER_ENABLED", "false")
+# Prompts repeat once there are more researches than prompts, and each one should be run
+os.environ.setdefault("RESEARCH_REUSE_ENABLED", "false")
+
+from api.bench.measure import ImportProfile, SnapshotEncoding  # noqa: E402
+from api.bench.scenarios import SCENARIOS, BenchReport, BenchSettings, run_scenario_async  # noqa: E402
+from api.telemetry.logs import configure_logging  # noqa: E402
+
+# Lower is better for all of them
+REGRESSION_METRICS = [
+    ("time_to_first_paper", "p50"),
+    ("time_to_first_paper", "p90"),
+    ("latency", "p50"),
+    ("latency", "p90"),
+    ("peak_rss_bytes", None),
+    ("startup", "seconds"),
+    ("snapshot_encoding", "cached_last_us"),
+]
+
+
+def find_startup_problems(startup: ImportProfile, max_import_seconds: float) -> list[str]:
+    problems = [f"{module} is imported at start-up" for module in startup.eager]
+    if max_import_seconds > 0 and startup.seconds > max_import_seconds:
+        slowest = ", ".join(f"{name} {seconds:.3f}s" for name, seconds in startup.slowest.items())
+        problems.append(
+            f"Importing the app took {startup.seconds:.3f}s, over the {max_import_seconds:.3f}s budget ({slowest})"
+        )
+    return problems
+
+
+def find_snapshot_problems(snapshot_encoding: SnapshotEncoding) -> list[str]:
+    # The UI reads the snapshots, they have to be exactly what they were before they were cached
+    if snapshot_encoding.identical:
+        return []
+    return ["Snapshots encoded from cached papers differ from model_dump_json()"]
+
+
+def find_regressions(
+    report: BenchReport, baseline: BenchReport, max_regression: float
+) -> list[str]:
+    regressions = []
+    for metric, percentile in REGRESSION_METRICS:
+        value, baseline_value = getattr(report, metric), getattr(baseline, metric)
+        if percentile is not None:
+            value, baseline_value = getattr(value, percentile), getattr(baseline_value, percentile)
+            metric = f"{metric}.{percentile}"
+        if baseline_value > 0 and value > baseline_value * (1 + max_regression):
+            regressions.append(
+                f"{metric}: {value:.3f} vs {baseline_value:.3f} (+{(value / baseline_value - 1):.0%})"
+            )
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Benchmark research end to end against local stand-ins for OpenAI, Google and paper hosts"
+    )
+    parser.add_argument("scenario", choices=list(SCENARIOS))
+    for name, field in BenchSettings.model_fields.items():
+        parser.add_argument(
+            f"--{name.replace('_', '-')}", type=field.annotation, default=field.default
+        )
+    parser.add_argument("-o", "--output", help="Where to write the report (default: stdout)")
+    parser.add_argument(
+        "--baseline", help="A previous report, exits with an error if this run is slower"
+    )
+    parser.add_argument(
+        "--max-regression",
+        type=float,
+        default=0.2,
+        help="How much worse than the baseline is tolerated, as a fraction",
+    )
+    parser.add_argument(
+        "--max-import-seconds",
+        type=float,
+        default=1.0,
+        help="Exits with an error if importing the app takes longer, or imports what should wait (0 for no budget)",
+    )
+    parser.add_argument(
+        "-v", "--verbose", action="store_true", help="Show the app's own logging"
+    )
+    args = parser.parse_args()
+
+    settings = BenchSettings(
+        **{name: getattr(args, name) for name in BenchSettings.model_fields}
+    )
+    configure_logging("INFO" if args.verbose else "ERROR")
+    report = asyncio.run(run_scenario_async(args.scenario, settings))
+    report.startup = ImportProfile.of()
+
+    if args.output:
+        with open(args.output, "w") as file:
+            file.write(report.model_dump_json(indent=2))
+    else:
+        print(report.model_dump_json(indent=2))
+
+    problems = find_startup_problems(report.startup, args.max_import_seconds)
+    for problem in problems:
+        print("Start-up:", problem, file=sys.stderr)
+    for problem in find_snapshot_problems(report.snapshot_encoding):
+        print("Snapshots:", problem, file=sys.stderr)
+        problems.append(problem)
+
+    if args.baseline:
+        with open(args.baseline) as file:
+            baseline = BenchReport.model_validate_json(file.read())
+        if baseline.scenario != report.scenario or baseline.settings != report.settings:
+            print("Baseline was run with different settings, comparing anyway", file=sys.stderr)
+
+        regressions = find_regressions(report, baseline, args.max_regression)
+        for regression in regressions:
+            print("Regression:", regression, file=sys.stderr)
+        problems += regressions
+
+    if problems:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
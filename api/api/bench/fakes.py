@@ -0,0 +1,203 @@
+import asyncio
+import json
+import math
+import random
+import re
+from typing import AsyncIterator
+
+import httpx
+import openai
+
+from api.llm.openai_client import OpenAIClientWrapper, OpenAIModel, OpenAIParams
+from api.llm.prompt_builder import Prompt
+from api.llm.tokens import get_token_counter
+from api.research.web_searcher import SearchThrottledError, WebSearcher
+
+SEARCH_TERM_COUNT = re.compile(r"generate exactly (\d+) search terms")
+USER_TOPIC = re.compile(r"User topic: (.*)")
+RESPONSE_TOKEN = re.compile(r"\S+\s*|\s+")
+PAPER_TITLE = re.compile(r"^(.*?\(\d+\))")
+BATCHED_PAPER = re.compile(r'<paper id="(\d+)">\n(.*?)\n</paper>', re.DOTALL)
+PUBLISHER = "Proceedings of the Conference on Benchmarking"
+
+
+class Latency:
+    # Lognormal around `median`, long-tailed like the real thing. A `spread` of 0 makes it constant.
+
+    def __init__(self, median: float, spread: float = 0.5):
+        self.median = median
+        self.spread = spread
+
+    def sample(self, rng: random.Random) -> float:
+        if self.median <= 0:
+            return 0
+        return self.median * math.exp(rng.gauss(0, self.spread))
+
+    def __repr__(self) -> str:
+        return f"{self.median}:{self.spread}"
+
+
+class FakeOpenAIError(openai.APIConnectionError):
+    # The kind of error worth trying again, as a dropped connection would be
+
+    def __init__(self, message: str):
+        super().__init__(
+            message=message,
+            request=httpx.Request("POST", "http://fake-openai/v1/chat/completions"),
+        )
+
+
+class FakeOpenAIClientWrapper(OpenAIClientWrapper):
+    # Answers the prompts this app actually sends (search terms and paper summaries) with plausible
+    # responses, taking about as long as OpenAI would: a wait for the first token, then a steady stream
+
+    def __init__(
+        self,
+        *,
+        first_token_latency: Latency = Latency(0.5),
+        seconds_per_token: float = 0.01,
+        error_rate: float = 0.0,
+        summary_words: int = 80,
+        seed: int = 0,
+    ):
+        self.first_token_latency = first_token_latency
+        self.seconds_per_token = seconds_per_token
+        self.error_rate = error_rate
+        self.summary_words = summary_words
+        self.rng = random.Random(seed)
+        self.token_counter = get_token_counter(OpenAIModel.GPT_3_5_TURBO_0125)
+
+        self.calls = 0
+        self.errors = 0
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
+
+    def stats(self) -> dict:
+        return {
+            "calls": self.calls,
+            "errors": self.errors,
+            "prompt_tokens": self.prompt_tokens,
+            "completion_tokens": self.completion_tokens,
+        }
+
+    def _search_terms(self, prompt: Prompt) -> str:
+        content = "\n".join(message.content for message in prompt.messages)
+        count = SEARCH_TERM_COUNT.search(content)
+        topic = USER_TOPIC.search(content)
+        topic = topic.group(1).strip('"') if topic else "science"
+        return "\n".join(
+            f"{topic} {self.rng.choice(['papers', 'survey', 'recent advances', 'methods', 'benchmarks'])} {i}"
+            for i in range(int(count.group(1)) if count else 10)
+        )
+
+    def _summarize(self, text: str) -> tuple[str, str]:
+        # Condensed text starts with the title page. The corpus numbers its titles, which is
+        # where the title stops and the authors start.
+        first_line = text.strip().split("\n", 1)[0]
+        title = PAPER_TITLE.match(first_line)
+        title = title.group(1) if title else " ".join(first_line.split()[:12])
+        words = [word for word in text.split() if word.isalpha()] or ["summary"]
+        summary = " ".join(self.rng.choice(words) for _ in range(self.summary_words))
+        return title or "Untitled", summary
+
+    def _paper_summary(self, prompt: Prompt) -> str:
+        text = prompt.messages[-1].content.split("Paper text:", 1)[1]
+        title, summary = self._summarize(text.split("Instructions:", 1)[0])
+        return (
+            f"title: |\n    {title}\nsummary: |\n    {summary}\n"
+            f"publisher: |\n    {PUBLISHER}\n"
+        )
+
+    def _batched_paper_summaries(self, prompt: Prompt) -> str:
+        papers = []
+        for id, text in BATCHED_PAPER.findall(prompt.messages[-1].content):
+            title, summary = self._summarize(text)
+            papers.append(
+                {"id": int(id), "title": title, "summary": summary, "publisher": PUBLISHER}
+            )
+        return json.dumps({"papers": papers})
+
+    def _respond(self, prompt: Prompt) -> str:
+        self.calls += 1
+        self.prompt_tokens += sum(
+            self.token_counter.count(message.content) for message in prompt.messages
+        )
+        if "search terms" in prompt.messages[0].content:
+            return self._search_terms(prompt)
+        if "Paper text:" in prompt.messages[-1].content:
+            return self._paper_summary(prompt)
+        if '<paper id="' in prompt.messages[-1].content:
+            return self._batched_paper_summaries(prompt)
+        return "OK"
+
+    async def _first_token_async(self):
+        await asyncio.sleep(self.first_token_latency.sample(self.rng))
+        if self.rng.random() < self.error_rate:
+            self.errors += 1
+            raise FakeOpenAIError("Fake OpenAI error")
+
+    async def get_completion_async(
+        self, model: OpenAIModel, prompt: Prompt, params: OpenAIParams = OpenAIParams()
+    ) -> str:
+        response = self._respond(prompt)
+        await self._first_token_async()
+        tokens = RESPONSE_TOKEN.findall(response)
+        self.completion_tokens += len(tokens)
+        await asyncio.sleep(len(tokens) * self.seconds_per_token)
+        return response
+
+    async def stream_completion_async(
+        self, model: OpenAIModel, prompt: Prompt, params: OpenAIParams = OpenAIParams()
+    ) -> AsyncIterator[str]:
+        response = self._respond(prompt)
+        await self._first_token_async()
+        for token in RESPONSE_TOKEN.findall(response):
+            self.completion_tokens += 1
+            yield token
+            await asyncio.sleep(self.seconds_per_token)
+
+
+class FakeWebSearcher(WebSearcher):
+    # Results are picked from `urls` by the query, so the same query always finds the same papers.
+    # Papers near the front of `urls` turn up more often, like well-cited papers do.
+
+    def __init__(
+        self,
+        urls: list[str],
+        *,
+        latency: Latency = Latency(1.0),
+        seconds_per_result: float = 0.05,
+        error_rate: float = 0.0,
+        seed: int = 0,
+    ):
+        self.urls = urls
+        self.latency = latency
+        self.seconds_per_result = seconds_per_result
+        self.error_rate = error_rate
+        self.seed = seed
+        self.rng = random.Random(seed)
+        self.weights = [1 / (rank + 1) ** 0.8 for rank in range(len(urls))]
+
+        self.searches = 0
+        self.errors = 0
+
+    def stats(self) -> dict:
+        return {"searches": self.searches, "errors": self.errors}
+
+    def _pick_urls(self, query: str, n: int) -> list[str]:
+        rng = random.Random(f"{self.seed}:{query}")
+        picked: dict[str, None] = {}
+        while len(picked) < min(n, len(self.urls)):
+            picked[rng.choices(self.urls, self.weights)[0]] = None
+        return list(picked)
+
+    async def top_urls_async(self, query: str, n: int = 10) -> AsyncIterator[str]:
+        self.searches += 1
+        await asyncio.sleep(self.latency.sample(self.rng))
+        if self.rng.random() < self.error_rate:
+            self.errors += 1
+            raise SearchThrottledError("Fake search throttled")
+
+        for url in self._pick_urls(query, n):
+            await asyncio.sleep(self.seconds_per_result)
+            yield url
@@ -0,0 +1,198 @@
+import asyncio
+import gc
+import os
+import re
+import resource
+import subprocess
+import sys
+import time
+
+from api.types import Paper, Research, ResearchSnapshot, Search
+from pydantic import BaseModel
+
+
+class Percentiles(BaseModel):
+    count: int = 0
+    mean: float = 0
+    p50: float = 0
+    p90: float = 0
+    p99: float = 0
+    max: float = 0
+
+    @classmethod
+    def of(cls, values: list[float]) -> "Percentiles":
+        if not values:
+            return cls()
+        ordered = sorted(values)
+
+        def _percentile(p: float) -> float:
+            # Nearest rank, good enough for the number of samples we get
+            return ordered[min(len(ordered) - 1, int(p / 100 * len(ordered)))]
+
+        return cls(
+            count=len(ordered),
+            mean=sum(ordered) / len(ordered),
+            p50=_percentile(50),
+            p90=_percentile(90),
+            p99=_percentile(99),
+            max=ordered[-1],
+        )
+
+
+# Slow to import and not needed until the app does something, so starting it mustn't import them
+LAZY_MODULES = ("openai", "pypdf", "yaml", "aiostream", "googlesearch")
+
+# "import time: <self us> | <cumulative us> | <indented module name>", from `python -X importtime`
+IMPORT_TIME_LINE = re.compile(r"^import time:\s*(\d+) \|\s*(\d+) \| (\s*)(\S+)$")
+
+
+class ImportProfile(BaseModel):
+    # How long a fresh interpreter takes to import the app, the best of a few tries
+    seconds: float = 0
+    # The packages that took longest, cumulative seconds each
+    slowest: dict[str, float] = {}
+    # Any of `LAZY_MODULES` that were imported anyway
+    eager: list[str] = []
+
+    @classmethod
+    def of(cls, module: str = "api.app", runs: int = 3) -> "ImportProfile":
+        # The package's parent, so the interpreter finds it whatever the working directory
+        package_root = os.path.dirname(os.path.dirname(os.path.dirname(__file__)))
+        env = {**os.environ, "PYTHONPATH": package_root}
+        check_eager = (
+            f"import sys, {module}; "
+            f"print(','.join(m for m in {LAZY_MODULES!r} if m in sys.modules))"
+        )
+
+        best = None
+        for _ in range(max(1, runs)):
+            result = subprocess.run(
+                [sys.executable, "-X", "importtime", "-c", check_eager],
+                env=env,
+                capture_output=True,
+                text=True,
+                check=True,
+            )
+            packages: dict[str, float] = {}
+            seconds = 0.0
+            for line in result.stderr.splitlines():
+                match = IMPORT_TIME_LINE.match(line)
+                if match is None:
+                    continue
+                cumulative = int(match.group(2)) / 1_000_000
+                name = match.group(4)
+                if name == module:
+                    seconds = cumulative
+                elif "." not in name and match.group(3):
+                    # Indented, i.e. imported by the app rather than by the interpreter starting up
+                    packages[name] = max(packages.get(name, 0.0), cumulative)
+
+            if best is None or seconds < best.seconds:
+                slowest = sorted(packages.items(), key=lambda item: item[1], reverse=True)
+                best = cls(
+                    seconds=seconds,
+                    slowest=dict(slowest[:10]),
+                    eager=[m for m in result.stdout.strip().split(",") if m],
+                )
+        return best
+
+
+class SnapshotEncoding(BaseModel):
+    # Encoding the snapshot sent after every update, replayed on a research rebuilt a paper at a time:
+    # each paper is added with half its summary, then updated with the rest, like a streamed summary.
+    # Median microseconds per update over the first and the last quarter of the updates, from cached
+    # paper fragments (`dump_json()`) and from scratch (`model_dump_json()`). Cached should stay flat.
+    papers: int = 0
+    cached_first_us: float = 0
+    cached_last_us: float = 0
+    uncached_first_us: float = 0
+    uncached_last_us: float = 0
+    # Whether the two came out byte for byte the same every time
+    identical: bool = True
+
+    @classmethod
+    def of(cls, research: Research) -> "SnapshotEncoding":
+        rebuilt = Research(id=research.id, prompt=research.prompt, searches=[])
+        cached: list[float] = []
+        uncached: list[float] = []
+        identical = True
+
+        def _encode():
+            nonlocal identical
+            snapshot = ResearchSnapshot(order=len(cached), research=rebuilt)
+            started = time.perf_counter()
+            data = snapshot.dump_json()
+            cached.append((time.perf_counter() - started) * 1_000_000)
+            started = time.perf_counter()
+            expected = snapshot.model_dump_json()
+            uncached.append((time.perf_counter() - started) * 1_000_000)
+            identical = identical and data == expected
+
+        papers = 0
+        # A collection in the middle of one would be most of what's measured
+        gc_enabled = gc.isenabled()
+        gc.disable()
+        try:
+            for search in research.searches:
+                rebuilt_search = Search(query=search.query, papers=[])
+                rebuilt.searches.append(rebuilt_search)
+                for paper in search.papers:
+                    # A paper of its own, nothing encoded yet
+                    rebuilt_paper = Paper.model_validate(paper.model_dump())
+                    rebuilt_paper.summary = paper.summary[: len(paper.summary) // 2]
+                    rebuilt_search.papers.append(rebuilt_paper)
+                    _encode()
+                    rebuilt_paper.summary = paper.summary
+                    _encode()
+                    papers += 1
+        finally:
+            if gc_enabled:
+                gc.enable()
+
+        quarter = max(1, len(cached) // 4)
+        return cls(
+            papers=papers,
+            cached_first_us=Percentiles.of(cached[:quarter]).p50,
+            cached_last_us=Percentiles.of(cached[-quarter:]).p50,
+            uncached_first_us=Percentiles.of(uncached[:quarter]).p50,
+            uncached_last_us=Percentiles.of(uncached[-quarter:]).p50,
+            identical=identical,
+        )
+
+
+def peak_rss_bytes(who: int = resource.RUSAGE_SELF) -> int:
+    # For `RUSAGE_CHILDREN` it's the largest child that's finished and been waited for
+    peak = resource.getrusage(who).ru_maxrss
+    # Linux reports kilobytes, macOS bytes
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+class LoopLagMonitor:
+    # How late the event loop gets round to a callback that should run every `interval` seconds.
+    # Anything that blocks the loop (parsing, serializing, a slow callback) delays every stream at once.
+
+    def __init__(self, interval: float = 0.01):
+        self.interval = interval
+        self.lags: list[float] = []
+        self._task: asyncio.Task | None = None
+
+    async def _run_async(self):
+        while True:
+            started = time.monotonic()
+            await asyncio.sleep(self.interval)
+            self.lags.append(max(0.0, time.monotonic() - started - self.interval))
+
+    def start(self):
+        self._task = asyncio.create_task(self._run_async())
+
+    async def stop_async(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def stats(self) -> Percentiles:
+        return Percentiles.of(self.lags)
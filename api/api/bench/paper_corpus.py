@@ -0,0 +1,133 @@
+import random
+import textwrap
+
+# Enough words to make text that doesn't compress or repeat suspiciously, none of them section headings
+WORDS = """
+accuracy adaptive agent algorithm analysis approach architecture assumption attention baseline
+benchmark bias boundary calibration capacity causal channel classifier cluster coefficient cohort
+compression constraint contrast convergence correlation cost coverage dataset decoder density
+dependency deployment distribution domain dynamics efficiency embedding empirical encoder energy
+ensemble entropy estimate evaluation evidence feature fidelity framework frequency function gradient
+graph heuristic hypothesis inference information interaction interval kernel label latency layer
+likelihood linear manifold margin matrix measurement mechanism memory metric model module network
+noise objective observation optimization parameter pattern performance policy population posterior
+precision prediction prior probability protocol quality quantity random rate regression
+representation resolution robustness sample scale scheme score sensitivity sequence signal
+simulation sparse spectrum stability statistic structure supervision surface system temporal
+tensor theory threshold throughput token topology trajectory transfer transform uncertainty
+validation variance vector weight
+""".split()
+
+AUTHOR_FIRST_NAMES = "Ada Alan Barbara Claude Donald Edsger Frances Grace John Katherine Leslie Radia".split()
+AUTHOR_LAST_NAMES = "Allen Chen Dijkstra Hopper Johnson Knuth Lamport Liskov Lovelace Perlman Shannon Turing".split()
+
+RUNNING_HEADER = "Proceedings of the Conference on Benchmarking 2024"
+
+LINE_CHARS = 90
+LINES_PER_PAGE = 52
+
+
+class PaperCorpus:
+    # Deterministic made-up papers, laid out like the real thing as far as text extraction cares:
+    # a title page, the usual sections, running headers and page numbers, and a long reference list
+
+    def __init__(self, size: int, min_pages: int = 2, max_pages: int = 24, seed: int = 0):
+        self.size = size
+        self.min_pages = min_pages
+        self.max_pages = max_pages
+        self.seed = seed
+
+    def title(self, index: int) -> str:
+        rng = random.Random(f"{self.seed}:title:{index}")
+        words = rng.sample(WORDS, 5)
+        return f"{words[0].title()} {words[1].title()} for {words[2]} {words[3]} {words[4]} ({index})"
+
+    def _sentence(self, rng: random.Random) -> str:
+        words = rng.choices(WORDS, k=rng.randint(8, 20))
+        return " ".join(words).capitalize() + "."
+
+    def _paragraph(self, rng: random.Random) -> list[str]:
+        text = " ".join(self._sentence(rng) for _ in range(rng.randint(3, 7)))
+        return textwrap.wrap(text, LINE_CHARS) + [""]
+
+    def _section(self, rng: random.Random, heading: str, paragraphs: int) -> list[str]:
+        lines = [heading]
+        for _ in range(paragraphs):
+            lines += self._paragraph(rng)
+        return lines
+
+    def pages(self, index: int) -> list[str]:
+        rng = random.Random(f"{self.seed}:paper:{index}")
+        page_count = rng.randint(self.min_pages, self.max_pages)
+        # Roughly a page's worth of lines for every page, whatever the sections end up being
+        body_paragraphs = max(1, page_count * LINES_PER_PAGE // 8)
+
+        authors = [
+            f"{rng.choice(AUTHOR_FIRST_NAMES)} {rng.choice(AUTHOR_LAST_NAMES)}"
+            for _ in range(rng.randint(1, 4))
+        ]
+        lines = [self.title(index), ", ".join(authors), ""]
+        lines += self._section(rng, "Abstract", 1)
+        lines += self._section(rng, "1 Introduction", max(1, body_paragraphs // 6))
+        lines += self._section(rng, "2 Related Work", max(1, body_paragraphs // 6))
+        lines += self._section(rng, "3 Methods", max(1, body_paragraphs // 4))
+        lines += self._section(rng, "4 Results", max(1, body_paragraphs // 4))
+        lines += self._section(rng, "5 Conclusion", 1)
+        lines += ["References"]
+        for i in range(rng.randint(10, 40)):
+            lines += textwrap.wrap(
+                f"[{i + 1}] {rng.choice(AUTHOR_LAST_NAMES)} et al. {self._sentence(rng)} {rng.randint(1990, 2024)}.",
+                LINE_CHARS,
+            )
+
+        pages = []
+        for number, start in enumerate(range(0, len(lines), LINES_PER_PAGE), 1):
+            page = lines[start : start + LINES_PER_PAGE]
+            # Like most papers, the title page has no running header
+            if number > 1:
+                page = [RUNNING_HEADER, ""] + page
+            pages.append("\n".join(page + ["", str(number)]))
+        return pages
+
+    def pdf(self, index: int) -> bytes:
+        return make_pdf(self.pages(index))
+
+
+def _escape_pdf_text(text: str) -> str:
+    return text.replace("\\", "\\\\").replace("(", "\\(").replace(")", "\\)")
+
+
+def make_pdf(pages: list[str]) -> bytes:
+    # The smallest valid PDF that puts each line of text on its own line of the page
+    objects = [
+        b"<< /Type /Catalog /Pages 2 0 R >>",
+        (
+            "<< /Type /Pages /Kids ["
+            + " ".join(f"{4 + 2 * i} 0 R" for i in range(len(pages)))
+            + f"] /Count {len(pages)} >>"
+        ).encode(),
+        b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>",
+    ]
+    for i, page in enumerate(pages):
+        content = (
+            "BT /F1 9 Tf 40 770 Td 13 TL "
+            + " ".join(f"({_escape_pdf_text(line)}) '" for line in page.split("\n"))
+            + " ET"
+        ).encode()
+        objects.append(
+            f"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 792] /Resources << /Font << /F1 3 0 R >> >> /Contents {5 + 2 * i} 0 R >>".encode()
+        )
+        objects.append(b"<< /Length %d >>\nstream\n" % len(content) + content + b"\nendstream")
+
+    pdf = bytearray(b"%PDF-1.4\n")
+    offsets = []
+    for number, body in enumerate(objects, 1):
+        offsets.append(len(pdf))
+        pdf += f"{number} 0 obj\n".encode() + body + b"\nendobj\n"
+
+    xref_offset = len(pdf)
+    pdf += f"xref\n0 {len(objects) + 1}\n0000000000 65535 f \n".encode()
+    for offset in offsets:
+        pdf += f"{offset:010d} 00000 n \n".encode()
+    pdf += f"trailer\n<< /Size {len(objects) + 1} /Root 1 0 R >>\nstartxref\n{xref_offset}\n%%EOF\n".encode()
+    return bytes(pdf)
@@ -0,0 +1,204 @@
+import hashlib
+import multiprocessing
+import random
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from api.bench.fakes import Latency
+from api.bench.paper_corpus import PaperCorpus
+
+PAPER_PATH = re.compile(r"^/papers/(\d+)\.pdf$")
+
+# Written in chunks of this size, so `bytes_per_second` can be honoured
+WRITE_CHUNK_BYTES = 16 * 1024
+
+
+class _PaperServerState:
+    def __init__(
+        self,
+        corpus: PaperCorpus,
+        latency: Latency,
+        error_rate: float,
+        html_rate: float,
+        bytes_per_second: int,
+        seed: int,
+    ):
+        self.corpus = corpus
+        self.latency = latency
+        self.error_rate = error_rate
+        self.html_rate = html_rate
+        self.bytes_per_second = bytes_per_second
+        self.rng = random.Random(seed)
+        self.lock = threading.Lock()
+        self.pdfs: dict[int, tuple[bytes, str]] = {}
+
+        self.requests = 0
+        self.not_modified = 0
+        self.errors = 0
+        self.html = 0
+        self.bytes_sent = 0
+
+    def pdf(self, index: int) -> tuple[bytes, str]:
+        with self.lock:
+            if index not in self.pdfs:
+                pdf = self.corpus.pdf(index)
+                self.pdfs[index] = pdf, hashlib.sha256(pdf).hexdigest()[:16]
+            return self.pdfs[index]
+
+    def stats(self) -> dict:
+        return {
+            "requests": self.requests,
+            "not_modified": self.not_modified,
+            "errors": self.errors,
+            "html": self.html,
+            "bytes_sent": self.bytes_sent,
+        }
+
+
+def _handler(state: _PaperServerState):
+    class PaperRequestHandler(BaseHTTPRequestHandler):
+        # Keep-alive, like a real host, so the downloader's connection pool is exercised
+        protocol_version = "HTTP/1.1"
+
+        def log_message(self, format, *args):
+            pass
+
+        def _send(self, status: int, content_type: str, body: bytes, headers: dict | None = None):
+            self.send_response(status)
+            self.send_header("Content-Type", content_type)
+            self.send_header("Content-Length", str(len(body)))
+            for name, value in (headers or {}).items():
+                self.send_header(name, value)
+            self.end_headers()
+
+            for start in range(0, len(body), WRITE_CHUNK_BYTES):
+                chunk = body[start : start + WRITE_CHUNK_BYTES]
+                self.wfile.write(chunk)
+                if state.bytes_per_second > 0:
+                    time.sleep(len(chunk) / state.bytes_per_second)
+            with state.lock:
+                state.bytes_sent += len(body)
+
+        def do_GET(self):
+            with state.lock:
+                state.requests += 1
+                delay = state.latency.sample(state.rng)
+                roll = state.rng.random()
+            time.sleep(delay)
+
+            match = PAPER_PATH.match(self.path)
+            if match is None or int(match.group(1)) >= state.corpus.size:
+                self._send(404, "text/plain", b"Not found")
+                return
+
+            if roll < state.error_rate:
+                with state.lock:
+                    state.errors += 1
+                self._send(500, "text/plain", b"Internal server error")
+                return
+            if roll < state.error_rate + state.html_rate:
+                # A paywall or a cookie banner rather than the paper
+                with state.lock:
+                    state.html += 1
+                self._send(200, "text/html", b"<html><body>Sign in to read</body></html>")
+                return
+
+            pdf, etag = state.pdf(int(match.group(1)))
+            if self.headers.get("If-None-Match") == f'"{etag}"':
+                with state.lock:
+                    state.not_modified += 1
+                self.send_response(304)
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+                return
+
+            self._send(200, "application/pdf", pdf, {"ETag": f'"{etag}"'})
+
+    return PaperRequestHandler
+
+
+def _serve(connection, corpus: PaperCorpus, hosts: list[str], settings: dict):
+    state = _PaperServerState(corpus, **settings)
+    servers = []
+    for host in hosts:
+        try:
+            servers.append(ThreadingHTTPServer((host, 0), _handler(state)))
+        except OSError:
+            # Only Linux routes all of 127.0.0.0/8 to loopback out of the box
+            continue
+    if not servers:
+        servers.append(ThreadingHTTPServer(("127.0.0.1", 0), _handler(state)))
+
+    for server in servers:
+        server.daemon_threads = True
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+    connection.send(
+        [f"http://{server.server_address[0]}:{server.server_address[1]}" for server in servers]
+    )
+
+    # Until we're told to stop, then hand back what happened
+    connection.recv()
+    for server in servers:
+        server.shutdown()
+    connection.send(state.stats())
+
+
+class PaperServer:
+    # Serves a `PaperCorpus` over HTTP from its own process, so serving doesn't compete with the
+    # code being measured for the GIL. Several loopback addresses look like several hosts to the
+    # downloader, whose connections are limited per host.
+
+    def __init__(
+        self,
+        corpus: PaperCorpus,
+        *,
+        hosts: int = 4,
+        latency: Latency = Latency(0.2),
+        error_rate: float = 0.0,
+        html_rate: float = 0.0,
+        bytes_per_second: int = 0,
+        seed: int = 0,
+    ):
+        self.corpus = corpus
+        self.hosts = [f"127.0.0.{i + 1}" for i in range(max(1, hosts))]
+        self.settings = {
+            "latency": latency,
+            "error_rate": error_rate,
+            "html_rate": html_rate,
+            "bytes_per_second": bytes_per_second,
+            "seed": seed,
+        }
+        self.base_urls: list[str] = []
+        self._connection = None
+        self._process = None
+        self._stats: dict = {}
+
+    def start(self):
+        context = multiprocessing.get_context("spawn")
+        self._connection, child_connection = context.Pipe()
+        self._process = context.Process(
+            target=_serve,
+            args=(child_connection, self.corpus, self.hosts, self.settings),
+            daemon=True,
+        )
+        self._process.start()
+        self.base_urls = self._connection.recv()
+
+    def urls(self) -> list[str]:
+        return [
+            f"{self.base_urls[i % len(self.base_urls)]}/papers/{i}.pdf"
+            for i in range(self.corpus.size)
+        ]
+
+    def stop(self):
+        if self._process is None:
+            return
+        self._connection.send("stop")
+        self._stats = self._connection.recv()
+        self._process.join()
+        self._process = None
+
+    def stats(self) -> dict:
+        return self._stats
@@ -0,0 +1,323 @@
+import asyncio
+import logging
+import re
+import resource
+import time
+from typing import Awaitable, Callable
+from urllib.parse import urlencode
+
+from aiostream import stream
+from api.bench.fakes import (
+    FakeOpenAIClientWrapper,
+    FakeWebSearcher,
+    Latency,
+)
+from api.bench.measure import (
+    ImportProfile,
+    LoopLagMonitor,
+    Percentiles,
+    SnapshotEncoding,
+    peak_rss_bytes,
+)
+from api.bench.paper_corpus import PaperCorpus
+from api.bench.paper_server import PaperServer
+from api.app import app
+from api.container import AppContainer
+from api.types import Research, ResearchStatus
+from pydantic import BaseModel, Field
+
+logger = logging.getLogger(__name__)
+
+PROMPTS = [
+    "I'm interested in quantum computing and cryptography",
+    "Effects of microplastics on marine ecosystems",
+    "Large language models for code generation",
+    "CRISPR gene editing in crop science",
+    "Battery chemistry for grid-scale energy storage",
+    "Sleep and memory consolidation",
+    "Graph neural networks for drug discovery",
+    "Urban heat islands and city planning",
+    "Dark matter detection experiments",
+    "Reinforcement learning for robotics",
+    "Antibiotic resistance in hospitals",
+    "Economics of remote work",
+]
+
+SSE_EVENT_ID = re.compile(rb"id: (.+):-?\d+\r?\n")
+
+
+class BenchSettings(BaseModel):
+    # Everything that shapes a run, so reports can be compared knowing they measured the same thing
+    researches: int = 8
+    concurrency: int = 4
+    corpus_size: int = 200
+    min_pages: int = 2
+    max_pages: int = 24
+    # Medians in seconds, every latency is lognormal with this spread
+    latency_spread: float = 0.5
+    llm_latency: float = 0.5
+    llm_seconds_per_token: float = 0.01
+    llm_error_rate: float = 0.0
+    search_latency: float = 1.0
+    search_error_rate: float = 0.0
+    paper_latency: float = 0.2
+    paper_error_rate: float = 0.02
+    paper_html_rate: float = 0.02
+    paper_bytes_per_second: int = 0
+    paper_hosts: int = 4
+    seed: int = 0
+
+
+class ResearchRun(BaseModel):
+    prompt: str
+    completed: bool
+    seconds: float
+    first_paper_seconds: float | None = None
+    papers: int = 0
+    bytes_streamed: int = 0
+    # What it came up with, for measuring how it's encoded (not part of the report)
+    research: Research | None = Field(default=None, exclude=True)
+
+
+class BenchReport(BaseModel):
+    scenario: str
+    settings: BenchSettings
+    researches: int
+    completed: int
+    failed: int
+    papers: int
+    seconds: float
+    time_to_first_paper: Percentiles
+    latency: Percentiles
+    bytes_streamed: int
+    event_loop_lag: Percentiles
+    peak_rss_bytes: int
+    # Largest child process, the PDF parser workers or the paper server
+    peak_child_rss_bytes: int
+    llm: dict
+    search: dict
+    paper_server: dict
+    app: dict
+    snapshot_encoding: SnapshotEncoding = SnapshotEncoding()
+    # Importing the app in a fresh interpreter, i.e. the start of every cold start
+    startup: ImportProfile = ImportProfile()
+
+
+class Bench:
+    # The app as it runs for real, except OpenAI, Google and the hosts papers are downloaded from
+    # are stand-ins on this machine with made-up (but realistic) latency and errors
+
+    def __init__(self, settings: BenchSettings, research_workers: int = 0):
+        self.settings = settings
+        self.research_workers = research_workers
+        spread = settings.latency_spread
+
+        self.corpus = PaperCorpus(
+            settings.corpus_size, settings.min_pages, settings.max_pages, settings.seed
+        )
+        self.paper_server = PaperServer(
+            self.corpus,
+            hosts=settings.paper_hosts,
+            latency=Latency(settings.paper_latency, spread),
+            error_rate=settings.paper_error_rate,
+            html_rate=settings.paper_html_rate,
+            bytes_per_second=settings.paper_bytes_per_second,
+            seed=settings.seed,
+        )
+        self.openai_client = FakeOpenAIClientWrapper(
+            first_token_latency=Latency(settings.llm_latency, spread),
+            seconds_per_token=settings.llm_seconds_per_token,
+            error_rate=settings.llm_error_rate,
+            seed=settings.seed,
+        )
+        self.web_searcher: FakeWebSearcher | None = None
+        self.container: AppContainer | None = None
+
+    async def __aenter__(self) -> "Bench":
+        await asyncio.to_thread(self.paper_server.start)
+        self.web_searcher = FakeWebSearcher(
+            self.paper_server.urls(),
+            latency=Latency(self.settings.search_latency, self.settings.latency_spread),
+            error_rate=self.settings.search_error_rate,
+            seed=self.settings.seed,
+        )
+        self.container = AppContainer(
+            self.research_workers,
+            openai_client_wrapper=self.openai_client,
+            web_searcher=self.web_searcher,
+        )
+        await self.container.start_async()
+        # Worker process start-up isn't what we're here to measure
+        await self.container.pdf_text_parser_pool.warm_up_async()
+        return self
+
+    async def __aexit__(self, *args):
+        await self.container.aclose()
+        await asyncio.to_thread(self.paper_server.stop)
+
+
+async def _research_async(bench: Bench, prompt: str) -> ResearchRun:
+    started = time.monotonic()
+    first_paper_seconds = None
+    research = None
+    try:
+        async for research in bench.container.researcher.research_async(prompt):
+            if first_paper_seconds is None and any(
+                search.papers for search in research.searches
+            ):
+                first_paper_seconds = time.monotonic() - started
+    except Exception as e:
+        logger.error("Research failed: %s: %r", prompt, e)
+        return ResearchRun(prompt=prompt, completed=False, seconds=time.monotonic() - started)
+
+    return ResearchRun(
+        prompt=prompt,
+        completed=True,
+        seconds=time.monotonic() - started,
+        first_paper_seconds=first_paper_seconds,
+        papers=sum(len(search.papers) for search in research.searches) if research else 0,
+        research=research,
+    )
+
+
+async def _get_async(asgi_app, path: str, params: dict, on_body: Callable[[bytes], None]):
+    # Straight to the ASGI app, no server or HTTP client in between, and the body is seen
+    # chunk by chunk as it's sent, the way a browser would see it
+    done = asyncio.Event()
+    requested = False
+
+    async def _receive() -> dict:
+        nonlocal requested
+        if not requested:
+            requested = True
+            return {"type": "http.request", "body": b"", "more_body": False}
+        # The client only goes away once it has everything
+        await done.wait()
+        return {"type": "http.disconnect"}
+
+    async def _send(message: dict):
+        if message["type"] == "http.response.body":
+            on_body(message.get("body", b""))
+            if not message.get("more_body", False):
+                done.set()
+
+    scope = {
+        "type": "http",
+        "asgi": {"version": "3.0"},
+        "http_version": "1.1",
+        "method": "GET",
+        "scheme": "http",
+        "path": path,
+        "raw_path": path.encode(),
+        "root_path": "",
+        "query_string": urlencode(params).encode(),
+        "headers": [(b"host", b"bench"), (b"accept", b"text/event-stream")],
+        "client": ("127.0.0.1", 0),
+        "server": ("bench", 80),
+        "state": {},
+    }
+    await asgi_app(scope, _receive, _send)
+
+
+def _sse_scenario(protocol: str) -> Callable[[Bench, str], Awaitable[ResearchRun]]:
+    # Snapshots contain papers once there are any, deltas say when one's added
+    first_paper = b'"papers":[{' if protocol == "snapshot" else b'"type":"paper_added"'
+
+    async def _sse_research_async(bench: Bench, prompt: str) -> ResearchRun:
+        started = time.monotonic()
+        run = ResearchRun(prompt=prompt, completed=False, seconds=0)
+        research_id = None
+
+        def _on_body(body: bytes):
+            nonlocal research_id
+            run.bytes_streamed += len(body)
+            if research_id is None and (match := SSE_EVENT_ID.search(body)):
+                research_id = match.group(1).decode()
+            if run.first_paper_seconds is None and first_paper in body:
+                run.first_paper_seconds = time.monotonic() - started
+
+        await _get_async(
+            app, "/research/create", {"prompt": prompt, "protocol": protocol}, _on_body
+        )
+        run.seconds = time.monotonic() - started
+
+        if research_id is not None:
+            state = await bench.container.research_sessions.get_state_async(research_id)
+            if state is not None:
+                run.completed = state.status == ResearchStatus.COMPLETED
+                run.papers = sum(len(search.papers) for search in state.research.searches)
+                run.research = state.research
+        return run
+
+    return _sse_research_async
+
+
+SCENARIOS: dict[str, Callable[[Bench, str], Awaitable[ResearchRun]]] = {
+    # The pipeline on its own
+    "research": _research_async,
+    # The pipeline behind the API, through the job queue and the SSE stream the UI reads
+    "sse": _sse_scenario("snapshot"),
+    "sse-delta": _sse_scenario("delta"),
+}
+
+
+async def run_scenario_async(scenario: str, settings: BenchSettings) -> BenchReport:
+    run_research = SCENARIOS[scenario]
+    # Research through the API is run by the workers, research on its own doesn't need any
+    research_workers = settings.concurrency if scenario.startswith("sse") else 0
+    prompts = [PROMPTS[i % len(PROMPTS)] for i in range(settings.researches)]
+
+    async with Bench(settings, research_workers) as bench:
+        if scenario.startswith("sse"):
+            # What the lifespan would do, minus building its own container
+            app.state.container = bench.container
+
+        monitor = LoopLagMonitor()
+        monitor.start()
+        started = time.monotonic()
+        runs: list[ResearchRun] = []
+        results = stream.starmap(
+            stream.iterate([(bench, prompt) for prompt in prompts]),
+            run_research,
+            ordered=False,
+            task_limit=max(1, settings.concurrency),
+        )
+        async with results.stream() as streamer:
+            async for run in streamer:
+                runs.append(run)
+        seconds = time.monotonic() - started
+        await monitor.stop_async()
+        app_stats = bench.container.stats()
+
+    # The research with the most papers, where re-encoding all of them every time would cost most
+    researches = [run.research for run in runs if run.research is not None]
+    largest = max(
+        researches,
+        key=lambda research: sum(len(search.papers) for search in research.searches),
+        default=None,
+    )
+
+    return BenchReport(
+        scenario=scenario,
+        settings=settings,
+        researches=len(runs),
+        completed=sum(run.completed for run in runs),
+        failed=sum(not run.completed for run in runs),
+        papers=sum(run.papers for run in runs),
+        seconds=seconds,
+        time_to_first_paper=Percentiles.of(
+            [run.first_paper_seconds for run in runs if run.first_paper_seconds is not None]
+        ),
+        latency=Percentiles.of([run.seconds for run in runs]),
+        bytes_streamed=sum(run.bytes_streamed for run in runs),
+        event_loop_lag=monitor.stats(),
+        peak_rss_bytes=peak_rss_bytes(),
+        peak_child_rss_bytes=peak_rss_bytes(resource.RUSAGE_CHILDREN),
+        llm=bench.openai_client.stats(),
+        search=bench.web_searcher.stats(),
+        paper_server=bench.paper_server.stats(),
+        app=app_stats,
+        snapshot_encoding=(
+            SnapshotEncoding.of(largest) if largest is not None else SnapshotEncoding()
+        ),
+    )
@@ -0,0 +1,246 @@
+import abc
+import asyncio
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+
+class CacheStats:
+    def __init__(self):
+        self.hits = 0
+        self.misses = 0
+        self.sets = 0
+        self.evictions = 0
+
+    def record(self, hit: bool):
+        if hit:
+            self.hits += 1
+        else:
+            self.misses += 1
+
+    def to_dict(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "sets": self.sets,
+            "evictions": self.evictions,
+        }
+
+
+class CacheStore(abc.ABC):
+    def __init__(self):
+        self.stats = CacheStats()
+
+    @abc.abstractmethod
+    async def get_async(self, namespace: str, key: str) -> bytes | None:
+        pass
+
+    @abc.abstractmethod
+    async def set_async(self, namespace: str, key: str, value: bytes):
+        pass
+
+    @abc.abstractmethod
+    async def delete_async(self, namespace: str, key: str):
+        pass
+
+    async def close_async(self):
+        pass
+
+
+class LRUCacheStore(CacheStore):
+    def __init__(self, max_bytes: int):
+        super().__init__()
+        self.max_bytes = max_bytes
+        self.total_bytes = 0
+        self._entries: OrderedDict[tuple[str, str], bytes] = OrderedDict()
+
+    async def get_async(self, namespace: str, key: str) -> bytes | None:
+        value = self._entries.get((namespace, key))
+        self.stats.record(value is not None)
+        if value is not None:
+            self._entries.move_to_end((namespace, key))
+        return value
+
+    async def set_async(self, namespace: str, key: str, value: bytes):
+        await self.delete_async(namespace, key)
+        if len(value) > self.max_bytes:
+            # Would just evict everything else and then itself, don't bother
+            return
+
+        self._entries[(namespace, key)] = value
+        self.total_bytes += len(value)
+        self.stats.sets += 1
+
+        while self.total_bytes > self.max_bytes:
+            _, evicted = self._entries.popitem(last=False)
+            self.total_bytes -= len(evicted)
+            self.stats.evictions += 1
+
+    async def delete_async(self, namespace: str, key: str):
+        value = self._entries.pop((namespace, key), None)
+        if value is not None:
+            self.total_bytes -= len(value)
+
+
+class SQLiteCacheStore(CacheStore):
+    # Evict down to this fraction of max_bytes, so we aren't evicting on every single write
+    EVICTION_LOW_WATER_MARK = 0.9
+
+    def __init__(self, path: str, max_bytes: int):
+        super().__init__()
+        self.path = path
+        self.max_bytes = max_bytes
+        self._connection: sqlite3.Connection | None = None
+        self._lock = threading.Lock()
+        self._approx_total_bytes: int | None = None
+
+    def _connect(self) -> sqlite3.Connection:
+        if self._connection is None:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+
+            connection = sqlite3.connect(
+                self.path, check_same_thread=False, isolation_level=None
+            )
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            connection.execute(
+                """
+                CREATE TABLE IF NOT EXISTS cache_entries (
+                    namespace TEXT NOT NULL,
+                    key TEXT NOT NULL,
+                    value BLOB NOT NULL,
+                    size INTEGER NOT NULL,
+                    accessed_at REAL NOT NULL,
+                    PRIMARY KEY (namespace, key)
+                )
+                """
+            )
+            connection.execute(
+                "CREATE INDEX IF NOT EXISTS cache_entries_accessed_at ON cache_entries (accessed_at)"
+            )
+            self._connection = connection
+        return self._connection
+
+    def _get(self, namespace: str, key: str) -> bytes | None:
+        with self._lock:
+            connection = self._connect()
+            row = connection.execute(
+                "SELECT value FROM cache_entries WHERE namespace = ? AND key = ?",
+                (namespace, key),
+            ).fetchone()
+            if row is None:
+                return None
+
+            connection.execute(
+                "UPDATE cache_entries SET accessed_at = ? WHERE namespace = ? AND key = ?",
+                (time.time(), namespace, key),
+            )
+            return row[0]
+
+    def _set(self, namespace: str, key: str, value: bytes):
+        with self._lock:
+            connection = self._connect()
+            connection.execute(
+                "INSERT OR REPLACE INTO cache_entries (namespace, key, value, size, accessed_at) VALUES (?, ?, ?, ?, ?)",
+                (namespace, key, value, len(value), time.time()),
+            )
+
+            if self._approx_total_bytes is None:
+                self._approx_total_bytes = self._total_bytes(connection)
+            else:
+                self._approx_total_bytes += len(value)
+
+            if self._approx_total_bytes > self.max_bytes:
+                self._evict(connection)
+
+    def _total_bytes(self, connection: sqlite3.Connection) -> int:
+        return connection.execute(
+            "SELECT COALESCE(SUM(size), 0) FROM cache_entries"
+        ).fetchone()[0]
+
+    def _evict(self, connection: sqlite3.Connection):
+        # The running total is only an estimate (replaced keys, other processes), so recount first
+        total_bytes = self._total_bytes(connection)
+        target_bytes = self.max_bytes * self.EVICTION_LOW_WATER_MARK
+
+        while total_bytes > target_bytes:
+            rows = connection.execute(
+                "SELECT namespace, key, size FROM cache_entries ORDER BY accessed_at LIMIT 100"
+            ).fetchall()
+            if not rows:
+                break
+
+            for namespace, key, size in rows:
+                if total_bytes <= target_bytes:
+                    break
+                connection.execute(
+                    "DELETE FROM cache_entries WHERE namespace = ? AND key = ?",
+                    (namespace, key),
+                )
+                total_bytes -= size
+                self.stats.evictions += 1
+
+        self._approx_total_bytes = total_bytes
+
+    def _delete(self, namespace: str, key: str):
+        with self._lock:
+            self._connect().execute(
+                "DELETE FROM cache_entries WHERE namespace = ? AND key = ?",
+                (namespace, key),
+            )
+
+    async def get_async(self, namespace: str, key: str) -> bytes | None:
+        value = await asyncio.to_thread(self._get, namespace, key)
+        self.stats.record(value is not None)
+        return value
+
+    async def set_async(self, namespace: str, key: str, value: bytes):
+        await asyncio.to_thread(self._set, namespace, key, value)
+        self.stats.sets += 1
+
+    async def delete_async(self, namespace: str, key: str):
+        await asyncio.to_thread(self._delete, namespace, key)
+
+    async def close_async(self):
+        with self._lock:
+            if self._connection is not None:
+                self._connection.close()
+                self._connection = None
+
+
+class TieredCacheStore(CacheStore):
+    def __init__(self, tiers: list[CacheStore]):
+        super().__init__()
+        self.tiers = tiers
+
+    async def get_async(self, namespace: str, key: str) -> bytes | None:
+        for index, tier in enumerate(self.tiers):
+            value = await tier.get_async(namespace, key)
+            if value is not None:
+                # Promote to the faster tiers so the next lookup stops there
+                for faster_tier in self.tiers[:index]:
+                    await faster_tier.set_async(namespace, key, value)
+                self.stats.record(True)
+                return value
+
+        self.stats.record(False)
+        return None
+
+    async def set_async(self, namespace: str, key: str, value: bytes):
+        for tier in self.tiers:
+            await tier.set_async(namespace, key, value)
+        self.stats.sets += 1
+
+    async def delete_async(self, namespace: str, key: str):
+        for tier in self.tiers:
+            await tier.delete_async(namespace, key)
+
+    async def close_async(self):
+        for tier in self.tiers:
+            await tier.close_async()
@@ -7,19 +7,214 @@ SEARCH_TERMS_PER_RESEARCH = float(os.getenv("SEARCH_TERMS_PER_RESEARCH", 3))
 RESULTS_PER_SEARCH_TERM = float(os.getenv("RESULTS_PER_SEARCH_TERM", 10))
 GOOGLE_SEARCH_PAUSE_SECONDS = float(os.getenv("GOOGLE_SEARCH_PAUSE_SECONDS", 4))
 
-OPENAI_PAPER_TEXT_CONTEXT_LENGTH = float(
-    os.getenv("OPENAI_PAPER_TEXT_CONTEXT_LENGTH", 5000)
+# Adaptive rate limit shared by every search in the process, see `AdaptiveRateLimiter`
+SEARCH_RATE_LIMIT_INITIAL_PER_MINUTE = float(
+    os.getenv("SEARCH_RATE_LIMIT_INITIAL_PER_MINUTE", 10)
+)
+SEARCH_RATE_LIMIT_MIN_PER_MINUTE = float(os.getenv("SEARCH_RATE_LIMIT_MIN_PER_MINUTE", 1))
+SEARCH_RATE_LIMIT_MAX_PER_MINUTE = float(os.getenv("SEARCH_RATE_LIMIT_MAX_PER_MINUTE", 30))
+SEARCH_RATE_LIMIT_BURST = int(os.getenv("SEARCH_RATE_LIMIT_BURST", 3))
+SEARCH_RATE_LIMIT_INCREASE_PER_MINUTE = float(
+    os.getenv("SEARCH_RATE_LIMIT_INCREASE_PER_MINUTE", 1)
+)
+SEARCH_RATE_LIMIT_DECREASE_FACTOR = float(
+    os.getenv("SEARCH_RATE_LIMIT_DECREASE_FACTOR", 0.5)
+)
+SEARCH_RATE_LIMIT_TARGET_LATENCY_SECONDS = float(
+    os.getenv("SEARCH_RATE_LIMIT_TARGET_LATENCY_SECONDS", GOOGLE_SEARCH_PAUSE_SECONDS + 5)
+)
+SEARCH_RATE_LIMIT_BACKOFF_BASE_SECONDS = float(
+    os.getenv("SEARCH_RATE_LIMIT_BACKOFF_BASE_SECONDS", 5)
+)
+SEARCH_RATE_LIMIT_BACKOFF_MAX_SECONDS = float(
+    os.getenv("SEARCH_RATE_LIMIT_BACKOFF_MAX_SECONDS", 120)
+)
+SEARCH_RATE_LIMIT_CIRCUIT_BREAKER_THRESHOLD = int(
+    os.getenv("SEARCH_RATE_LIMIT_CIRCUIT_BREAKER_THRESHOLD", 3)
+)
+SEARCH_RATE_LIMIT_CIRCUIT_BREAKER_COOLDOWN_SECONDS = float(
+    os.getenv("SEARCH_RATE_LIMIT_CIRCUIT_BREAKER_COOLDOWN_SECONDS", 300)
+)
+
+# How many delta events between full snapshots in the delta streaming protocol
+SSE_DELTA_SNAPSHOT_INTERVAL = int(os.getenv("SSE_DELTA_SNAPSHOT_INTERVAL", 20))
+
+# How much text is extracted from a paper at most, before it's condensed
+PAPER_TEXT_MAX_CHARS = int(os.getenv("PAPER_TEXT_MAX_CHARS", 200_000))
+# Papers are scored against the prompt before they're summarized, see `api.research.relevance`.
+# Scores go from 0 to 1; papers under the threshold, or past the limit for the research, are skipped.
+RELEVANCE_FILTER_ENABLED = os.getenv("RELEVANCE_FILTER_ENABLED", "true").lower() == "true"
+RELEVANCE_THRESHOLD = float(os.getenv("RELEVANCE_THRESHOLD", 0.15))
+# 0 for no limit
+RELEVANCE_MAX_PAPERS_PER_RESEARCH = int(os.getenv("RELEVANCE_MAX_PAPERS_PER_RESEARCH", 20))
+# Only the first pages are scored, that's where a paper says what it's about
+RELEVANCE_FILTER_PAGES = int(os.getenv("RELEVANCE_FILTER_PAGES", 3))
+# About how many words (less stopwords) a page has, how long a paper's first pages are is judged against it
+RELEVANCE_WORDS_PER_PAGE = int(os.getenv("RELEVANCE_WORDS_PER_PAGE", 330))
+# How many tokens of (condensed) paper text go into the summary prompt
+OPENAI_PAPER_TEXT_TOKEN_BUDGET = int(os.getenv("OPENAI_PAPER_TEXT_TOKEN_BUDGET", 1500))
+# "streaming" shows papers as their summaries are written, "complete" waits for the whole summary,
+# "batched" summarizes several papers in one request and shows each one once its summary is done
+PAPER_SUMMARY_MODE = os.getenv("PAPER_SUMMARY_MODE", "streaming").lower()
+# Batched summaries: papers that turn up within the wait of each other share a request, as long as
+# their (condensed) text fits in the token budget
+PAPER_SUMMARY_BATCH_MAX_PAPERS = int(os.getenv("PAPER_SUMMARY_BATCH_MAX_PAPERS", 8))
+PAPER_SUMMARY_BATCH_TOKEN_BUDGET = int(os.getenv("PAPER_SUMMARY_BATCH_TOKEN_BUDGET", 6000))
+PAPER_SUMMARY_BATCH_WAIT_SECONDS = float(os.getenv("PAPER_SUMMARY_BATCH_WAIT_SECONDS", 0.1))
+# How often a summary that's being written is pushed to the client
+PAPER_SUMMARY_STREAM_UPDATE_INTERVAL_SECONDS = float(
+    os.getenv("PAPER_SUMMARY_STREAM_UPDATE_INTERVAL_SECONDS", 0.25)
 )
 OPENAI_DEFAULT_MAX_TOKENS = int(os.getenv("OPENAI_DEFAULT_MAX_TOKENS", 4000))
 OPENAI_DEFAULT_TEMPERATURE = float(os.getenv("OPENAI_TEMPERATURE", 0.1))
 OPENAI_DEFAULT_TOP_P = float(os.getenv("OPENAI_TOP_P", 0.8))
+OPENAI_MAX_CONNECTIONS = int(os.getenv("OPENAI_MAX_CONNECTIONS", 100))
+OPENAI_MAX_KEEPALIVE_CONNECTIONS = int(
+    os.getenv("OPENAI_MAX_KEEPALIVE_CONNECTIONS", 20)
+)
+
+# Every LLM call goes through a governor, see `api.llm.governor`. Calls are admitted against the
+# account's per-minute limits, bursting up to `LLM_RATE_BURST_SECONDS` worth at a time.
+LLM_GOVERNOR_ENABLED = os.getenv("LLM_GOVERNOR_ENABLED", "true").lower() == "true"
+LLM_TOKENS_PER_MINUTE = int(os.getenv("LLM_TOKENS_PER_MINUTE", 160_000))
+LLM_REQUESTS_PER_MINUTE = int(os.getenv("LLM_REQUESTS_PER_MINUTE", 3_500))
+LLM_RATE_BURST_SECONDS = float(os.getenv("LLM_RATE_BURST_SECONDS", 10))
+# What a completion is assumed to cost before it's known, corrected once it is
+LLM_COMPLETION_TOKENS_ESTIMATE = int(os.getenv("LLM_COMPLETION_TOKENS_ESTIMATE", 500))
+# How long a call gets in all, and how long a streamed one gets to start
+LLM_DEADLINE_SECONDS = float(os.getenv("LLM_DEADLINE_SECONDS", 90))
+LLM_FIRST_TOKEN_DEADLINE_SECONDS = float(os.getenv("LLM_FIRST_TOKEN_DEADLINE_SECONDS", 20))
+LLM_MAX_RETRIES = int(os.getenv("LLM_MAX_RETRIES", 3))
+LLM_RETRY_BASE_SECONDS = float(os.getenv("LLM_RETRY_BASE_SECONDS", 0.5))
+LLM_RETRY_MAX_SECONDS = float(os.getenv("LLM_RETRY_MAX_SECONDS", 8))
+# A call slower than this percentile of recent ones gets a duplicate sent, whichever answers first wins.
+# Not until there are enough recent calls to know, and never for more than a share of calls.
+LLM_HEDGE_ENABLED = os.getenv("LLM_HEDGE_ENABLED", "true").lower() == "true"
+LLM_HEDGE_PERCENTILE = float(os.getenv("LLM_HEDGE_PERCENTILE", 0.95))
+LLM_HEDGE_MIN_SAMPLES = int(os.getenv("LLM_HEDGE_MIN_SAMPLES", 20))
+LLM_HEDGE_MAX_RATE = float(os.getenv("LLM_HEDGE_MAX_RATE", 0.1))
+
+# Pre-open connections and start worker processes on startup
+APP_WARMUP_ENABLED = os.getenv("APP_WARMUP_ENABLED", "true").lower() == "true"
+APP_WARMUP_URLS = [
+    url.strip()
+    for url in os.getenv("APP_WARMUP_URLS", "https://arxiv.org").split(",")
+    if url.strip()
+]
+APP_WARMUP_TIMEOUT_SECONDS = float(os.getenv("APP_WARMUP_TIMEOUT_SECONDS", 10))
 
 PAPER_DOWNLOAD_TIMEOUT_SECONDS = float(os.getenv("PAPER_DOWNLOAD_TIMEOUT", 30))
+PAPER_DOWNLOAD_MAX_BYTES = int(os.getenv("PAPER_DOWNLOAD_MAX_BYTES", 50 * 1024 * 1024))
+PAPER_DOWNLOAD_CHUNK_SIZE = int(os.getenv("PAPER_DOWNLOAD_CHUNK_SIZE", 64 * 1024))
+PAPER_DOWNLOAD_MAX_CONNECTIONS = int(os.getenv("PAPER_DOWNLOAD_MAX_CONNECTIONS", 100))
+PAPER_DOWNLOAD_MAX_KEEPALIVE_CONNECTIONS = int(
+    os.getenv("PAPER_DOWNLOAD_MAX_KEEPALIVE_CONNECTIONS", 20)
+)
+PAPER_DOWNLOAD_MAX_CONNECTIONS_PER_HOST = int(
+    os.getenv("PAPER_DOWNLOAD_MAX_CONNECTIONS_PER_HOST", 4)
+)
 
+CACHE_DIR = os.getenv("CACHE_DIR", ".cache")
+CACHE_MEMORY_MAX_BYTES = int(os.getenv("CACHE_MEMORY_MAX_BYTES", 64 * 1024 * 1024))
+CACHE_DISK_ENABLED = os.getenv("CACHE_DISK_ENABLED", "true").lower() == "true"
+CACHE_DISK_MAX_BYTES = int(os.getenv("CACHE_DISK_MAX_BYTES", 1024 * 1024 * 1024))
+PAPER_URL_CACHE_TTL_SECONDS = float(os.getenv("PAPER_URL_CACHE_TTL_SECONDS", 24 * 60 * 60))
 
-OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
+# Search results are served from cache for the TTL, then served stale (and refreshed) for a while longer
+SEARCH_CACHE_TTL_SECONDS = float(os.getenv("SEARCH_CACHE_TTL_SECONDS", 6 * 60 * 60))
+SEARCH_CACHE_STALE_SECONDS = float(os.getenv("SEARCH_CACHE_STALE_SECONDS", 24 * 60 * 60))
+SEARCH_CACHE_MEMORY_MAX_BYTES = int(
+    os.getenv("SEARCH_CACHE_MEMORY_MAX_BYTES", 8 * 1024 * 1024)
+)
+SEARCH_CACHE_DISK_ENABLED = (
+    os.getenv("SEARCH_CACHE_DISK_ENABLED", str(CACHE_DISK_ENABLED)).lower() == "true"
+)
+
+# Research (finished or in progress) and its events are kept here, so streams can be resumed
+DATA_DIR = os.getenv("DATA_DIR", ".data")
+RESEARCH_STORE_ENABLED = os.getenv("RESEARCH_STORE_ENABLED", "true").lower() == "true"
+# Events are written in batches, whichever of these comes first
+RESEARCH_STORE_FLUSH_EVENTS = int(os.getenv("RESEARCH_STORE_FLUSH_EVENTS", 50))
+RESEARCH_STORE_FLUSH_SECONDS = float(os.getenv("RESEARCH_STORE_FLUSH_SECONDS", 1))
+# How long a finished research stays in memory for clients catching up, after that it comes from the store
+RESEARCH_SESSION_RETENTION_SECONDS = float(
+    os.getenv("RESEARCH_SESSION_RETENTION_SECONDS", 5 * 60)
+)
+# The same prompt (ignoring case, punctuation and spacing) submitted again is given the research that's
+# already queued or running for it, or the one that finished within `RESEARCH_REUSE_SECONDS`
+RESEARCH_REUSE_ENABLED = os.getenv("RESEARCH_REUSE_ENABLED", "true").lower() == "true"
+RESEARCH_REUSE_SECONDS = float(os.getenv("RESEARCH_REUSE_SECONDS", 15 * 60))
+# The search terms generated for a prompt, so researching it again can start searching straight away
+SEARCH_TERMS_CACHE_TTL_SECONDS = float(
+    os.getenv("SEARCH_TERMS_CACHE_TTL_SECONDS", 7 * 24 * 60 * 60)
+)
+
+# Every paper summarized is added to a full-text index, and research starts with the papers
+# already in it that match the prompt, see `api.research.paper_index`
+PAPER_INDEX_ENABLED = os.getenv("PAPER_INDEX_ENABLED", "true").lower() == "true"
+PAPER_INDEX_DIR = os.getenv("PAPER_INDEX_DIR", os.path.join(DATA_DIR, "paper_index"))
+PAPER_INDEX_MAX_RESULTS = int(os.getenv("PAPER_INDEX_MAX_RESULTS", 5))
+# From 0 to 1, like the relevance filter's scores
+PAPER_INDEX_MIN_SCORE = float(os.getenv("PAPER_INDEX_MIN_SCORE", 0.3))
+# Papers are buffered in memory and written out as a new segment this many at a time
+PAPER_INDEX_FLUSH_DOCS = int(os.getenv("PAPER_INDEX_FLUSH_DOCS", 32))
+# More segments than this and the smallest are merged
+PAPER_INDEX_MAX_SEGMENTS = int(os.getenv("PAPER_INDEX_MAX_SEGMENTS", 8))
+
+# Research is queued as jobs, "memory" for a single process or "sqlite" to share
+# the queue with other API processes and workers (`python -m api.worker`)
+JOB_QUEUE_BACKEND = os.getenv("JOB_QUEUE_BACKEND", "memory").lower()
+JOB_QUEUE_POLL_SECONDS = float(os.getenv("JOB_QUEUE_POLL_SECONDS", 0.5))
+# A worker that hasn't checked in for this long is presumed dead, and its research interrupted
+JOB_LEASE_SECONDS = float(os.getenv("JOB_LEASE_SECONDS", 60))
+# How many research jobs this process runs at once, 0 to only take requests and leave the work to workers
+RESEARCH_WORKERS = int(os.getenv("RESEARCH_WORKERS", 8))
+# The search and LLM rate limits are kept in files under `SHARED_STATE_DIR` rather than in memory,
+# so every process on the box (`python -m api.serve --workers N`, `python -m api.worker`) keeps
+# to them together. On by default with the sqlite queue, the only one several processes can share.
+SHARED_LIMITS_ENABLED = (
+    os.getenv("SHARED_LIMITS_ENABLED", str(JOB_QUEUE_BACKEND == "sqlite")).lower() == "true"
+)
+SHARED_STATE_DIR = os.getenv("SHARED_STATE_DIR", os.path.join(DATA_DIR, "shared"))
+
+# How many prompts of a batch are researched at once
+BATCH_CONCURRENCY = int(os.getenv("BATCH_CONCURRENCY", 4))
 
-if not OPENAI_API_KEY:
-    raise ValueError(
-        "No API key provided for OpenAI. Please set the OPEN_API_KEY environment variable in your .env file."
-    )
+PDF_PARSER_POOL_SIZE = int(os.getenv("PDF_PARSER_POOL_SIZE", os.cpu_count() or 1))
+PDF_PARSER_MAX_QUEUE_DEPTH = int(os.getenv("PDF_PARSER_MAX_QUEUE_DEPTH", 32))
+
+# Concurrency limits for each pipeline stage, across the whole process and for any one research
+SEARCH_CONCURRENCY = int(os.getenv("SEARCH_CONCURRENCY", 4))
+SEARCH_CONCURRENCY_PER_RESEARCH = int(os.getenv("SEARCH_CONCURRENCY_PER_RESEARCH", 3))
+DOWNLOAD_CONCURRENCY = int(os.getenv("DOWNLOAD_CONCURRENCY", 32))
+DOWNLOAD_CONCURRENCY_PER_RESEARCH = int(
+    os.getenv("DOWNLOAD_CONCURRENCY_PER_RESEARCH", 8)
+)
+PARSE_CONCURRENCY = int(os.getenv("PARSE_CONCURRENCY", PDF_PARSER_POOL_SIZE * 2))
+PARSE_CONCURRENCY_PER_RESEARCH = int(os.getenv("PARSE_CONCURRENCY_PER_RESEARCH", 4))
+SUMMARIZE_CONCURRENCY = int(os.getenv("SUMMARIZE_CONCURRENCY", 16))
+SUMMARIZE_CONCURRENCY_PER_RESEARCH = int(
+    os.getenv("SUMMARIZE_CONCURRENCY_PER_RESEARCH", 5)
+)
+
+
+# Observability, see `api.telemetry`
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO")
+# Counters and histograms served at /metrics
+METRICS_ENABLED = os.getenv("METRICS_ENABLED", "true").lower() == "true"
+# Per research spans served at /research/{research_id}/trace, for the researches most recently run here
+TRACING_ENABLED = os.getenv("TRACING_ENABLED", "true").lower() == "true"
+TRACE_MAX_RESEARCHES = int(os.getenv("TRACE_MAX_RESEARCHES", 100))
+TRACE_MAX_SPANS_PER_RESEARCH = int(os.getenv("TRACE_MAX_SPANS_PER_RESEARCH", 1000))
+# How often the event loop's lag is measured, and how long one callback may hog the loop before
+# it gets logged with its stack. 0 stops the logging, lag is still measured.
+EVENT_LOOP_LAG_INTERVAL_SECONDS = float(os.getenv("EVENT_LOOP_LAG_INTERVAL_SECONDS", 0.1))
+EVENT_LOOP_SLOW_CALLBACK_SECONDS = float(
+    os.getenv("EVENT_LOOP_SLOW_CALLBACK_SECONDS", 0.25)
+)
+# The sampling profiler at /debug/profile, off unless asked for: it shows the code to whoever asks
+PROFILER_ENABLED = os.getenv("PROFILER_ENABLED", "false").lower() == "true"
+PROFILER_MAX_SECONDS = float(os.getenv("PROFILER_MAX_SECONDS", 60))
+
+# Only needed once something actually talks to OpenAI, see `api.container.create_openai_client`
+OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
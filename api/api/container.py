@@ -0,0 +1,424 @@
+import asyncio
+import logging
+import os
+from typing import TYPE_CHECKING
+
+from api.cache.store import (
+    CacheStore,
+    LRUCacheStore,
+    SQLiteCacheStore,
+    TieredCacheStore,
+)
+from api.config import (
+    APP_WARMUP_TIMEOUT_SECONDS,
+    APP_WARMUP_URLS,
+    BATCH_CONCURRENCY,
+    CACHE_DIR,
+    CACHE_DISK_ENABLED,
+    CACHE_DISK_MAX_BYTES,
+    CACHE_MEMORY_MAX_BYTES,
+    DATA_DIR,
+    LLM_GOVERNOR_ENABLED,
+    JOB_QUEUE_BACKEND,
+    OPENAI_API_KEY,
+    OPENAI_MAX_CONNECTIONS,
+    OPENAI_MAX_KEEPALIVE_CONNECTIONS,
+    PAPER_INDEX_DIR,
+    PAPER_INDEX_ENABLED,
+    PAPER_SUMMARY_MODE,
+    RELEVANCE_FILTER_ENABLED,
+    RESEARCH_STORE_ENABLED,
+    RESEARCH_WORKERS,
+    SEARCH_CACHE_DISK_ENABLED,
+    SEARCH_CACHE_MEMORY_MAX_BYTES,
+    SHARED_LIMITS_ENABLED,
+    SHARED_STATE_DIR,
+)
+from api.jobs.queue import InMemoryJobQueue, JobQueue, SQLiteJobQueue
+from api.jobs.worker import ResearchWorkerPool
+from api.llm.governor import GovernedOpenAIClientWrapper, LLMBudget
+from api.llm.openai_client import DefaultOpenAIClientWrapper, OpenAIClientWrapper, OpenAIModel
+from api.llm.streams import DefaultLineByLineStreamParser
+from api.llm.tokens import get_token_counter
+from api.research.paper_cache import PaperCache
+from api.research.paper_downloader import HttpxPaperDownloader
+from api.research.paper_index import IndexingPaperSummaryGenerator, MmapPaperIndex
+from api.research.batch_runner import BatchRunner
+from api.research.paper_summary_generator import (
+    MemoizingPaperSummaryGenerator,
+    OpenAIPaperSummaryGenerator,
+    PaperSummary,
+    PaperSummaryBatcher,
+    PaperSummaryGenerator,
+    SingleFlightPaperSummaryGenerator,
+)
+from api.research.paper_text_extractor import PDFPaperTextExtractor
+from api.research.pdf_text_parser import PDFTextParserPool
+from api.research.rate_limiter import AdaptiveRateLimiter
+from api.research.relevance import TextRelevanceFilter
+from api.research.research_session import ResearchSessionManager
+from api.research.research_store import (
+    InMemoryResearchStore,
+    ResearchStore,
+    SQLiteResearchStore,
+)
+from api.research.researcher import GooglePDFResearcher
+from api.research.scheduler import StageScheduler
+from api.research.search_term_generator import (
+    CachingSearchTermGenerator,
+    OpenAIPDFSearchTermGenerator,
+)
+from api.research.single_flight import SingleFlight
+from api.research.web_searcher import (
+    CachingWebSearcher,
+    GoogleWebSearcher,
+    RateLimitedWebSearcher,
+    WebSearcher,
+)
+from api.telemetry.diagnostics import EventLoopMonitor, SamplingProfiler
+from api.telemetry.metrics import REGISTRY
+import httpx
+
+if TYPE_CHECKING:
+    from openai import AsyncOpenAI
+
+logger = logging.getLogger(__name__)
+
+
+def shared_state_path(filename: str) -> str | None:
+    # Where a limit is kept if it's shared with the other processes, None to keep it in memory
+    if not SHARED_LIMITS_ENABLED:
+        return None
+    return os.path.join(SHARED_STATE_DIR, filename)
+
+
+def create_cache_store(
+    filename: str,
+    memory_max_bytes: int = CACHE_MEMORY_MAX_BYTES,
+    disk_enabled: bool = CACHE_DISK_ENABLED,
+) -> CacheStore:
+    memory_tier = LRUCacheStore(memory_max_bytes)
+    if not disk_enabled:
+        return memory_tier
+
+    disk_tier = SQLiteCacheStore(os.path.join(CACHE_DIR, filename), CACHE_DISK_MAX_BYTES)
+    return TieredCacheStore([memory_tier, disk_tier])
+
+
+def check_openai_api_key():
+    if not OPENAI_API_KEY:
+        raise ValueError(
+            "No API key provided for OpenAI. Please set the OPENAI_API_KEY environment variable in your .env file."
+        )
+
+
+def create_openai_client(http_client: httpx.AsyncClient) -> "AsyncOpenAI":
+    # Imported here, on the first LLM call rather than at start-up, it's slow to import
+    from openai import AsyncOpenAI
+
+    check_openai_api_key()
+    return AsyncOpenAI(
+        api_key=OPENAI_API_KEY,
+        http_client=http_client,
+        # The governor retries, with what it knows about our limits and deadlines
+        max_retries=0 if LLM_GOVERNOR_ENABLED else 2,
+    )
+
+
+def create_research_store(enabled: bool = RESEARCH_STORE_ENABLED) -> ResearchStore:
+    if not enabled:
+        return InMemoryResearchStore()
+    return SQLiteResearchStore(os.path.join(DATA_DIR, "research.sqlite3"))
+
+
+def create_job_queue(backend: str = JOB_QUEUE_BACKEND) -> JobQueue:
+    if backend == "sqlite":
+        return SQLiteJobQueue(os.path.join(DATA_DIR, "jobs.sqlite3"))
+    return InMemoryJobQueue()
+
+
+class AppContainer:
+    # Everything that's expensive to build or has to be shared to be useful (connection pools,
+    # caches, process pools, limits) is built once here for the life of the app, then injected.
+
+    def __init__(
+        self,
+        research_workers: int = RESEARCH_WORKERS,
+        *,
+        openai_client_wrapper: OpenAIClientWrapper | None = None,
+        web_searcher: WebSearcher | None = None,
+    ):
+        # `openai_client_wrapper` and `web_searcher` stand in for OpenAI and Google, e.g. in `api.bench`.
+        # Everything in between (caches, limits, scheduling) is the real thing either way.
+        self.scheduler = StageScheduler.from_config()
+
+        self.openai_http_client: httpx.AsyncClient | None = None
+        self.default_openai_client_wrapper: DefaultOpenAIClientWrapper | None = None
+        if openai_client_wrapper is None:
+            # Checked now rather than on the first call, the client itself is made then
+            check_openai_api_key()
+            # OpenAI gets its own connection pool so TLS connections are kept alive across requests
+            self.openai_http_client = httpx.AsyncClient(
+                limits=httpx.Limits(
+                    max_connections=OPENAI_MAX_CONNECTIONS,
+                    max_keepalive_connections=OPENAI_MAX_KEEPALIVE_CONNECTIONS,
+                ),
+            )
+            self.default_openai_client_wrapper = DefaultOpenAIClientWrapper(
+                client_factory=lambda: create_openai_client(self.openai_http_client)
+            )
+            openai_client_wrapper = self.default_openai_client_wrapper
+        if LLM_GOVERNOR_ENABLED:
+            openai_client_wrapper = GovernedOpenAIClientWrapper(
+                openai_client_wrapper, LLMBudget(shared_path=shared_state_path("llm.state"))
+            )
+        self.openai_client_wrapper = openai_client_wrapper
+
+        self.paper_download_client = HttpxPaperDownloader.create_client()
+        self.paper_downloader = HttpxPaperDownloader(
+            self.paper_download_client, scheduler=self.scheduler
+        )
+        self.pdf_text_parser_pool = PDFTextParserPool()
+        self.paper_cache = PaperCache(create_cache_store("papers.sqlite3"))
+        self.paper_single_flight: SingleFlight[PaperSummary] = SingleFlight()
+        # One for everybody, the more papers are ready at once the fuller the batches
+        self.paper_summary_batcher = (
+            PaperSummaryBatcher(self.openai_client_wrapper)
+            if PAPER_SUMMARY_MODE == "batched"
+            else None
+        )
+        self.search_rate_limiter = AdaptiveRateLimiter.for_search(
+            shared_path=shared_state_path("search.state")
+        )
+
+        # Search results and the search terms generated for prompts
+        self.search_cache_store = create_cache_store(
+            "search.sqlite3",
+            SEARCH_CACHE_MEMORY_MAX_BYTES,
+            SEARCH_CACHE_DISK_ENABLED,
+        )
+        # Cache hits don't count against the rate limit, so the cache goes in front of it
+        self.web_searcher = CachingWebSearcher(
+            RateLimitedWebSearcher(
+                web_searcher or GoogleWebSearcher(), self.search_rate_limiter
+            ),
+            self.search_cache_store,
+        )
+        self.search_term_generator = CachingSearchTermGenerator(
+            OpenAIPDFSearchTermGenerator(
+                self.openai_client_wrapper, DefaultLineByLineStreamParser()
+            ),
+            self.search_cache_store,
+        )
+
+        self.paper_index = MmapPaperIndex(PAPER_INDEX_DIR) if PAPER_INDEX_ENABLED else None
+        self.relevance_filter = (
+            TextRelevanceFilter(self._build_paper_text_extractor())
+            if RELEVANCE_FILTER_ENABLED
+            else None
+        )
+        self.researcher = self._build_researcher()
+        self.research_store = create_research_store()
+        self.job_queue = create_job_queue()
+        self.research_sessions = ResearchSessionManager(
+            self.researcher, self.research_store, self.job_queue
+        )
+        self.research_workers = ResearchWorkerPool(
+            self.research_sessions, self.job_queue, research_workers
+        )
+        self.event_loop_monitor = EventLoopMonitor()
+        self.profiler = SamplingProfiler()
+        self._register_gauges()
+
+    @property
+    def openai_client(self) -> "AsyncOpenAI | None":
+        # Made on the first LLM call, until then there isn't one
+        if self.default_openai_client_wrapper is None:
+            return None
+        return self.default_openai_client_wrapper.client
+
+    def _register_gauges(self):
+        # Read when /metrics is scraped, from the same numbers as /stats
+        REGISTRY.gauge(
+            "research_stage_active",
+            "Slots in use in each stage",
+            ("stage",),
+            lambda: {
+                (stage.value,): limiter.active_total
+                for stage, limiter in self.scheduler.limiters.items()
+            },
+        )
+        REGISTRY.gauge(
+            "research_stage_queued",
+            "Work waiting for a slot in each stage",
+            ("stage",),
+            lambda: {
+                (stage.value,): limiter.queued
+                for stage, limiter in self.scheduler.limiters.items()
+            },
+        )
+        REGISTRY.gauge(
+            "research_sessions_running",
+            "Research running in this process",
+            (),
+            lambda: {(): self.research_sessions.running},
+        )
+        REGISTRY.gauge(
+            "paper_single_flight_in_flight",
+            "Papers being read right now, however many are waiting for each",
+            (),
+            lambda: {(): self.paper_single_flight.in_flight},
+        )
+
+    def _build_paper_text_extractor(self) -> PDFPaperTextExtractor:
+        return PDFPaperTextExtractor(
+            self.paper_downloader,
+            self.pdf_text_parser_pool,
+            self.paper_cache,
+            self.scheduler,
+        )
+
+    def _build_paper_summarizer(self, **kwargs) -> OpenAIPaperSummaryGenerator:
+        return OpenAIPaperSummaryGenerator(
+            self._build_paper_text_extractor(),
+            self.openai_client_wrapper,
+            self.paper_cache,
+            scheduler=self.scheduler,
+            batcher=self.paper_summary_batcher,
+            **kwargs,
+        )
+
+    def _indexed(self, summarizer: OpenAIPaperSummaryGenerator) -> PaperSummaryGenerator:
+        # Everything summarized goes into the index, once per paper however many are waiting for it
+        if self.paper_index is None:
+            return summarizer
+        return IndexingPaperSummaryGenerator(
+            summarizer, summarizer.paper_text_extractor, self.paper_index
+        )
+
+    def _build_researcher(
+        self, paper_summary_generator: PaperSummaryGenerator | None = None
+    ) -> GooglePDFResearcher:
+        if paper_summary_generator is None:
+            paper_summary_generator = SingleFlightPaperSummaryGenerator(
+                self._indexed(self._build_paper_summarizer()), self.paper_single_flight
+            )
+        return GooglePDFResearcher(
+            self.search_term_generator,
+            self.web_searcher,
+            paper_summary_generator,
+            self.scheduler,
+            self.relevance_filter,
+            self.paper_index,
+        )
+
+    def build_batch_runner(self, concurrency: int = BATCH_CONCURRENCY) -> BatchRunner:
+        # A fresh memo for each batch, nobody is watching summaries being written so they aren't streamed
+        summarizer = self._build_paper_summarizer(streaming=False)
+        paper_summary_generator = MemoizingPaperSummaryGenerator(
+            SingleFlightPaperSummaryGenerator(
+                self._indexed(summarizer), self.paper_single_flight
+            )
+        )
+        return BatchRunner(
+            self._build_researcher(paper_summary_generator),
+            paper_summary_generator,
+            summarizer,
+            concurrency,
+        )
+
+    async def start_async(self):
+        # An in-memory queue died with the last process, and so did everything in it.
+        # Jobs in a shared queue are still there, and workers look after each other's leases.
+        if isinstance(self.job_queue, InMemoryJobQueue):
+            interrupted = await self.research_store.mark_interrupted_async()
+            if interrupted:
+                logger.warning("Research interrupted by the last shutdown: %d", interrupted)
+
+        self.event_loop_monitor.start()
+        self.research_workers.start()
+
+    async def _open_connection_async(self, client: httpx.AsyncClient, url: str):
+        # Any response at all means the TCP/TLS connection is up and back in the pool
+        try:
+            await client.head(url)
+        except httpx.HTTPError as e:
+            logger.warning("Warm-up request failed: %s: %r", url, e)
+
+    async def _open_openai_connection_async(self):
+        client = await self.default_openai_client_wrapper.get_client_async()
+        await self._open_connection_async(self.openai_http_client, str(client.base_url))
+
+    async def warm_up_async(self):
+        # Pay for connection setup and worker process start-up before the first user does
+        warm_ups = [self.pdf_text_parser_pool.warm_up_async()]
+        if self.default_openai_client_wrapper is not None:
+            warm_ups.append(self._open_openai_connection_async())
+        # The tokenizer papers are condensed with, it's downloaded the first time
+        warm_ups.append(get_token_counter(OpenAIModel.GPT_3_5_TURBO_0125).load_async())
+        warm_ups += [
+            self._open_connection_async(self.paper_download_client, url)
+            for url in APP_WARMUP_URLS
+        ]
+
+        # Best effort, the app works fine cold
+        try:
+            async with asyncio.timeout(APP_WARMUP_TIMEOUT_SECONDS):
+                results = await asyncio.gather(*warm_ups, return_exceptions=True)
+        except TimeoutError:
+            logger.warning("Warm-up timed out, carrying on")
+            return
+
+        for result in results:
+            if isinstance(result, Exception):
+                logger.warning("Warm-up failed: %r", result)
+
+    def stats(self) -> dict:
+        return {
+            "research_sessions": self.research_sessions.stats(),
+            "job_queue": self.job_queue.stats(),
+            "research_workers": self.research_workers.stats(),
+            "scheduler": self.scheduler.stats(),
+            "pdf_parser_pool": self.pdf_text_parser_pool.stats(),
+            "paper_cache": self.paper_cache.stats_dict(),
+            "paper_single_flight": self.paper_single_flight.stats(),
+            "paper_summary_batcher": (
+                self.paper_summary_batcher.stats()
+                if self.paper_summary_batcher is not None
+                else None
+            ),
+            "paper_index": self.paper_index.stats() if self.paper_index is not None else None,
+            "relevance_filter": (
+                self.relevance_filter.stats() if self.relevance_filter is not None else None
+            ),
+            "search_rate_limiter": self.search_rate_limiter.stats(),
+            "llm_governor": (
+                self.openai_client_wrapper.stats()
+                if isinstance(self.openai_client_wrapper, GovernedOpenAIClientWrapper)
+                else None
+            ),
+            "search_cache": self.web_searcher.stats_dict(),
+            "search_terms_cache": self.search_term_generator.stats_dict(),
+            "event_loop": self.event_loop_monitor.stats(),
+        }
+
+    async def aclose(self):
+        # Reverse order of construction: stop taking on work, then let go of what it used
+        await self.research_workers.aclose()
+        await self.job_queue.close_async()
+        await self.research_store.close_async()
+        await self.web_searcher.aclose()
+        await self.search_cache_store.close_async()
+        await self.paper_download_client.aclose()
+        if self.openai_client is not None:
+            await self.openai_client.close()
+        elif self.openai_http_client is not None:
+            await self.openai_http_client.aclose()
+        self.pdf_text_parser_pool.shutdown()
+        self.search_rate_limiter.close()
+        if isinstance(self.openai_client_wrapper, GovernedOpenAIClientWrapper):
+            self.openai_client_wrapper.budget.close()
+        await self.paper_cache.store.close_async()
+        if self.paper_index is not None:
+            await self.paper_index.close_async()
+        await self.event_loop_monitor.stop_async()
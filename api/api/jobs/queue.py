@@ -0,0 +1,229 @@
+import abc
+import asyncio
+import os
+import sqlite3
+import threading
+import time
+
+from api.config import JOB_LEASE_SECONDS, JOB_QUEUE_POLL_SECONDS
+from pydantic import BaseModel
+
+
+class ResearchJob(BaseModel):
+    # The job id is the id of the research it produces
+    id: str
+    prompt: str
+
+
+class JobQueue(abc.ABC):
+    # Research waiting to be run, and leases on the research being run.
+    # Finished jobs are forgotten, their results are in the research store.
+
+    def __init__(self):
+        self.submitted = 0
+        self.claimed = 0
+        self.finished = 0
+        self.expired = 0
+
+    @abc.abstractmethod
+    async def submit_async(self, job: ResearchJob):
+        pass
+
+    @abc.abstractmethod
+    async def claim_async(self, worker_id: str) -> ResearchJob:
+        # Waits until there's a job to run
+        pass
+
+    @abc.abstractmethod
+    async def heartbeat_async(self, job_id: str, worker_id: str):
+        pass
+
+    @abc.abstractmethod
+    async def finish_async(self, job_id: str):
+        pass
+
+    @abc.abstractmethod
+    async def expire_leases_async(self) -> list[str]:
+        # Jobs whose worker stopped checking in, they're dropped and their ids returned
+        pass
+
+    async def close_async(self):
+        pass
+
+    def stats(self) -> dict:
+        return {
+            "submitted": self.submitted,
+            "claimed": self.claimed,
+            "finished": self.finished,
+            "expired": self.expired,
+        }
+
+
+class InMemoryJobQueue(JobQueue):
+    # Everything happens in this process, so a worker can't die without the queue dying too
+
+    def __init__(self):
+        super().__init__()
+        self._queued: asyncio.Queue[ResearchJob] = asyncio.Queue()
+        self._running: set[str] = set()
+
+    async def submit_async(self, job: ResearchJob):
+        self._queued.put_nowait(job)
+        self.submitted += 1
+
+    async def claim_async(self, worker_id: str) -> ResearchJob:
+        job = await self._queued.get()
+        self._running.add(job.id)
+        self.claimed += 1
+        return job
+
+    async def heartbeat_async(self, job_id: str, worker_id: str):
+        pass
+
+    async def finish_async(self, job_id: str):
+        self._running.discard(job_id)
+        self.finished += 1
+
+    async def expire_leases_async(self) -> list[str]:
+        return []
+
+    def stats(self) -> dict:
+        return {
+            **super().stats(),
+            "queued": self._queued.qsize(),
+            "running": len(self._running),
+        }
+
+
+class SQLiteJobQueue(JobQueue):
+    # Shared by every process pointing at the same file: API processes submit, workers claim
+
+    def __init__(
+        self,
+        path: str,
+        lease_seconds: float = JOB_LEASE_SECONDS,
+        poll_seconds: float = JOB_QUEUE_POLL_SECONDS,
+    ):
+        super().__init__()
+        self.path = path
+        self.lease_seconds = lease_seconds
+        self.poll_seconds = poll_seconds
+        self._connection: sqlite3.Connection | None = None
+        self._lock = threading.Lock()
+        # Workers in this process don't have to wait for their next poll to see jobs submitted here
+        self._submitted_here = asyncio.Event()
+
+    def _connect(self) -> sqlite3.Connection:
+        if self._connection is None:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+
+            connection = sqlite3.connect(
+                self.path, check_same_thread=False, isolation_level=None
+            )
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            connection.execute(
+                """
+                CREATE TABLE IF NOT EXISTS research_jobs (
+                    id TEXT PRIMARY KEY,
+                    prompt TEXT NOT NULL,
+                    worker_id TEXT,
+                    lease_expires_at REAL,
+                    created_at REAL NOT NULL
+                )
+                """
+            )
+            connection.execute(
+                "CREATE INDEX IF NOT EXISTS research_jobs_queued ON research_jobs (worker_id, created_at)"
+            )
+            self._connection = connection
+        return self._connection
+
+    def _submit(self, job: ResearchJob):
+        with self._lock:
+            self._connect().execute(
+                "INSERT INTO research_jobs (id, prompt, created_at) VALUES (?, ?, ?)",
+                (job.id, job.prompt, time.time()),
+            )
+
+    def _claim(self, worker_id: str) -> ResearchJob | None:
+        with self._lock:
+            # A single statement, so two workers can never claim the same job
+            row = (
+                self._connect()
+                .execute(
+                    """
+                    UPDATE research_jobs SET worker_id = ?, lease_expires_at = ?
+                    WHERE id = (
+                        SELECT id FROM research_jobs WHERE worker_id IS NULL ORDER BY created_at LIMIT 1
+                    )
+                    RETURNING id, prompt
+                    """,
+                    (worker_id, time.time() + self.lease_seconds),
+                )
+                .fetchone()
+            )
+        if row is None:
+            return None
+        return ResearchJob(id=row[0], prompt=row[1])
+
+    def _heartbeat(self, job_id: str, worker_id: str):
+        with self._lock:
+            self._connect().execute(
+                "UPDATE research_jobs SET lease_expires_at = ? WHERE id = ? AND worker_id = ?",
+                (time.time() + self.lease_seconds, job_id, worker_id),
+            )
+
+    def _finish(self, job_id: str):
+        with self._lock:
+            self._connect().execute("DELETE FROM research_jobs WHERE id = ?", (job_id,))
+
+    def _expire_leases(self) -> list[str]:
+        with self._lock:
+            rows = (
+                self._connect()
+                .execute(
+                    "DELETE FROM research_jobs WHERE worker_id IS NOT NULL AND lease_expires_at < ? RETURNING id",
+                    (time.time(),),
+                )
+                .fetchall()
+            )
+        return [row[0] for row in rows]
+
+    async def submit_async(self, job: ResearchJob):
+        await asyncio.to_thread(self._submit, job)
+        self.submitted += 1
+        self._submitted_here.set()
+
+    async def claim_async(self, worker_id: str) -> ResearchJob:
+        while True:
+            self._submitted_here.clear()
+            job = await asyncio.to_thread(self._claim, worker_id)
+            if job is not None:
+                self.claimed += 1
+                return job
+
+            try:
+                await asyncio.wait_for(self._submitted_here.wait(), self.poll_seconds)
+            except TimeoutError:
+                pass
+
+    async def heartbeat_async(self, job_id: str, worker_id: str):
+        await asyncio.to_thread(self._heartbeat, job_id, worker_id)
+
+    async def finish_async(self, job_id: str):
+        await asyncio.to_thread(self._finish, job_id)
+        self.finished += 1
+
+    async def expire_leases_async(self) -> list[str]:
+        expired = await asyncio.to_thread(self._expire_leases)
+        self.expired += len(expired)
+        return expired
+
+    async def close_async(self):
+        with self._lock:
+            if self._connection is not None:
+                self._connection.close()
+                self._connection = None
@@ -0,0 +1,92 @@
+import asyncio
+import logging
+import os
+import socket
+import uuid
+
+from api.config import JOB_LEASE_SECONDS, RESEARCH_WORKERS
+from api.jobs.queue import JobQueue, ResearchJob
+from api.research.research_session import ResearchSessionManager
+
+logger = logging.getLogger(__name__)
+
+
+class ResearchWorkerPool:
+    # Takes research jobs off the queue and runs them, `concurrency` at a time.
+    # Runs inside the API process, or on its own via `python -m api.worker`.
+
+    def __init__(
+        self,
+        research_sessions: ResearchSessionManager,
+        job_queue: JobQueue,
+        concurrency: int = RESEARCH_WORKERS,
+        lease_seconds: float = JOB_LEASE_SECONDS,
+    ):
+        self.research_sessions = research_sessions
+        self.job_queue = job_queue
+        self.concurrency = concurrency
+        self.lease_seconds = lease_seconds
+        self.worker_id = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self._workers: list[asyncio.Task] = []
+        self.busy = 0
+
+    def start(self):
+        self._workers = [
+            asyncio.create_task(self._work_async()) for _ in range(self.concurrency)
+        ]
+        if self.concurrency > 0:
+            self._workers.append(asyncio.create_task(self._expire_leases_async()))
+
+    async def _heartbeat_async(self, job: ResearchJob):
+        while True:
+            await asyncio.sleep(self.lease_seconds / 3)
+            try:
+                await self.job_queue.heartbeat_async(job.id, self.worker_id)
+            except Exception as e:
+                logger.warning("Job heartbeat failed: %s: %r", job.id, e)
+
+    async def _run_job_async(self, job: ResearchJob):
+        heartbeat = asyncio.create_task(self._heartbeat_async(job))
+        self.busy += 1
+        try:
+            await self.research_sessions.run_async(job.id, job.prompt)
+        finally:
+            self.busy -= 1
+            heartbeat.cancel()
+            await self.job_queue.finish_async(job.id)
+
+    async def _work_async(self):
+        while True:
+            job = await self.job_queue.claim_async(self.worker_id)
+            try:
+                await self._run_job_async(job)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                # The research records its own failures, this is the queue misbehaving
+                logger.warning("Research job failed: %s: %r", job.id, e)
+
+    async def _expire_leases_async(self):
+        # Any worker can notice another one died, and own up for it
+        while True:
+            try:
+                expired = await self.job_queue.expire_leases_async()
+                if expired:
+                    logger.warning("Research interrupted, worker went away: %s", expired)
+                    await self.research_sessions.store.mark_interrupted_async(expired)
+            except Exception as e:
+                logger.warning("Failed to expire job leases: %r", e)
+            await asyncio.sleep(self.lease_seconds)
+
+    def stats(self) -> dict:
+        return {
+            "worker_id": self.worker_id,
+            "concurrency": self.concurrency,
+            "busy": self.busy,
+        }
+
+    async def aclose(self):
+        for worker in self._workers:
+            worker.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers = []
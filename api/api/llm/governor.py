@@ -0,0 +1,438 @@
+import asyncio
+import functools
+import logging
+import random
+import time
+from typing import AsyncIterator, Awaitable, Callable, TypeVar
+
+from api.config import (
+    LLM_COMPLETION_TOKENS_ESTIMATE,
+    LLM_DEADLINE_SECONDS,
+    LLM_FIRST_TOKEN_DEADLINE_SECONDS,
+    LLM_HEDGE_ENABLED,
+    LLM_HEDGE_MAX_RATE,
+    LLM_HEDGE_MIN_SAMPLES,
+    LLM_HEDGE_PERCENTILE,
+    LLM_MAX_RETRIES,
+    LLM_RATE_BURST_SECONDS,
+    LLM_REQUESTS_PER_MINUTE,
+    LLM_RETRY_BASE_SECONDS,
+    LLM_RETRY_MAX_SECONDS,
+    LLM_TOKENS_PER_MINUTE,
+)
+from api.llm.openai_client import OpenAIClientWrapper, OpenAIModel, OpenAIParams
+from api.llm.prompt_builder import Prompt
+from api.llm.tokens import get_token_counter
+from api.research.context import current_research_id
+from api.research.scheduler import NO_RESEARCH, FairLimiter, WaitStats
+from api.research.shared_state import open_state
+from api.telemetry.metrics import LLM_ADMISSION_SECONDS, LLM_HEDGES, LLM_RETRIES
+
+logger = logging.getLogger(__name__)
+
+Result = TypeVar("Result")
+
+
+@functools.cache
+def transient_errors() -> tuple[type[Exception], ...]:
+    # Worth trying again: the connection, OpenAI having a bad moment, being told to slow down,
+    # or our own deadline running out.
+    # Only asked once something has gone wrong, `openai` is slow to import and may not be yet.
+    import openai
+
+    return (
+        openai.APIConnectionError,
+        openai.RateLimitError,
+        openai.InternalServerError,
+        TimeoutError,
+    )
+
+
+def is_rate_limited(e: Exception) -> bool:
+    import openai
+
+    return isinstance(e, openai.RateLimitError)
+
+
+# How long everybody holds off after being throttled, doubling for each throttle in a row
+THROTTLE_BACKOFF_BASE_SECONDS = 1.0
+THROTTLE_BACKOFF_MAX_SECONDS = 30.0
+
+
+class LLMBudget:
+    # Token buckets for the account's requests and tokens per minute, shared by every call in the
+    # process so a burst of research queues here instead of turning into a storm of 429s.
+    # With `shared_path` they're shared with every other process using it, see `SharedState`.
+    # Callers take turns per research (round robin), like `AdaptiveRateLimiter`.
+
+    def __init__(
+        self,
+        tokens_per_minute: int = LLM_TOKENS_PER_MINUTE,
+        requests_per_minute: int = LLM_REQUESTS_PER_MINUTE,
+        burst_seconds: float = LLM_RATE_BURST_SECONDS,
+        shared_path: str | None = None,
+    ):
+        self.tokens_per_second = tokens_per_minute / 60
+        self.requests_per_second = requests_per_minute / 60
+        self.max_tokens = self.tokens_per_second * burst_seconds
+        self.max_requests = max(1.0, self.requests_per_second * burst_seconds)
+
+        # Refilled from the beginning of time, i.e. full
+        self._state = open_state(
+            shared_path,
+            {
+                "tokens": self.max_tokens,
+                "requests": self.max_requests,
+                "refilled_at": 0.0,
+                "backoff_until": 0.0,
+                "consecutive_throttles": 0.0,
+            },
+        )
+        self._turnstile = FairLimiter(1, 1)
+
+        self.admitted = 0
+        self.throttled = 0
+        self.wait = WaitStats()
+
+    def _refill(self, state):
+        now = state.clock()
+        elapsed = max(0.0, now - state["refilled_at"])
+        state["tokens"] = min(
+            self.max_tokens, state["tokens"] + elapsed * self.tokens_per_second
+        )
+        state["requests"] = min(
+            self.max_requests, state["requests"] + elapsed * self.requests_per_second
+        )
+        state["refilled_at"] = now
+
+    def _try_take(self, tokens: int) -> float:
+        # Takes them if they're there, otherwise says how long until they will be.
+        # One go under the lock, so another process can't take them in between.
+        with self._state.locked() as state:
+            self._refill(state)
+            # A call bigger than the whole bucket goes once the bucket is full, or it never would
+            wait = max(
+                state["backoff_until"] - state.clock(),
+                (min(tokens, self.max_tokens) - state["tokens"]) / self.tokens_per_second,
+                (1 - state["requests"]) / self.requests_per_second,
+                0.0,
+            )
+            if wait > 0:
+                return wait
+            state["tokens"] -= tokens
+            state["requests"] -= 1
+        self.admitted += 1
+        return 0.0
+
+    async def acquire(self, tokens: int):
+        started = time.monotonic()
+        session = current_research_id.get() or NO_RESEARCH
+        await self._turnstile.acquire(session)
+        try:
+            while (delay := self._try_take(tokens)) > 0:
+                await asyncio.sleep(delay)
+        finally:
+            self._turnstile.release(session)
+
+        waited = time.monotonic() - started
+        self.wait.record(waited)
+        LLM_ADMISSION_SECONDS.observe(waited)
+
+    def try_acquire(self, tokens: int) -> bool:
+        # For calls that are only worth making if they can go right now, i.e. hedges
+        if self._turnstile.queued:
+            return False
+        return self._try_take(tokens) == 0
+
+    def correct(self, estimated_tokens: int, actual_tokens: int):
+        # Can go negative, then the next callers wait for it to be paid off
+        with self._state.locked() as state:
+            state["tokens"] -= actual_tokens - estimated_tokens
+
+    def record_success(self):
+        with self._state.locked() as state:
+            state["consecutive_throttles"] = 0
+
+    def record_throttled(self):
+        self.throttled += 1
+        with self._state.locked() as state:
+            state["consecutive_throttles"] += 1
+            backoff = min(
+                THROTTLE_BACKOFF_MAX_SECONDS,
+                THROTTLE_BACKOFF_BASE_SECONDS * 2 ** (state["consecutive_throttles"] - 1),
+            )
+            # Other processes may have been throttled too, whoever backs off longest wins
+            state["backoff_until"] = max(
+                state["backoff_until"], state.clock() + random.uniform(backoff / 2, backoff)
+            )
+
+    def close(self):
+        self._state.close()
+
+    def stats(self) -> dict:
+        with self._state.locked() as state:
+            self._refill(state)
+            tokens, requests = state["tokens"], state["requests"]
+        return {
+            "tokens": tokens,
+            "requests": requests,
+            "queued": self._turnstile.queued,
+            "admitted": self.admitted,
+            "throttled": self.throttled,
+            "wait": self.wait.to_dict(),
+        }
+
+
+class GovernedOpenAIClientWrapper(OpenAIClientWrapper):
+    # Keeps a slow or failing LLM call from holding up a paper indefinitely:
+    # * calls are admitted against the shared `LLMBudget`, by their estimated tokens
+    # * each call has a deadline (and a streamed one a deadline for its first token)
+    # * a call slower than the usual p95 gets a hedge, the same call sent again, and whichever
+    #   answers first is used, the other cancelled. For a stream that's whichever starts first.
+    # * transient errors are retried with jittered exponential backoff, streams only if nothing
+    #   has been passed on yet
+
+    def __init__(
+        self,
+        client: OpenAIClientWrapper,
+        budget: LLMBudget | None = None,
+        *,
+        deadline_seconds: float = LLM_DEADLINE_SECONDS,
+        first_token_deadline_seconds: float = LLM_FIRST_TOKEN_DEADLINE_SECONDS,
+        max_retries: int = LLM_MAX_RETRIES,
+        retry_base_seconds: float = LLM_RETRY_BASE_SECONDS,
+        retry_max_seconds: float = LLM_RETRY_MAX_SECONDS,
+        completion_tokens_estimate: int = LLM_COMPLETION_TOKENS_ESTIMATE,
+        hedge_enabled: bool = LLM_HEDGE_ENABLED,
+        hedge_percentile: float = LLM_HEDGE_PERCENTILE,
+        hedge_min_samples: int = LLM_HEDGE_MIN_SAMPLES,
+        hedge_max_rate: float = LLM_HEDGE_MAX_RATE,
+    ):
+        self.client = client
+        self.budget = budget or LLMBudget()
+        self.deadline_seconds = deadline_seconds
+        self.first_token_deadline_seconds = first_token_deadline_seconds
+        self.max_retries = max_retries
+        self.retry_base_seconds = retry_base_seconds
+        self.retry_max_seconds = retry_max_seconds
+        self.completion_tokens_estimate = completion_tokens_estimate
+        self.hedge_enabled = hedge_enabled
+        self.hedge_percentile = hedge_percentile
+        self.hedge_min_samples = hedge_min_samples
+        self.hedge_max_rate = hedge_max_rate
+
+        # Time to the answer for complete calls, to the first token for streams. Hedging goes by these.
+        self.latency = {"complete": WaitStats(), "stream": WaitStats()}
+        # Start to finish, whatever it took
+        self.total_latency = {"complete": WaitStats(), "stream": WaitStats()}
+        self.calls = 0
+        self.retries = 0
+        self.hedges = 0
+        self.hedges_won = 0
+        self.deadlines_exceeded = 0
+
+    def _estimate_tokens(
+        self, model: OpenAIModel, prompt: Prompt, params: OpenAIParams
+    ) -> tuple[int, int]:
+        # What's sent, and that plus what's likely to come back
+        token_counter = get_token_counter(model)
+        prompt_tokens = sum(token_counter.count(message.content) for message in prompt.messages)
+        return prompt_tokens, prompt_tokens + min(
+            params.max_tokens, self.completion_tokens_estimate
+        )
+
+    def _hedge_after(self, mode: str) -> float | None:
+        latency = self.latency[mode]
+        if not self.hedge_enabled or latency.count < self.hedge_min_samples:
+            return None
+        return latency.percentile(self.hedge_percentile)
+
+    def _may_hedge(self, tokens: int) -> bool:
+        if self.hedges >= self.hedge_max_rate * self.calls:
+            return False
+        return self.budget.try_acquire(tokens)
+
+    def _record_error(self, e: Exception):
+        if is_rate_limited(e):
+            self.budget.record_throttled()
+        elif isinstance(e, TimeoutError):
+            self.deadlines_exceeded += 1
+
+    async def _backoff_async(self, model: OpenAIModel, attempt: int, e: Exception):
+        self.retries += 1
+        LLM_RETRIES.inc(model=model.value, reason=type(e).__name__)
+        # Full jitter, so calls that failed together don't retry together
+        delay = random.uniform(
+            0, min(self.retry_max_seconds, self.retry_base_seconds * 2**attempt)
+        )
+        logger.info("Retrying LLM call in %.1fs after %r", delay, e)
+        await asyncio.sleep(delay)
+
+    def _should_retry(self, attempt: int, e: Exception) -> bool:
+        return attempt < self.max_retries and isinstance(e, transient_errors())
+
+    async def _first_of_async(
+        self,
+        model: OpenAIModel,
+        mode: str,
+        tokens: int,
+        start: Callable[[], Awaitable[Result]],
+        on_lost: Callable[[asyncio.Task], Awaitable[None]] | None = None,
+    ) -> Result:
+        # Runs `start()`, and again as a hedge if the first is slow. The first to succeed wins;
+        # only if every attempt fails is the first error raised.
+        attempts = [asyncio.ensure_future(start())]
+        errors = []
+        winner = None
+        try:
+            hedge_after = self._hedge_after(mode)
+            if hedge_after is not None:
+                await asyncio.wait(attempts, timeout=hedge_after)
+                if not attempts[0].done() and self._may_hedge(tokens):
+                    self.hedges += 1
+                    LLM_HEDGES.inc(model=model.value, outcome="sent")
+                    attempts.append(asyncio.ensure_future(start()))
+
+            pending = set(attempts)
+            while pending and winner is None:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for attempt in done:
+                    if attempt.exception() is None:
+                        winner = attempt
+                        break
+                    errors.append(attempt.exception())
+        finally:
+            losers = [attempt for attempt in attempts if attempt is not winner]
+            for attempt in losers:
+                attempt.cancel()
+                # Nobody's interested in how it went anymore
+                attempt.add_done_callback(lambda done: done.cancelled() or done.exception())
+            if on_lost is not None and losers:
+                await asyncio.wait(losers)
+                for attempt in losers:
+                    await on_lost(attempt)
+
+        if winner is None:
+            raise errors[0]
+        if winner is not attempts[0]:
+            self.hedges_won += 1
+            LLM_HEDGES.inc(model=model.value, outcome="won")
+        return winner.result()
+
+    async def get_completion_async(
+        self, model: OpenAIModel, prompt: Prompt, params: OpenAIParams = OpenAIParams()
+    ) -> str:
+        prompt_tokens, tokens = self._estimate_tokens(model, prompt, params)
+        self.calls += 1
+        started = time.monotonic()
+        attempt = 0
+        while True:
+            await self.budget.acquire(tokens)
+            attempt_started = time.monotonic()
+            try:
+                async with asyncio.timeout(self.deadline_seconds):
+                    response = await self._first_of_async(
+                        model,
+                        "complete",
+                        tokens,
+                        lambda: self.client.get_completion_async(model, prompt, params),
+                    )
+                break
+            except Exception as e:
+                self._record_error(e)
+                if not self._should_retry(attempt, e):
+                    raise
+                await self._backoff_async(model, attempt, e)
+                attempt += 1
+
+        self.budget.record_success()
+        self.budget.correct(tokens, prompt_tokens + get_token_counter(model).count(response))
+        self.latency["complete"].record(time.monotonic() - attempt_started)
+        self.total_latency["complete"].record(time.monotonic() - started)
+        return response
+
+    async def _start_stream_async(
+        self, model: OpenAIModel, prompt: Prompt, params: OpenAIParams, tokens: int
+    ) -> tuple[AsyncIterator[str], str | None]:
+        # A stream that has produced its first chunk, however many had to be started to get one
+
+        async def _start() -> tuple[AsyncIterator[str], str | None]:
+            chunks = self.client.stream_completion_async(model, prompt, params)
+            try:
+                return chunks, await anext(chunks)
+            except StopAsyncIteration:
+                return chunks, None
+            except BaseException:
+                await chunks.aclose()
+                raise
+
+        async def _close_lost(attempt: asyncio.Task):
+            if attempt.cancelled() or attempt.exception() is not None:
+                return
+            chunks, _ = attempt.result()
+            await chunks.aclose()
+
+        async with asyncio.timeout(self.first_token_deadline_seconds):
+            return await self._first_of_async(model, "stream", tokens, _start, _close_lost)
+
+    async def stream_completion_async(
+        self, model: OpenAIModel, prompt: Prompt, params: OpenAIParams = OpenAIParams()
+    ) -> AsyncIterator[str]:
+        prompt_tokens, tokens = self._estimate_tokens(model, prompt, params)
+        self.calls += 1
+        started = time.monotonic()
+        attempt = 0
+        while True:
+            await self.budget.acquire(tokens)
+            attempt_started = time.monotonic()
+            try:
+                chunks, chunk = await self._start_stream_async(model, prompt, params, tokens)
+                break
+            except Exception as e:
+                self._record_error(e)
+                if not self._should_retry(attempt, e):
+                    raise
+                await self._backoff_async(model, attempt, e)
+                attempt += 1
+
+        self.budget.record_success()
+        self.latency["stream"].record(time.monotonic() - attempt_started)
+        completion_tokens = 0
+        deadline = attempt_started + self.deadline_seconds
+        try:
+            while chunk is not None:
+                completion_tokens += 1
+                yield chunk
+                try:
+                    # Only the wait for the next chunk is timed, not whoever we're yielding to
+                    async with asyncio.timeout(max(0.0, deadline - time.monotonic())):
+                        chunk = await anext(chunks)
+                except StopAsyncIteration:
+                    chunk = None
+                except TimeoutError:
+                    # Too late to try again, whoever's reading it has seen half of it
+                    self.deadlines_exceeded += 1
+                    raise
+        finally:
+            await chunks.aclose()
+            # Near enough one token per chunk
+            self.budget.correct(tokens, prompt_tokens + completion_tokens)
+
+        self.total_latency["stream"].record(time.monotonic() - started)
+
+    def stats(self) -> dict:
+        calls = self.calls or 1
+        return {
+            "calls": self.calls,
+            "retries": self.retries,
+            "retry_rate": self.retries / calls,
+            "hedges": self.hedges,
+            "hedge_rate": self.hedges / calls,
+            "hedges_won": self.hedges_won,
+            "deadlines_exceeded": self.deadlines_exceeded,
+            "latency": {mode: stats.to_dict() for mode, stats in self.latency.items()},
+            "total_latency": {
+                mode: stats.to_dict() for mode, stats in self.total_latency.items()
+            },
+            "budget": self.budget.stats(),
+        }
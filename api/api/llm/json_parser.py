@@ -0,0 +1,75 @@
+from typing import Type, TypeVar
+
+from pydantic import BaseModel
+
+
+ExpectedType = TypeVar("ExpectedType", bound=BaseModel)
+
+
+def parse_json_object(data: str, response_type: Type[ExpectedType]) -> ExpectedType:
+    if not issubclass(response_type, BaseModel):
+        raise ValueError(f"{response_type} is not a subclass of BaseModel")
+
+    # JSON mode doesn't wrap the object in markdown, but without it the LLM still might
+    if "```" in data:
+        data = data.replace("```json", "```")
+        data = data.split("```")[1]
+
+    # Parsed and validated in one go by pydantic, without building a dict in between
+    return response_type.model_validate_json(data)
+
+
+class IncrementalJsonArrayParser:
+    # Pulls the elements of the first array in a JSON response out as soon as each one is complete,
+    # e.g. the papers in `{"papers": [{...}, {...}]}` while the response is still streaming in.
+    # Only object (or array) elements are picked out, as raw JSON for `parse_json_object`.
+
+    def __init__(self):
+        self.buffer = ""
+        self._position = 0
+        self._depth = 0
+        self._in_string = False
+        self._escaped = False
+        # Depth of the first array once it's opened, and where the element being read started
+        self._array_depth: int | None = None
+        self._array_closed = False
+        self._element_start: int | None = None
+
+    def feed(self, chunk: str) -> list[str]:
+        self.buffer += chunk
+        buffer = self.buffer
+        elements = []
+
+        for position in range(self._position, len(buffer)):
+            char = buffer[position]
+            if self._in_string:
+                if self._escaped:
+                    self._escaped = False
+                elif char == "\\":
+                    self._escaped = True
+                elif char == '"':
+                    self._in_string = False
+                continue
+
+            if char == '"':
+                self._in_string = True
+            elif char == "[" or char == "{":
+                self._depth += 1
+                if self._array_closed:
+                    continue
+                if self._array_depth is None:
+                    if char == "[":
+                        self._array_depth = self._depth
+                elif self._depth == self._array_depth + 1:
+                    self._element_start = position
+            elif char == "]" or char == "}":
+                if self._array_depth is not None and not self._array_closed:
+                    if self._depth == self._array_depth + 1 and self._element_start is not None:
+                        elements.append(buffer[self._element_start : position + 1])
+                        self._element_start = None
+                    elif self._depth == self._array_depth:
+                        self._array_closed = True
+                self._depth -= 1
+
+        self._position = len(buffer)
+        return elements
@@ -1,18 +1,32 @@
+from __future__ import annotations
+
 import abc
+import asyncio
+import time
 from api.llm.prompt_builder import Prompt
-import openai
-from openai import AsyncStream
-from openai.types.chat import ChatCompletion
-from openai.types.chat import ChatCompletionChunk
 
 from enum import Enum
-from typing import AsyncIterator
+from typing import TYPE_CHECKING, AsyncIterator, Callable
 
 from api.config import (
     OPENAI_DEFAULT_MAX_TOKENS,
     OPENAI_DEFAULT_TEMPERATURE,
     OPENAI_DEFAULT_TOP_P,
 )
+from api.telemetry.metrics import (
+    LLM_COMPLETION_TOKENS,
+    LLM_PROMPT_TOKENS,
+    LLM_PROMPT_TOKENS_PER_REQUEST,
+    LLM_REQUESTS,
+    REGISTRY,
+)
+from api.telemetry.tracing import span
+
+if TYPE_CHECKING:
+    # Takes most of a second to import, so it's left until the first call needs it
+    import openai
+    from openai import AsyncStream
+    from openai.types.chat import ChatCompletion, ChatCompletionChunk
 
 
 class OpenAIModel(str, Enum):
@@ -59,39 +73,126 @@ class OpenAIClientWrapper(abc.ABC):
         ]
 
 
+def _record_tokens(model: OpenAIModel, prompt_tokens: int, completion_tokens: int):
+    LLM_PROMPT_TOKENS.inc(prompt_tokens, model=model.value)
+    LLM_PROMPT_TOKENS_PER_REQUEST.observe(prompt_tokens, model=model.value)
+    LLM_COMPLETION_TOKENS.inc(completion_tokens, model=model.value)
+
+
+def _count_prompt_tokens(model: OpenAIModel, prompt: Prompt) -> int:
+    # Streamed responses don't report usage, so it's counted here, but only if anybody's looking
+    if not REGISTRY.enabled:
+        return 0
+    # Imported here, `api.llm.tokens` needs `OpenAIModel` from this module
+    from api.llm.tokens import get_token_counter
+
+    token_counter = get_token_counter(model)
+    return sum(token_counter.count(message.content) for message in prompt.messages)
+
+
 class DefaultOpenAIClientWrapper(OpenAIClientWrapper):
-    def __init__(self, client: openai.AsyncOpenAI):
-        self.client = client
+    # Takes the client, or something to make it with on first use
+
+    def __init__(
+        self,
+        client: openai.AsyncOpenAI | None = None,
+        client_factory: Callable[[], openai.AsyncOpenAI] | None = None,
+    ):
+        if client is None and client_factory is None:
+            raise ValueError("Either a client or a client factory is needed")
+        self._client = client
+        self.client_factory = client_factory
+        self._creating: asyncio.Future | None = None
+
+    @property
+    def client(self) -> openai.AsyncOpenAI | None:
+        # Until the first call (or `get_client_async`) there may not be one
+        return self._client
+
+    async def get_client_async(self) -> openai.AsyncOpenAI:
+        if self._client is None:
+            # Made off the event loop, importing `openai` would block it for most of a second.
+            # Everybody making the first calls at once waits for the same one.
+            if self._creating is None:
+                self._creating = asyncio.ensure_future(
+                    asyncio.to_thread(self.client_factory)
+                )
+            try:
+                self._client = await asyncio.shield(self._creating)
+            except Exception:
+                self._creating = None
+                raise
+        return self._client
 
     async def get_completion_async(
         self, model: OpenAIModel, prompt: Prompt, params: OpenAIParams = OpenAIParams()
     ) -> str:
-        completion: ChatCompletion = await self.client.chat.completions.create(
-            max_tokens=params.max_tokens,
-            temperature=params.temperature,
-            top_p=params.top_p,
-            model=model,
-            messages=OpenAIClientWrapper.prompt_to_messages(prompt),
-            response_format=params.response_format,
-        )
+        try:
+            with span("llm", model=model.value, streaming=False) as llm_span:
+                client = await self.get_client_async()
+                completion: ChatCompletion = await client.chat.completions.create(
+                    max_tokens=params.max_tokens,
+                    temperature=params.temperature,
+                    top_p=params.top_p,
+                    model=model,
+                    messages=OpenAIClientWrapper.prompt_to_messages(prompt),
+                    response_format=params.response_format,
+                )
+                if completion.usage is not None:
+                    _record_tokens(
+                        model,
+                        completion.usage.prompt_tokens,
+                        completion.usage.completion_tokens,
+                    )
+                    llm_span.set(
+                        prompt_tokens=completion.usage.prompt_tokens,
+                        completion_tokens=completion.usage.completion_tokens,
+                    )
+        except Exception:
+            LLM_REQUESTS.inc(model=model.value, mode="complete", outcome="failed")
+            raise
+
+        LLM_REQUESTS.inc(model=model.value, mode="complete", outcome="ok")
         return completion.choices[0].message.content
 
     async def stream_completion_async(
         self, model: OpenAIModel, prompt: Prompt, params: OpenAIParams = OpenAIParams()
     ) -> AsyncIterator[str]:
-        chunks: AsyncStream[
-            ChatCompletionChunk
-        ] = await self.client.chat.completions.create(
-            max_tokens=params.max_tokens,
-            temperature=params.temperature,
-            top_p=params.top_p,
-            model=model,
-            messages=OpenAIClientWrapper.prompt_to_messages(prompt),
-            stream=True,
-            response_format=params.response_format,
-        )
-
-        async for chunk in chunks:
-            content = chunk.choices[0].delta.content
-            if content:
-                yield content
+        prompt_tokens = _count_prompt_tokens(model, prompt)
+        # Near enough one token per chunk
+        completion_tokens = 0
+        try:
+            with span(
+                "llm", model=model.value, streaming=True, prompt_tokens=prompt_tokens
+            ) as llm_span:
+                started = time.monotonic()
+                client = await self.get_client_async()
+                chunks: AsyncStream[
+                    ChatCompletionChunk
+                ] = await client.chat.completions.create(
+                    max_tokens=params.max_tokens,
+                    temperature=params.temperature,
+                    top_p=params.top_p,
+                    model=model,
+                    messages=OpenAIClientWrapper.prompt_to_messages(prompt),
+                    stream=True,
+                    response_format=params.response_format,
+                )
+
+                async for chunk in chunks:
+                    content = chunk.choices[0].delta.content
+                    if content:
+                        if completion_tokens == 0:
+                            llm_span.set(
+                                first_token_seconds=time.monotonic() - started
+                            )
+                        completion_tokens += 1
+                        yield content
+                llm_span.set(completion_tokens=completion_tokens)
+        except Exception:
+            LLM_REQUESTS.inc(model=model.value, mode="stream", outcome="failed")
+            raise
+        finally:
+            _record_tokens(model, prompt_tokens, completion_tokens)
+
+        LLM_REQUESTS.inc(model=model.value, mode="stream", outcome="ok")
@@ -0,0 +1,103 @@
+import abc
+import asyncio
+import functools
+import importlib.util
+import logging
+import threading
+
+from api.llm.openai_client import OpenAIModel
+
+logger = logging.getLogger(__name__)
+
+# Rule of thumb for English text with OpenAI tokenizers
+APPROXIMATE_CHARS_PER_TOKEN = 4
+
+
+class TokenCounter(abc.ABC):
+    @abc.abstractmethod
+    def count(self, text: str) -> int:
+        pass
+
+    @abc.abstractmethod
+    def truncate(self, text: str, max_tokens: int) -> str:
+        pass
+
+    async def load_async(self):
+        # Whatever the counter needs before it's exact, nothing for most
+        pass
+
+
+class TiktokenTokenCounter(TokenCounter):
+    # The model's own tokenizer. Its encoding is loaded by `load_async`, in a thread: tiktoken
+    # downloads it the first time, which mustn't hold up start-up or the event loop.
+    # Until it's loaded (or if it can't be), counts are approximate.
+
+    def __init__(self, model: OpenAIModel):
+        self.model = model
+        self.encoding = None
+        self.approximate = ApproximateTokenCounter()
+        self._lock = threading.Lock()
+        self._failed = False
+
+    def _load(self):
+        with self._lock:
+            if self.encoding is not None or self._failed:
+                return
+            try:
+                import tiktoken
+
+                self.encoding = tiktoken.encoding_for_model(self.model.value)
+            except Exception as e:
+                # e.g. it couldn't download the encoding, not worth trying again for every paper
+                self._failed = True
+                logger.warning("Using approximate token counts: %r", e)
+
+    async def load_async(self):
+        if self.encoding is None and not self._failed:
+            await asyncio.to_thread(self._load)
+
+    def count(self, text: str) -> int:
+        if self.encoding is None:
+            return self.approximate.count(text)
+        return len(self.encoding.encode_ordinary(text))
+
+    def truncate(self, text: str, max_tokens: int) -> str:
+        if self.encoding is None:
+            return self.approximate.truncate(text, max_tokens)
+        if max_tokens <= 0:
+            return ""
+        tokens = self.encoding.encode_ordinary(text)
+        if len(tokens) <= max_tokens:
+            return text
+        return self.encoding.decode(tokens[:max_tokens])
+
+
+class ApproximateTokenCounter(TokenCounter):
+    # Good enough for budgeting when tiktoken (or its encoding files) aren't available
+
+    def __init__(self, chars_per_token: int = APPROXIMATE_CHARS_PER_TOKEN):
+        self.chars_per_token = chars_per_token
+
+    def count(self, text: str) -> int:
+        return -(-len(text) // self.chars_per_token)
+
+    def truncate(self, text: str, max_tokens: int) -> str:
+        max_chars = max(0, max_tokens) * self.chars_per_token
+        if len(text) <= max_chars:
+            return text
+
+        # Don't leave half a word at the end
+        truncated = text[:max_chars]
+        last_space = truncated.rfind(" ")
+        if last_space > max_chars // 2:
+            truncated = truncated[:last_space]
+        return truncated
+
+
+@functools.cache
+def get_token_counter(model: OpenAIModel) -> TokenCounter:
+    # Only checks tiktoken is there, importing it and loading the encoding wait for `load_async`
+    if importlib.util.find_spec("tiktoken") is None:
+        logger.warning("tiktoken isn't installed, using approximate token counts")
+        return ApproximateTokenCounter()
+    return TiktokenTokenCounter(model)
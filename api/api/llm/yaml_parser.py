@@ -1,7 +1,7 @@
+import re
 from typing import Type, TypeVar
 
 from pydantic import BaseModel
-import yaml
 
 
 ExpectedType = TypeVar("ExpectedType", bound=BaseModel)
@@ -14,9 +14,94 @@ def parse_yaml_object(data: str, response_type: Type[ExpectedType]) -> ExpectedT
         # So, do a runtime check to be sure
         raise ValueError(f"{response_type} is not a subclass of BaseModel")
 
+    # Imported on first use, to keep start-up quick
+    import yaml
+
     # LLM loves to put yaml in markdown despite instructions, so try to cleanse
     if "```" in data:
         data = data.replace("```yaml", "```")
         data = data.split("```")[1]
 
     return response_type.model_validate(yaml.safe_load(data))
+
+
+BLOCK_SCALAR_INDICATORS = {"|", "|-", "|+", ">", ">-", ">+"}
+TOP_LEVEL_KEY = re.compile(r"^([A-Za-z_][\w-]*):(?:[ \t]+(.*))?$")
+
+
+def _unquote(value: str) -> str:
+    value = value.strip()
+    if len(value) >= 2 and value[0] == value[-1] and value[0] in "\"'":
+        return value[1:-1]
+    return value
+
+
+def _dedent(lines: list[str]) -> list[str]:
+    indents = [len(line) - len(line.lstrip()) for line in lines if line.strip()]
+    indent = min(indents, default=0)
+    return [line[indent:] for line in lines]
+
+
+class IncrementalYamlObjectParser:
+    # Just enough YAML to pull the top-level fields out of an LLM response while it streams in:
+    # plain scalars, block scalars (| and >) and block sequences of scalars.
+    # It's forgiving by design, the complete response should still go through `parse_yaml_object`.
+
+    def __init__(self):
+        self.buffer = ""
+
+    def feed(self, chunk: str) -> dict:
+        self.buffer += chunk
+        return self.parse(self.buffer)
+
+    @classmethod
+    def _value(cls, style: str, lines: list[str]) -> str | list[str] | None:
+        if style == "plain":
+            return _unquote(" ".join(line.strip() for line in lines))
+
+        lines = _dedent(lines)
+        if style == "|":
+            return "\n".join(lines).strip("\n")
+        if style == ">":
+            return " ".join(line.strip() for line in lines if line.strip())
+
+        # Nested under `key:`, either a list of items or (unhelpfully) more text
+        items = [line.strip() for line in lines if line.strip()]
+        if not items:
+            return None
+        if all(item.startswith("-") for item in items):
+            return [_unquote(item[1:]) for item in items if item[1:].strip()]
+        return " ".join(items)
+
+    @classmethod
+    def parse(cls, data: str) -> dict:
+        fields = {}
+        key = None
+        style = None
+        lines: list[str] = []
+
+        for line in data.split("\n"):
+            if line.lstrip().startswith("```"):
+                continue
+
+            match = TOP_LEVEL_KEY.match(line) if line[:1].strip() else None
+            if match:
+                if key is not None:
+                    fields[key] = cls._value(style, lines)
+
+                key = match.group(1)
+                rest = (match.group(2) or "").strip()
+                if rest in BLOCK_SCALAR_INDICATORS:
+                    style, lines = rest[0], []
+                elif rest:
+                    style, lines = "plain", [rest]
+                else:
+                    style, lines = "nested", []
+            elif key is not None and (not line.strip() or line[0].isspace()):
+                lines.append(line)
+            # Anything else unindented is the start of a key that hasn't fully arrived yet
+
+        if key is not None:
+            fields[key] = cls._value(style, lines)
+
+        return {key: value for key, value in fields.items() if value is not None}
@@ -0,0 +1,134 @@
+import logging
+import time
+from typing import AsyncIterator, Literal
+
+from api.config import BATCH_CONCURRENCY
+from api.research.paper_summary_generator import (
+    MemoizingPaperSummaryGenerator,
+    OpenAIPaperSummaryGenerator,
+)
+from api.research.researcher import Researcher
+from api.types import Research, ResearchStatus
+from pydantic import BaseModel
+
+logger = logging.getLogger(__name__)
+
+
+class BatchRequest(BaseModel):
+    prompts: list[str]
+    concurrency: int | None = None
+
+
+class BatchResult(BaseModel):
+    type: Literal["result"] = "result"
+    # Position of the prompt in the batch, results come out in the order they finish
+    index: int
+    prompt: str
+    status: ResearchStatus
+    error: str | None = None
+    seconds: float
+    research: Research | None = None
+
+
+class BatchReport(BaseModel):
+    type: Literal["report"] = "report"
+    prompts: int
+    completed: int
+    failed: int
+    papers: int
+    unique_papers: int
+    # Papers the researchers asked to read, and how many of them actually cost an LLM call
+    paper_reads: int
+    summary_llm_calls: int
+    llm_calls_saved: int
+    seconds: float
+    papers_per_second: float
+    prompts_per_minute: float
+
+
+class BatchRunner:
+    # Researches many prompts at once with everything shared between them: caches, limits,
+    # and every paper read so far, so a URL found by any number of prompts is read once
+
+    def __init__(
+        self,
+        researcher: Researcher,
+        paper_summary_generator: MemoizingPaperSummaryGenerator,
+        summarizer: OpenAIPaperSummaryGenerator,
+        concurrency: int = BATCH_CONCURRENCY,
+    ):
+        self.researcher = researcher
+        self.paper_summary_generator = paper_summary_generator
+        self.summarizer = summarizer
+        self.concurrency = concurrency
+
+    async def _research_prompt_async(self, index: int, prompt: str) -> BatchResult:
+        started = time.monotonic()
+        research = None
+        try:
+            async for research in self.researcher.research_async(prompt):
+                pass
+        except Exception as e:
+            logger.warning("Batch research failed: %s: %r", prompt, e)
+            return BatchResult(
+                index=index,
+                prompt=prompt,
+                status=ResearchStatus.FAILED,
+                error=str(e),
+                seconds=time.monotonic() - started,
+                research=research,
+            )
+
+        return BatchResult(
+            index=index,
+            prompt=prompt,
+            status=ResearchStatus.COMPLETED,
+            seconds=time.monotonic() - started,
+            research=research,
+        )
+
+    async def run_async(
+        self, prompts: list[str]
+    ) -> AsyncIterator[BatchResult | BatchReport]:
+        started = time.monotonic()
+        completed = 0
+        papers = 0
+        paper_urls = set()
+
+        # Imported when a batch first needs it, rather than when the app starts
+        from aiostream import stream
+
+        # Each result is handed over as soon as it's done, whatever order that's in
+        results = stream.starmap(
+            stream.iterate(enumerate(prompts)),
+            self._research_prompt_async,
+            ordered=False,
+            task_limit=max(1, self.concurrency),
+        )
+        async with results.stream() as streamer:
+            async for result in streamer:
+                if result.status == ResearchStatus.COMPLETED:
+                    completed += 1
+                if result.research is not None:
+                    for search in result.research.searches:
+                        papers += len(search.papers)
+                        paper_urls.update(paper.url for paper in search.papers)
+                yield result
+
+        seconds = time.monotonic() - started
+        paper_reads = self.paper_summary_generator.requests
+        # Fractional when summaries are batched, each paper counts for its share of a request
+        summary_llm_calls = round(self.summarizer.llm_calls)
+        yield BatchReport(
+            prompts=len(prompts),
+            completed=completed,
+            failed=len(prompts) - completed,
+            papers=papers,
+            unique_papers=len(paper_urls),
+            paper_reads=paper_reads,
+            summary_llm_calls=summary_llm_calls,
+            llm_calls_saved=max(0, paper_reads - summary_llm_calls),
+            seconds=seconds,
+            papers_per_second=papers / seconds if seconds > 0 else 0,
+            prompts_per_minute=len(prompts) * 60 / seconds if seconds > 0 else 0,
+        )
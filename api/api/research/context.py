@@ -0,0 +1,7 @@
+from contextvars import ContextVar
+
+# Id of the research the current task is working on. Set by the researcher for each
+# search term's task, and inherited by every task spawned from there.
+current_research_id: ContextVar[str | None] = ContextVar(
+    "current_research_id", default=None
+)
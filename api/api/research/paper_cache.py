@@ -0,0 +1,79 @@
+import time
+from typing import Type, TypeVar
+
+from api.cache.store import CacheStats, CacheStore
+from api.config import PAPER_URL_CACHE_TTL_SECONDS
+from api.research.url_normalizer import normalize_paper_url
+from pydantic import BaseModel
+
+CachedModel = TypeVar("CachedModel", bound=BaseModel)
+
+URL_NAMESPACE = "paper_url"
+TEXT_NAMESPACE = "paper_text"
+SUMMARY_NAMESPACE = "paper_summary"
+
+
+class CachedPaperUrl(BaseModel):
+    sha256: str
+    etag: str | None = None
+    last_modified: str | None = None
+    checked_at: float
+
+
+class PaperCache:
+    # Two levels:
+    # * URL -> content hash (plus ETag/Last-Modified for revalidating with the origin), keyed by the
+    #   normalized URL so the same paper found with different tracking parameters is one entry
+    # * content hash + parameters -> extracted text / summaries
+    # Keying the expensive stuff by content means mirrors of the same PDF share entries.
+    def __init__(
+        self, store: CacheStore, url_ttl_seconds: float = PAPER_URL_CACHE_TTL_SECONDS
+    ):
+        self.store = store
+        self.url_ttl_seconds = url_ttl_seconds
+        self.stats = {
+            namespace: CacheStats()
+            for namespace in (URL_NAMESPACE, TEXT_NAMESPACE, SUMMARY_NAMESPACE)
+        }
+
+    async def _get_async(self, namespace: str, key: str) -> bytes | None:
+        value = await self.store.get_async(namespace, key)
+        self.stats[namespace].record(value is not None)
+        return value
+
+    async def _set_async(self, namespace: str, key: str, value: bytes):
+        await self.store.set_async(namespace, key, value)
+        self.stats[namespace].sets += 1
+
+    def is_fresh(self, cached_url: CachedPaperUrl) -> bool:
+        return time.time() - cached_url.checked_at < self.url_ttl_seconds
+
+    async def get_url_async(self, url: str) -> CachedPaperUrl | None:
+        value = await self._get_async(URL_NAMESPACE, normalize_paper_url(url))
+        return CachedPaperUrl.model_validate_json(value) if value else None
+
+    async def set_url_async(self, url: str, cached_url: CachedPaperUrl):
+        await self._set_async(
+            URL_NAMESPACE, normalize_paper_url(url), cached_url.model_dump_json().encode()
+        )
+
+    async def get_text_async(self, sha256: str, params: str) -> str | None:
+        value = await self._get_async(TEXT_NAMESPACE, f"{sha256}:{params}")
+        return value.decode() if value is not None else None
+
+    async def set_text_async(self, sha256: str, params: str, text: str):
+        await self._set_async(TEXT_NAMESPACE, f"{sha256}:{params}", text.encode())
+
+    async def get_summary_async(
+        self, sha256: str, params: str, summary_type: Type[CachedModel]
+    ) -> CachedModel | None:
+        value = await self._get_async(SUMMARY_NAMESPACE, f"{sha256}:{params}")
+        return summary_type.model_validate_json(value) if value else None
+
+    async def set_summary_async(self, sha256: str, params: str, summary: BaseModel):
+        await self._set_async(
+            SUMMARY_NAMESPACE, f"{sha256}:{params}", summary.model_dump_json().encode()
+        )
+
+    def stats_dict(self) -> dict:
+        return {namespace: stats.to_dict() for namespace, stats in self.stats.items()}
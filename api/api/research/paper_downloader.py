@@ -0,0 +1,211 @@
+import abc
+import asyncio
+import hashlib
+import os
+import tempfile
+import weakref
+from contextlib import asynccontextmanager
+from typing import AsyncContextManager, AsyncIterator
+
+from api.config import (
+    PAPER_DOWNLOAD_CHUNK_SIZE,
+    PAPER_DOWNLOAD_MAX_BYTES,
+    PAPER_DOWNLOAD_MAX_CONNECTIONS,
+    PAPER_DOWNLOAD_MAX_CONNECTIONS_PER_HOST,
+    PAPER_DOWNLOAD_MAX_KEEPALIVE_CONNECTIONS,
+    PAPER_DOWNLOAD_TIMEOUT_SECONDS,
+)
+from api.research.scheduler import PipelineStage, StageScheduler, stage_slot
+from api.telemetry.metrics import PAPER_DOWNLOAD_BYTES
+from api.telemetry.tracing import span
+from pydantic import BaseModel
+import httpx
+
+PDF_MAGIC = b"%PDF-"
+
+# The PDF spec allows junk before the header, but it has to be within the first 1KB
+PDF_MAGIC_SEARCH_BYTES = 1024
+
+# Servers are sloppy about Content-Type for PDFs, so only reject types that are clearly something else
+PDF_CONTENT_TYPES = {
+    "application/pdf",
+    "application/x-pdf",
+    "application/acrobat",
+    "application/octet-stream",
+    "binary/octet-stream",
+    "application/download",
+    "application/force-download",
+}
+
+DOWNLOAD_USER_AGENT = "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/123.0.0.0 Safari/537.36"
+
+
+class PaperDownloadError(Exception):
+    pass
+
+
+class DownloadedPaper(BaseModel):
+    url: str
+    # Both None when the server says our cached copy is still good (304)
+    path: str | None
+    sha256: str | None
+    size: int = 0
+    content_type: str | None = None
+    etag: str | None = None
+    last_modified: str | None = None
+
+    @property
+    def not_modified(self) -> bool:
+        return self.path is None
+
+
+class PaperDownloader(abc.ABC):
+    @abc.abstractmethod
+    def download_async(
+        self, url: str, etag: str | None = None, last_modified: str | None = None
+    ) -> AsyncContextManager[DownloadedPaper]:
+        pass
+
+
+class HttpxPaperDownloader(PaperDownloader):
+    def __init__(
+        self,
+        client: httpx.AsyncClient,
+        *,
+        max_bytes: int = PAPER_DOWNLOAD_MAX_BYTES,
+        chunk_size: int = PAPER_DOWNLOAD_CHUNK_SIZE,
+        max_connections_per_host: int = PAPER_DOWNLOAD_MAX_CONNECTIONS_PER_HOST,
+        timeout: float = PAPER_DOWNLOAD_TIMEOUT_SECONDS,
+        scheduler: StageScheduler | None = None,
+    ):
+        self.client = client
+        self.scheduler = scheduler
+        self.max_bytes = max_bytes
+        self.chunk_size = max(chunk_size, PDF_MAGIC_SEARCH_BYTES)
+        self.max_connections_per_host = max_connections_per_host
+        self.timeout = timeout
+
+        # httpx only limits connections globally, so per-host limits are enforced here.
+        # Entries disappear on their own once no download is holding on to them.
+        self._host_slots: weakref.WeakValueDictionary[
+            str, asyncio.Semaphore
+        ] = weakref.WeakValueDictionary()
+
+    @classmethod
+    def create_client(cls) -> httpx.AsyncClient:
+        # One pooled client for the life of the app so connections get kept alive and reused
+        return httpx.AsyncClient(
+            follow_redirects=True,
+            timeout=PAPER_DOWNLOAD_TIMEOUT_SECONDS,
+            headers={"User-Agent": DOWNLOAD_USER_AGENT},
+            limits=httpx.Limits(
+                max_connections=PAPER_DOWNLOAD_MAX_CONNECTIONS,
+                max_keepalive_connections=PAPER_DOWNLOAD_MAX_KEEPALIVE_CONNECTIONS,
+            ),
+        )
+
+    def _host_slot(self, url: str) -> asyncio.Semaphore:
+        host = httpx.URL(url).host
+        slot = self._host_slots.get(host)
+        if slot is None:
+            slot = asyncio.Semaphore(self.max_connections_per_host)
+            self._host_slots[host] = slot
+        return slot
+
+    @classmethod
+    def _check_content_type(cls, url: str, content_type: str | None):
+        if not content_type:
+            return
+        media_type = content_type.split(";")[0].strip().lower()
+        if media_type not in PDF_CONTENT_TYPES:
+            raise PaperDownloadError(f"Not a PDF ({media_type}): {url}")
+
+    def _check_content_length(self, url: str, content_length: str | None):
+        if self.max_bytes > 0 and content_length and content_length.isdigit():
+            if int(content_length) > self.max_bytes:
+                raise PaperDownloadError(
+                    f"PDF too large ({content_length} bytes > {self.max_bytes}): {url}"
+                )
+
+    async def _stream_to_file(
+        self, url: str, file, etag: str | None, last_modified: str | None
+    ) -> DownloadedPaper:
+        headers = {}
+        if etag:
+            headers["If-None-Match"] = etag
+        if last_modified:
+            headers["If-Modified-Since"] = last_modified
+
+        async with self.client.stream("GET", url, headers=headers) as response:
+            if response.status_code == 304 and headers:
+                return DownloadedPaper(
+                    url=url,
+                    path=None,
+                    sha256=None,
+                    etag=response.headers.get("etag", etag),
+                    last_modified=response.headers.get("last-modified", last_modified),
+                )
+
+            if response.status_code != 200:
+                raise PaperDownloadError(
+                    f"Unexpected status {response.status_code}: {url}"
+                )
+
+            # Bail out before reading any of the body if the headers already rule it out
+            content_type = response.headers.get("content-type")
+            self._check_content_type(url, content_type)
+            self._check_content_length(url, response.headers.get("content-length"))
+
+            digest = hashlib.sha256()
+            size = 0
+            async for chunk in response.aiter_bytes(self.chunk_size):
+                if size == 0 and PDF_MAGIC not in chunk[:PDF_MAGIC_SEARCH_BYTES]:
+                    raise PaperDownloadError(f"Missing PDF header: {url}")
+
+                size += len(chunk)
+                if self.max_bytes > 0 and size > self.max_bytes:
+                    raise PaperDownloadError(
+                        f"PDF too large (> {self.max_bytes} bytes): {url}"
+                    )
+
+                digest.update(chunk)
+                file.write(chunk)
+
+            if size == 0:
+                raise PaperDownloadError(f"Empty response: {url}")
+
+        return DownloadedPaper(
+            url=url,
+            path=file.name,
+            size=size,
+            sha256=digest.hexdigest(),
+            content_type=content_type,
+            etag=response.headers.get("etag"),
+            last_modified=response.headers.get("last-modified"),
+        )
+
+    @asynccontextmanager
+    async def download_async(
+        self, url: str, etag: str | None = None, last_modified: str | None = None
+    ) -> AsyncIterator[DownloadedPaper]:
+        temp_pdf = tempfile.NamedTemporaryFile(suffix=".pdf", delete=False)
+        try:
+            # Stream the body straight to disk so memory use stays at one chunk per download
+            with temp_pdf:
+                async with stage_slot(self.scheduler, PipelineStage.DOWNLOAD):
+                    async with self._host_slot(url):
+                        # Only time the download itself, not the wait for a slot
+                        with span("download", url=url) as download_span:
+                            async with asyncio.timeout(self.timeout):
+                                paper = await self._stream_to_file(
+                                    url, temp_pdf, etag, last_modified
+                                )
+                            download_span.set(
+                                bytes=paper.size, not_modified=paper.not_modified
+                            )
+                        if not paper.not_modified:
+                            PAPER_DOWNLOAD_BYTES.observe(paper.size)
+
+            yield paper
+        finally:
+            os.unlink(temp_pdf.name)
@@ -0,0 +1,499 @@
+import abc
+import asyncio
+import heapq
+import logging
+import math
+import mmap
+import os
+import sqlite3
+import threading
+from array import array
+from collections import Counter
+from typing import AsyncIterator
+
+from api.config import (
+    PAPER_INDEX_FLUSH_DOCS,
+    PAPER_INDEX_MAX_SEGMENTS,
+    PAPER_INDEX_MIN_SCORE,
+    PAPER_TEXT_MAX_CHARS,
+)
+from api.research.paper_summary_generator import (
+    PaperSummary,
+    PaperSummaryGenerator,
+    PartialPaperSummary,
+)
+from api.research.paper_text_extractor import PaperTextExtractor
+from api.research.relevance import BM25_B, BM25_K1, tokenize
+from pydantic import BaseModel
+
+logger = logging.getLogger(__name__)
+
+# Postings are (document id, term frequency) pairs of native unsigned ints
+POSTING_TYPECODE = "I"
+POSTING_BYTES = array(POSTING_TYPECODE).itemsize * 2
+
+
+class PaperIndexHit(BaseModel):
+    url: str
+    score: float
+    summary: PaperSummary
+
+
+class PaperIndex(abc.ABC):
+    # Full-text search over every paper this app has read and summarized
+
+    @abc.abstractmethod
+    async def add_async(self, url: str, text: str, summary: PaperSummary):
+        pass
+
+    @abc.abstractmethod
+    async def search_async(self, query: str, n: int) -> list[PaperIndexHit]:
+        pass
+
+    def stats(self) -> dict:
+        return {}
+
+    async def close_async(self):
+        pass
+
+
+class _Document:
+    def __init__(self, url: str, summary_json: str, words: Counter[str], length: int):
+        self.url = url
+        self.summary_json = summary_json
+        self.words = words
+        self.length = length
+
+
+class _Segment:
+    # An immutable file of postings, term by term. Which term's postings are where is in SQLite,
+    # so neither the dictionary nor the postings have to be in memory to search.
+
+    def __init__(self, segment_id: int, path: str):
+        self.id = segment_id
+        self.path = path
+        self._file = open(path, "rb")
+        size = os.fstat(self._file.fileno()).st_size
+        # Can't map an empty file, and there's nothing to read from one anyway
+        self._mmap = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ) if size else None
+        self.postings = memoryview(self._mmap).cast(POSTING_TYPECODE) if self._mmap else None
+
+    def read(self, offset: int, count: int) -> memoryview:
+        return self.postings[offset * 2 : (offset + count) * 2]
+
+    def read_bytes(self, offset: int, count: int) -> bytes:
+        return self._mmap[offset * POSTING_BYTES : (offset + count) * POSTING_BYTES]
+
+    def close(self):
+        if self.postings is not None:
+            self.postings.release()
+            self._mmap.close()
+        self._file.close()
+
+
+class MmapPaperIndex(PaperIndex):
+    # An inverted index on disk, log-structured like Lucene's:
+    # * Papers are added to an in-memory buffer, searchable straight away, and written out as a new
+    #   segment every `flush_docs` papers (and on close). Segments are never changed once written.
+    # * Postings are memory-mapped, so only the pages a search touches are read, and the OS decides
+    #   what stays cached. The term dictionary, the papers and their summaries are in SQLite.
+    # * Once there are more than `max_segments`, the smallest are merged into one, so a search
+    #   doesn't have to look in ever more places.
+    # Segments are registered in SQLite when they're written, so processes sharing `directory` see
+    # each other's papers once they're flushed.
+
+    def __init__(
+        self,
+        directory: str,
+        flush_docs: int = PAPER_INDEX_FLUSH_DOCS,
+        max_segments: int = PAPER_INDEX_MAX_SEGMENTS,
+        min_score: float = PAPER_INDEX_MIN_SCORE,
+        max_chars: int = PAPER_TEXT_MAX_CHARS,
+    ):
+        self.directory = directory
+        self.flush_docs = flush_docs
+        self.max_segments = max_segments
+        self.min_score = min_score
+        self.max_chars = max_chars
+        self._connection: sqlite3.Connection | None = None
+        self._lock = threading.Lock()
+        self._segments: dict[int, _Segment] = {}
+        self._buffer: dict[str, _Document] = {}
+        # Indexed by document id, ids only ever go up so this only ever grows
+        self._lengths = array("I")
+        self.added = 0
+        self.searches = 0
+        self.merges = 0
+
+    def _segment_path(self, segment_id: int) -> str:
+        return os.path.join(self.directory, f"segment-{segment_id:08d}.postings")
+
+    def _connect(self) -> sqlite3.Connection:
+        if self._connection is None:
+            os.makedirs(self.directory, exist_ok=True)
+            connection = sqlite3.connect(
+                os.path.join(self.directory, "index.sqlite3"),
+                check_same_thread=False,
+                isolation_level=None,
+                # Another process may be merging
+                timeout=60,
+            )
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            connection.execute(
+                """
+                CREATE TABLE IF NOT EXISTS documents (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    url TEXT NOT NULL UNIQUE,
+                    length INTEGER NOT NULL,
+                    summary TEXT NOT NULL
+                )
+                """
+            )
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS segments (id INTEGER PRIMARY KEY AUTOINCREMENT, postings INTEGER NOT NULL)"
+            )
+            connection.execute(
+                """
+                CREATE TABLE IF NOT EXISTS terms (
+                    term TEXT NOT NULL,
+                    segment INTEGER NOT NULL,
+                    offset INTEGER NOT NULL,
+                    count INTEGER NOT NULL,
+                    PRIMARY KEY (term, segment)
+                ) WITHOUT ROWID
+                """
+            )
+            self._connection = connection
+            self._remove_orphans()
+        return self._connection
+
+    def _remove_orphans(self):
+        # Segments written by a process that died before registering them, or merged away
+        # by one that died before deleting them
+        connection = self._connection
+        connection.execute("BEGIN IMMEDIATE")
+        try:
+            registered = {row[0] for row in connection.execute("SELECT id FROM segments")}
+            for name in os.listdir(self.directory):
+                if not name.startswith("segment-") or not name.endswith(".postings"):
+                    continue
+                if int(name[len("segment-") : -len(".postings")]) not in registered:
+                    os.unlink(os.path.join(self.directory, name))
+        finally:
+            connection.execute("COMMIT")
+
+    def _refresh(self):
+        # Pick up segments flushed or merged since, by this process or any other
+        connection = self._connect()
+        current = {row[0] for row in connection.execute("SELECT id FROM segments")}
+        for segment_id in set(self._segments) - current:
+            self._segments.pop(segment_id).close()
+        for segment_id in current - set(self._segments):
+            try:
+                self._segments[segment_id] = _Segment(segment_id, self._segment_path(segment_id))
+            except FileNotFoundError:
+                # Merged away by another process since, the next refresh won't see it
+                pass
+
+        for document_id, length in connection.execute(
+            "SELECT id, length FROM documents WHERE id >= ? ORDER BY id", (len(self._lengths),)
+        ):
+            self._lengths.extend([0] * (document_id + 1 - len(self._lengths)))
+            self._lengths[document_id] = length
+
+    def _has(self, url: str) -> bool:
+        if url in self._buffer:
+            return True
+        return (
+            self._connect().execute("SELECT 1 FROM documents WHERE url = ?", (url,)).fetchone()
+            is not None
+        )
+
+    def _add(self, url: str, text: str, summary: PaperSummary):
+        with self._lock:
+            if self._has(url):
+                return
+        # Tokenizing a whole paper takes a while, searches can carry on meanwhile
+        document = self._document(url, text, summary)
+        with self._lock:
+            if self._has(url):
+                return
+            self._buffer[url] = document
+            self.added += 1
+            if len(self._buffer) >= self.flush_docs:
+                self._flush()
+                self._maybe_merge()
+
+    def _write_segment(self, segment_id: int, postings: dict[str, array]) -> list[tuple]:
+        # Written under a temporary name, so a segment file is only ever there complete
+        path = self._segment_path(segment_id)
+        terms = []
+        offset = 0
+        with open(path + ".tmp", "wb") as file:
+            for term in sorted(postings):
+                term_postings = postings[term]
+                term_postings.tofile(file)
+                count = len(term_postings) // 2
+                terms.append((term, segment_id, offset, count))
+                offset += count
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(path + ".tmp", path)
+        return terms
+
+    def _flush(self):
+        if not self._buffer:
+            return
+        connection = self._connect()
+        connection.execute("BEGIN IMMEDIATE")
+        try:
+            postings: dict[str, array] = {}
+            for document in self._buffer.values():
+                cursor = connection.execute(
+                    "INSERT OR IGNORE INTO documents (url, length, summary) VALUES (?, ?, ?)",
+                    (document.url, document.length, document.summary_json),
+                )
+                if not cursor.rowcount:
+                    # Another process got there first
+                    continue
+                document_id = cursor.lastrowid
+                for term, frequency in document.words.items():
+                    postings.setdefault(term, array(POSTING_TYPECODE)).extend(
+                        (document_id, frequency)
+                    )
+            if not postings:
+                connection.execute("COMMIT")
+                self._buffer.clear()
+                return
+
+            segment_id = connection.execute(
+                "INSERT INTO segments (postings) VALUES (?)",
+                (sum(len(term_postings) // 2 for term_postings in postings.values()),),
+            ).lastrowid
+            connection.executemany(
+                "INSERT INTO terms (term, segment, offset, count) VALUES (?, ?, ?, ?)",
+                self._write_segment(segment_id, postings),
+            )
+            connection.execute("COMMIT")
+        except BaseException:
+            connection.execute("ROLLBACK")
+            raise
+        self._buffer.clear()
+
+    def _maybe_merge(self):
+        connection = self._connect()
+        connection.execute("BEGIN IMMEDIATE")
+        try:
+            segments = connection.execute(
+                "SELECT id, postings FROM segments ORDER BY postings, id"
+            ).fetchall()
+            if len(segments) <= self.max_segments:
+                connection.execute("COMMIT")
+                return
+
+            # The smallest, so a big segment is rewritten rarely, and only ever alongside
+            # ones adding up to a good part of its size
+            merged = sorted(segment_id for segment_id, _ in segments[: len(segments) - self.max_segments + 1])
+            self._refresh()
+            merged_id = connection.execute(
+                "INSERT INTO segments (postings) VALUES (?)",
+                (sum(postings for segment_id, postings in segments if segment_id in merged),),
+            ).lastrowid
+
+            placeholders = ",".join("?" * len(merged))
+            rows = connection.execute(
+                f"SELECT term, segment, offset, count FROM terms WHERE segment IN ({placeholders}) ORDER BY term, segment",
+                merged,
+            ).fetchall()
+            postings: dict[str, array] = {}
+            for term, segment_id, offset, count in rows:
+                postings.setdefault(term, array(POSTING_TYPECODE)).frombytes(
+                    self._segments[segment_id].read_bytes(offset, count)
+                )
+            terms = self._write_segment(merged_id, postings)
+            del postings
+
+            connection.execute(f"DELETE FROM terms WHERE segment IN ({placeholders})", merged)
+            connection.execute(f"DELETE FROM segments WHERE id IN ({placeholders})", merged)
+            connection.executemany(
+                "INSERT INTO terms (term, segment, offset, count) VALUES (?, ?, ?, ?)", terms
+            )
+            connection.execute("COMMIT")
+        except BaseException:
+            connection.execute("ROLLBACK")
+            raise
+
+        self.merges += 1
+        for segment_id in merged:
+            self._segments.pop(segment_id).close()
+            # Anybody else with it mapped keeps reading it until they notice, that's fine on POSIX
+            os.unlink(self._segment_path(segment_id))
+
+    def _search(self, words: list[str], n: int) -> list[PaperIndexHit]:
+        with self._lock:
+            self._refresh()
+            connection = self._connect()
+            query = sorted(set(words))
+            if not query:
+                return []
+
+            documents, total_length = connection.execute(
+                "SELECT COUNT(*), COALESCE(SUM(length), 0) FROM documents"
+            ).fetchone()
+            documents += len(self._buffer)
+            total_length += sum(document.length for document in self._buffer.values())
+            if not documents:
+                return []
+            average_length = total_length / documents
+
+            placeholders = ",".join("?" * len(query))
+            locations: dict[str, list[tuple[int, int, int]]] = {}
+            frequency: Counter[str] = Counter()
+            for term, segment_id, offset, count in connection.execute(
+                f"SELECT term, segment, offset, count FROM terms WHERE term IN ({placeholders})",
+                query,
+            ):
+                locations.setdefault(term, []).append((segment_id, offset, count))
+                frequency[term] += count
+            for document in self._buffer.values():
+                for term in query:
+                    frequency[term] += term in document.words
+
+            # Normalized like the relevance filter's, so `min_score` means the same however long the query is
+            idf = {
+                term: math.log(
+                    1 + (documents - frequency[term] + 0.5) / (frequency[term] + 0.5)
+                )
+                for term in query
+            }
+            max_score = sum(idf.values())
+
+            def _term_score(term: str, tf: int, length: int) -> float:
+                return idf[term] * tf / (tf + BM25_K1 * (1 - BM25_B + BM25_B * length / average_length))
+
+            scores: dict[int, float] = {}
+            lengths = self._lengths
+            for term, term_locations in locations.items():
+                for segment_id, offset, count in term_locations:
+                    segment = self._segments.get(segment_id)
+                    if segment is None:
+                        continue
+                    postings = segment.read(offset, count)
+                    try:
+                        for i in range(0, len(postings), 2):
+                            document_id = postings[i]
+                            scores[document_id] = scores.get(document_id, 0.0) + _term_score(
+                                term, postings[i + 1], lengths[document_id]
+                            )
+                    finally:
+                        postings.release()
+
+            buffered = {}
+            for document in self._buffer.values():
+                score = sum(
+                    _term_score(term, document.words[term], document.length)
+                    for term in query
+                    if term in document.words
+                )
+                if score:
+                    buffered[document.url] = score
+
+            top = heapq.nlargest(
+                n,
+                [(score / max_score, "id", document_id) for document_id, score in scores.items()]
+                + [(score / max_score, "url", url) for url, score in buffered.items()],
+            )
+            top = [hit for hit in top if hit[0] >= self.min_score]
+
+            hits = []
+            for score, kind, key in top:
+                if kind == "url":
+                    url, summary_json = key, self._buffer[key].summary_json
+                else:
+                    url, summary_json = connection.execute(
+                        "SELECT url, summary FROM documents WHERE id = ?", (key,)
+                    ).fetchone()
+                hits.append(
+                    PaperIndexHit(
+                        url=url,
+                        score=score,
+                        summary=PaperSummary.model_validate_json(summary_json),
+                    )
+                )
+            self.searches += 1
+            return hits
+
+    def _document(self, url: str, text: str, summary: PaperSummary) -> _Document:
+        # The title and summary count for more than any one page of the text, so they're in twice
+        words = tokenize(text[: self.max_chars])
+        words += 2 * tokenize(f"{summary.title}\n{summary.summary}")
+        return _Document(url, summary.model_dump_json(), Counter(words), len(words))
+
+    async def add_async(self, url: str, text: str, summary: PaperSummary):
+        # Tokenizing a whole paper and writing segments takes a while, keep it off the event loop
+        await asyncio.to_thread(self._add, url, text, summary)
+
+    async def search_async(self, query: str, n: int) -> list[PaperIndexHit]:
+        return await asyncio.to_thread(self._search, tokenize(query), n)
+
+    def stats(self) -> dict:
+        return {
+            "added": self.added,
+            "buffered": len(self._buffer),
+            "segments": len(self._segments),
+            "searches": self.searches,
+            "merges": self.merges,
+        }
+
+    def _close(self):
+        with self._lock:
+            if self._buffer:
+                self._flush()
+            for segment in self._segments.values():
+                segment.close()
+            self._segments.clear()
+            if self._connection is not None:
+                self._connection.close()
+                self._connection = None
+
+    async def close_async(self):
+        await asyncio.to_thread(self._close)
+
+
+class IndexingPaperSummaryGenerator(PaperSummaryGenerator):
+    # Adds every paper summarized to the index, along with its text. The text was just extracted
+    # for the summary, so getting it again comes from the paper cache.
+
+    def __init__(
+        self,
+        paper_summary_generator: PaperSummaryGenerator,
+        paper_text_extractor: PaperTextExtractor,
+        index: PaperIndex,
+    ):
+        self.paper_summary_generator = paper_summary_generator
+        self.paper_text_extractor = paper_text_extractor
+        self.index = index
+
+    async def _index_async(self, url: str, summary: PaperSummary):
+        try:
+            paper_text = await self.paper_text_extractor.extract_paper_text_async(
+                url, PAPER_TEXT_MAX_CHARS
+            )
+            await self.index.add_async(url, paper_text.text, summary)
+        except Exception as e:
+            # The summary is what matters, it's only missing from future searches
+            logger.warning("Failed to index paper: %s: %r", url, e)
+
+    async def read_paper_async(self, url: str) -> PaperSummary:
+        summary = await self.paper_summary_generator.read_paper_async(url)
+        await self._index_async(url, summary)
+        return summary
+
+    async def stream_paper_async(
+        self, url: str
+    ) -> AsyncIterator[PartialPaperSummary | PaperSummary]:
+        async for summary in self.paper_summary_generator.stream_paper_async(url):
+            if isinstance(summary, PaperSummary):
+                await self._index_async(url, summary)
+            yield summary
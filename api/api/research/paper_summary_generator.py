@@ -1,13 +1,43 @@
 import abc
-from typing import List
+import asyncio
+import time
+from typing import AsyncIterator, List
 
-from api.config import OPENAI_PAPER_TEXT_CONTEXT_LENGTH
-from api.llm.openai_client import OpenAIClientWrapper, OpenAIModel
-from api.llm.prompt_builder import PromptBuilder
-from api.llm.yaml_parser import parse_yaml_object
+from api.config import (
+    OPENAI_PAPER_TEXT_TOKEN_BUDGET,
+    PAPER_TEXT_MAX_CHARS,
+    PAPER_SUMMARY_BATCH_MAX_PAPERS,
+    PAPER_SUMMARY_BATCH_TOKEN_BUDGET,
+    PAPER_SUMMARY_BATCH_WAIT_SECONDS,
+    PAPER_SUMMARY_MODE,
+    PAPER_SUMMARY_STREAM_UPDATE_INTERVAL_SECONDS,
+)
+from api.llm.json_parser import IncrementalJsonArrayParser, parse_json_object
+from api.llm.openai_client import OpenAIClientWrapper, OpenAIModel, OpenAIParams
+from api.llm.prompt_builder import Prompt, PromptBuilder
+from api.llm.tokens import get_token_counter
+from api.llm.yaml_parser import IncrementalYamlObjectParser, parse_yaml_object
+from api.research.paper_cache import PaperCache
+from api.research.paper_text_condenser import (
+    PAPER_TEXT_CONDENSER_VERSION,
+    PaperTextCondenser,
+)
 from api.research.paper_text_extractor import PaperTextExtractor
+from api.research.scheduler import PipelineStage, StageScheduler, stage_slot
+from api.research.single_flight import SingleFlight
+from api.research.url_normalizer import fetchable_paper_url, normalize_paper_url
+from api.telemetry.metrics import PAPER_SUMMARY_BATCH_MISSES, PAPER_SUMMARY_BATCH_PAPERS
+from api.telemetry.tracing import span
 from api.types import Paper
-from pydantic import BaseModel, Field
+from pydantic import BaseModel, Field, ValidationError
+
+
+class PartialPaperSummary(BaseModel):
+    # A summary that's still being written, with whatever has arrived so far
+    title: str | None = None
+    summary: str | None = None
+    authors: List[str] | None = None
+    publisher: str | None = None
 
 
 class PaperSummary(BaseModel):
@@ -22,10 +52,12 @@ class PaperSummary(BaseModel):
     )
 
     @classmethod
-    def to_paper(cls, paper_summary: "PaperSummary", url: str) -> Paper:
+    def to_paper(
+        cls, paper_summary: "PaperSummary | PartialPaperSummary", url: str
+    ) -> Paper:
         return Paper(
             title=paper_summary.title,
-            summary=paper_summary.summary,
+            summary=paper_summary.summary or "",
             url=url,
             authors=paper_summary.authors,
             publisher=paper_summary.publisher,
@@ -36,30 +68,301 @@ class PaperSummaryGenerator(abc.ABC):
     async def read_paper_async(self, url: str) -> PaperSummary:
         pass
 
+    async def stream_paper_async(
+        self, url: str
+    ) -> AsyncIterator[PartialPaperSummary | PaperSummary]:
+        # Partial summaries while the paper is being read, always finishing with the complete one.
+        # Generators that can't stream just yield the complete summary.
+        yield await self.read_paper_async(url)
+
+
+# Bump when the prompt changes in a way that should invalidate cached summaries
+PAPER_SUMMARY_PROMPT_VERSION = 1
+PAPER_SUMMARY_BATCH_PROMPT_VERSION = 1
+
+PAPER_SUMMARY_SYSTEM_PROMPT = """
+You are an academic researcher. You are an expert in reading scientific papers and summarizing them,
+so that other researchers can quickly understand their chief claims, discoveries, and conclusions.
+"""
+
+
+class BatchedPaperSummary(PaperSummary):
+    id: int = Field(description="The id of the paper summarized")
+
+
+class PaperSummaryMissingError(Exception):
+    pass
+
+
+class _PendingPaper:
+    def __init__(self, text: str, tokens: int, future: asyncio.Future):
+        self.text = text
+        self.tokens = tokens
+        self.future = future
+
+
+class PaperSummaryBatcher:
+    # Summarizes papers that are ready at about the same time in one request, for fewer round trips
+    # per paper. A paper waits up to `wait_seconds` for company, and the batch goes as soon as it's
+    # full or out of tokens.
+    #
+    # The response is JSON, one summary per paper, and streamed: each paper gets its summary as soon
+    # as its part of the response has arrived and validated, not when the whole batch is done.
+    # Papers the response leaves out or gets wrong are summarized again on their own.
+    #
+    # Shared process-wide, so papers from different researches can share a request.
+
+    def __init__(
+        self,
+        openai_client: OpenAIClientWrapper,
+        model: OpenAIModel = OpenAIModel.GPT_3_5_TURBO_0125,
+        max_papers: int = PAPER_SUMMARY_BATCH_MAX_PAPERS,
+        token_budget: int = PAPER_SUMMARY_BATCH_TOKEN_BUDGET,
+        wait_seconds: float = PAPER_SUMMARY_BATCH_WAIT_SECONDS,
+    ):
+        self.openai_client = openai_client
+        self.model = model
+        self.max_papers = max_papers
+        self.token_budget = token_budget
+        self.wait_seconds = wait_seconds
+        self._pending: list[_PendingPaper] = []
+        self._pending_tokens = 0
+        self._timer: asyncio.TimerHandle | None = None
+        self._requests: set[asyncio.Task] = set()
+        self.requests = 0
+        self.papers = 0
+        self.misses = 0
+
+    async def summarize_async(self, text: str, tokens: int) -> tuple[PaperSummary, int]:
+        # The summary, and how many papers shared the request for it
+        loop = asyncio.get_running_loop()
+        if self._pending and self._pending_tokens + tokens > self.token_budget:
+            self._flush()
+
+        paper = _PendingPaper(text, tokens, loop.create_future())
+        self._pending.append(paper)
+        self._pending_tokens += tokens
+        if len(self._pending) >= self.max_papers or self._pending_tokens >= self.token_budget:
+            self._flush()
+        elif self._timer is None:
+            self._timer = loop.call_later(self.wait_seconds, self._flush)
+
+        # Whoever gives up waiting cancels the future, and the paper is left out if it hasn't gone yet
+        return await paper.future
+
+    def _flush(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        batch = [paper for paper in self._pending if not paper.future.done()]
+        self._pending, self._pending_tokens = [], 0
+        if batch:
+            self._send(batch)
+
+    def _send(self, batch: list[_PendingPaper]):
+        task = asyncio.create_task(self._send_async(batch))
+        self._requests.add(task)
+        task.add_done_callback(self._requests.discard)
+
+    @classmethod
+    def build_prompt(cls, texts: list[str]) -> Prompt:
+        # Not `str.format`, the example is full of braces
+        papers = "\n\n".join(
+            f'<paper id="{id}">\n{text}\n</paper>' for id, text in enumerate(texts)
+        )
+        return (
+            PromptBuilder.system(PAPER_SUMMARY_SYSTEM_PROMPT)
+            .user(
+                """
+Papers:
+
+"""
+                + papers
+                + """
+
+
+Instructions:
+* Read the text of each paper carefully. It may be truncated or missing sections, but it's important to understand the main points.
+* Focus on the context (specific field of research, problem addressed), methodology (how the research was conducted), and conclusions (the main findings and their implications).
+* Summarize every paper on its own, never mix up details from different papers.
+
+Response format:
+Write a JSON object with a "papers" list holding one summary for each paper, in the order the papers were given.
+Each summary is a JSON object equivalent to type $BatchedPaperSummary, according to the Pydantic definitons below.
+
+class BatchedPaperSummary(BaseModel):
+    id: int = Field(description="The id of the paper summarized")
+    title: str = Field(description="The title of the paper")
+    summary: str = Field(description="A brief summary of the paper")
+    authors: List[str] | None = Field(description="The authors of the paper", default=None)
+    publisher: str | None = Field(description="The journal or other venue where the paper was published", default=None)
+
+
+Example response:
+{"papers": [{"id": 0, "title": "The title of the paper", "summary": "A summary of the paper with the context, methodology, and conclusions.", "authors": ["Author 1", "Author 2"], "publisher": "Cornell University Press"}]}
+
+
+Your response:
+"""
+            )
+            .build()
+        )
+
+    def _resolve(self, batch: list[_PendingPaper], element: str):
+        try:
+            item = parse_json_object(element, BatchedPaperSummary)
+        except ValidationError:
+            # Left for a request of its own
+            return
+        if not 0 <= item.id < len(batch) or batch[item.id].future.done():
+            return
+        summary = PaperSummary.model_validate(item.model_dump(exclude={"id"}))
+        batch[item.id].future.set_result((summary, len(batch)))
+
+    async def _send_async(self, batch: list[_PendingPaper]):
+        self.requests += 1
+        self.papers += len(batch)
+        PAPER_SUMMARY_BATCH_PAPERS.observe(len(batch))
+        prompt = self.build_prompt([paper.text for paper in batch])
+        params = OpenAIParams(response_format={"type": "json_object"})
+        parser = IncrementalJsonArrayParser()
+        try:
+            with span("summarize_batch", papers=len(batch)):
+                async for chunk in self.openai_client.stream_completion_async(
+                    self.model, prompt, params
+                ):
+                    for element in parser.feed(chunk):
+                        self._resolve(batch, element)
+        except Exception as e:
+            for paper in batch:
+                if not paper.future.done():
+                    paper.future.set_exception(e)
+            return
+
+        missing = [paper for paper in batch if not paper.future.done()]
+        if not missing:
+            return
+        if len(batch) == 1:
+            missing[0].future.set_exception(
+                PaperSummaryMissingError("The response had no valid summary for the paper")
+            )
+            return
+        self.misses += len(missing)
+        PAPER_SUMMARY_BATCH_MISSES.inc(len(missing))
+        for paper in missing:
+            self._send([paper])
+
+    def stats(self) -> dict:
+        return {
+            "requests": self.requests,
+            "papers": self.papers,
+            "papers_per_request": self.papers / self.requests if self.requests else 0.0,
+            "misses": self.misses,
+            "pending": len(self._pending),
+        }
+
 
 class OpenAIPaperSummaryGenerator(PaperSummaryGenerator):
     def __init__(
         self,
         paper_text_extractor: PaperTextExtractor,
         openai_client: OpenAIClientWrapper,
+        cache: PaperCache | None = None,
+        model: OpenAIModel = OpenAIModel.GPT_3_5_TURBO_0125,
+        scheduler: StageScheduler | None = None,
+        streaming: bool = PAPER_SUMMARY_MODE == "streaming",
+        stream_update_interval: float = PAPER_SUMMARY_STREAM_UPDATE_INTERVAL_SECONDS,
+        token_budget: int = OPENAI_PAPER_TEXT_TOKEN_BUDGET,
+        batcher: PaperSummaryBatcher | None = None,
     ):
         self.paper_text_extractor = paper_text_extractor
         self.openai_client = openai_client
+        self.cache = cache
+        self.model = model
+        self.scheduler = scheduler
+        self.streaming = streaming
+        self.stream_update_interval = stream_update_interval
+        self.token_budget = token_budget
+        self.batcher = batcher
+        self.condenser = PaperTextCondenser(get_token_counter(model))
+        # Shares of requests when batched, so it adds up to the requests made
+        self.llm_calls: float = 0
+
+    def _summary_cache_params(self) -> str:
+        if self.batcher is not None:
+            version = f"b{PAPER_SUMMARY_BATCH_PROMPT_VERSION}"
+        else:
+            version = f"v{PAPER_SUMMARY_PROMPT_VERSION}"
+        return f"{self.model.value}:{version}:c{PAPER_TEXT_CONDENSER_VERSION}:{self.token_budget}"
 
     async def read_paper_async(self, url: str) -> PaperSummary:
+        async for summary in self._read_paper_async(url, streaming=False):
+            pass
+        return summary
+
+    async def stream_paper_async(
+        self, url: str
+    ) -> AsyncIterator[PartialPaperSummary | PaperSummary]:
+        async for summary in self._read_paper_async(url, streaming=self.streaming):
+            yield summary
+
+    async def _read_paper_async(
+        self, url: str, streaming: bool
+    ) -> AsyncIterator[PartialPaperSummary | PaperSummary]:
         # Get the text
-        text = await self.paper_text_extractor.extract_paper_text_async(
-            url, OPENAI_PAPER_TEXT_CONTEXT_LENGTH
+        paper_text = await self.paper_text_extractor.extract_paper_text_async(
+            url, PAPER_TEXT_MAX_CHARS
         )
 
-        # Build prompt
-        prompt = (
-            PromptBuilder.system(
-                """
-You are an academic researcher. You are an expert in reading scientific papers and summarizing them,
-so that other researchers can quickly understand their chief claims, discoveries, and conclusions.
-"""
+        # Same content has been summarized before, no need to pay for it again
+        use_cache = self.cache is not None and paper_text.sha256 is not None
+        if use_cache:
+            cached_summary = await self.cache.get_summary_async(
+                paper_text.sha256, self._summary_cache_params(), PaperSummary
+            )
+            if cached_summary is not None:
+                yield cached_summary
+                return
+
+        # Only pay for the parts of the paper that matter. Tokenizing a whole paper
+        # takes a while, so keep it off the event loop (and loading the tokenizer the first time).
+        await self.condenser.token_counter.load_async()
+        with span("condense", url=url) as condense_span:
+            condensed = await asyncio.to_thread(
+                self.condenser.condense, paper_text.text, self.token_budget
+            )
+            condense_span.set(
+                tokens=condensed.tokens, original_tokens=condensed.original_tokens
             )
+
+        async with stage_slot(self.scheduler, PipelineStage.SUMMARIZE):
+            # Including parsing and validating what comes back, and waiting for whoever's streaming it
+            with span(
+                "summarize", url=url, streaming=streaming, batched=self.batcher is not None
+            ):
+                if self.batcher is not None:
+                    summary, batch_size = await self.batcher.summarize_async(
+                        condensed.text, condensed.tokens
+                    )
+                    self.llm_calls += 1 / batch_size
+                elif streaming:
+                    async for summary in self._stream_summary_async(condensed.text):
+                        if isinstance(summary, PartialPaperSummary):
+                            yield summary
+                else:
+                    summary = await self._summarize_async(condensed.text)
+
+        if use_cache:
+            await self.cache.set_summary_async(
+                paper_text.sha256, self._summary_cache_params(), summary
+            )
+
+        yield summary
+
+    @classmethod
+    def build_prompt(cls, text: str) -> Prompt:
+        return (
+            PromptBuilder.system(PAPER_SUMMARY_SYSTEM_PROMPT)
             .user(
                 """
 Paper text: 
@@ -105,10 +408,152 @@ Your response:
             .build()
         )
 
+    async def _summarize_async(self, text: str) -> PaperSummary:
+        # Build prompt
+        prompt = self.build_prompt(text)
+
         # Generate summary of the paper
-        response = await self.openai_client.get_completion_async(
-            OpenAIModel.GPT_3_5_TURBO_0125, prompt
-        )
+        self.llm_calls += 1
+        response = await self.openai_client.get_completion_async(self.model, prompt)
 
         # Parse the response
         return parse_yaml_object(response, PaperSummary)
+
+    async def _stream_summary_async(
+        self, text: str
+    ) -> AsyncIterator[PartialPaperSummary | PaperSummary]:
+        prompt = self.build_prompt(text)
+        parser = IncrementalYamlObjectParser()
+        last_partial = None
+        last_sent = 0.0
+        self.llm_calls += 1
+
+        async for chunk in self.openai_client.stream_completion_async(
+            self.model, prompt
+        ):
+            try:
+                partial = PartialPaperSummary.model_validate(parser.feed(chunk))
+            except ValidationError:
+                # Half-written in some shape we don't understand yet, the full parse will sort it out
+                continue
+
+            # Once the summary has started the title is done, which is what makes it worth showing
+            if partial.title is None or partial.summary is None:
+                continue
+            if partial == last_partial:
+                continue
+
+            # Show the paper straight away, then only every so often while it's written
+            now = time.monotonic()
+            if last_partial is not None and now - last_sent < self.stream_update_interval:
+                continue
+
+            last_partial, last_sent = partial, now
+            yield partial
+
+        # What's shown in the end is only ever the properly parsed and validated response
+        yield parse_yaml_object(parser.buffer, PaperSummary)
+
+
+class SingleFlightPaperSummaryGenerator(PaperSummaryGenerator):
+    # Papers are read once no matter how many searches (or users) ask for them at the same time.
+    # The single flight is shared process-wide, so it's passed in rather than created here.
+
+    def __init__(
+        self,
+        paper_summary_generator: PaperSummaryGenerator,
+        single_flight: SingleFlight[PaperSummary],
+    ):
+        self.paper_summary_generator = paper_summary_generator
+        self.single_flight = single_flight
+        # Everybody streaming a paper, so partial summaries from whoever is reading it reach them all
+        self._listeners: dict[str, set[asyncio.Queue]] = {}
+
+    async def read_paper_async(self, url: str) -> PaperSummary:
+        # Coalesced on the normalized URL, but whoever gets there first has the paper read from
+        # the URL it was found at (or an arXiv abstract's PDF), normalizing it might break it
+        return await self.single_flight.do(
+            normalize_paper_url(url),
+            lambda: self.paper_summary_generator.read_paper_async(fetchable_paper_url(url)),
+        )
+
+    async def _stream_to_listeners_async(self, url: str, key: str) -> PaperSummary:
+        summary = None
+        async for update in self.paper_summary_generator.stream_paper_async(url):
+            if isinstance(update, PaperSummary):
+                summary = update
+            else:
+                for listener in self._listeners.get(key, ()):
+                    listener.put_nowait(update)
+
+        if summary is None:
+            raise RuntimeError(f"No summary was generated: {url}")
+        return summary
+
+    async def stream_paper_async(
+        self, url: str
+    ) -> AsyncIterator[PartialPaperSummary | PaperSummary]:
+        # Like `read_paper_async`, coalesced on the normalized URL and read from the original one
+        key = normalize_paper_url(url)
+        updates: asyncio.Queue = asyncio.Queue()
+        listeners = self._listeners.setdefault(key, set())
+        listeners.add(updates)
+
+        result = asyncio.ensure_future(
+            self.single_flight.do(
+                key, lambda: self._stream_to_listeners_async(fetchable_paper_url(url), key)
+            )
+        )
+        next_update = None
+        try:
+            while True:
+                next_update = asyncio.ensure_future(updates.get())
+                await asyncio.wait(
+                    {next_update, result}, return_when=asyncio.FIRST_COMPLETED
+                )
+                if not next_update.done():
+                    break
+                yield next_update.result()
+
+            yield await result
+        finally:
+            if next_update is not None and not next_update.done():
+                next_update.cancel()
+            if not result.done():
+                result.cancel()
+
+            listeners.discard(updates)
+            if not listeners and self._listeners.get(key) is listeners:
+                del self._listeners[key]
+
+
+class MemoizingPaperSummaryGenerator(PaperSummaryGenerator):
+    # Remembers every paper it's read (or failed to read) for as long as it's around, e.g. for
+    # one batch, so the same URL found by different prompts is only ever read once
+
+    def __init__(self, paper_summary_generator: PaperSummaryGenerator):
+        self.paper_summary_generator = paper_summary_generator
+        self._summaries: dict[str, PaperSummary | Exception] = {}
+        self.requests = 0
+        self.hits = 0
+
+    async def read_paper_async(self, url: str) -> PaperSummary:
+        key = normalize_paper_url(url)
+        self.requests += 1
+
+        known = self._summaries.get(key)
+        if known is not None:
+            self.hits += 1
+            if isinstance(known, Exception):
+                raise known
+            return known
+
+        # Reads of the same URL at the same time are coalesced further down, by the single flight
+        try:
+            summary = await self.paper_summary_generator.read_paper_async(url)
+        except Exception as e:
+            self._summaries[key] = e
+            raise
+
+        self._summaries[key] = summary
+        return summary
@@ -0,0 +1,265 @@
+import re
+from collections import Counter
+
+from api.llm.tokens import TokenCounter
+from pydantic import BaseModel
+
+# Bump when condensing changes in a way that should invalidate cached summaries
+PAPER_TEXT_CONDENSER_VERSION = 3
+
+# Extracted PDF text keeps its pages apart with this, so repeated headers and footers can be spotted
+PAGE_SEPARATOR = "\f"
+
+# Only the first and last few lines of a page can be running headers/footers
+PAGE_EDGE_LINES = 3
+
+PAGE_NUMBER = re.compile(r"^(?:page\s*)?\d{1,4}(?:\s*(?:of|/)\s*\d{1,4})?$", re.IGNORECASE)
+HYPHENATED_LINE_BREAK = re.compile(r"(\w)-\n(?=[a-z])")
+WHITESPACE = re.compile(r"\s+")
+
+SECTION_HEADING = re.compile(
+    r"^(?:(?:\d+(?:\.\d+)*|[IVX]+)\.?\s+)?"
+    r"(abstract|introduction|background|related work|methods?|methodology|experiments?|results?|"
+    r"discussion|conclusions?|concluding remarks|summary|future work|limitations|"
+    r"references|bibliography|acknowledge?ments?|appendix|appendices)\b",
+    re.IGNORECASE,
+)
+# Anything longer is a sentence that happens to start with one of those words
+MAX_HEADING_CHARS = 60
+MAX_HEADING_EXTRA_WORDS = 4
+
+# Sections that are never worth paying for, everything after them usually isn't either (in the second
+# half of the paper, so a table of contents doesn't count, like `pdf_text_parser` does it)
+TRAILING_SECTIONS = {"references", "bibliography", "appendix", "appendices"}
+DROPPED_SECTIONS = TRAILING_SECTIONS | {"acknowledgments", "acknowledgements"}
+
+# Share of the budget each section is guaranteed before the rest is handed out, in priority order.
+# The preamble is whatever comes before the first heading, i.e. the title and authors.
+SECTION_SHARES = {
+    "preamble": 0.1,
+    "abstract": 0.25,
+    "introduction": 0.2,
+    "conclusion": 0.25,
+}
+CONCLUDING_SECTIONS = {"conclusion", "conclusions", "concluding remarks", "summary"}
+
+# Without any headings to go on, keep this much of the budget for the end of the text
+UNSTRUCTURED_TAIL_SHARE = 0.25
+
+
+class CondensedText(BaseModel):
+    text: str
+    tokens: int
+    original_tokens: int
+
+
+class _Section:
+    def __init__(self, name: str, heading: str):
+        self.name = name
+        self.heading = heading
+        self.lines: list[str] = []
+        self.text = ""
+        self.tokens = 0
+        self.allocated = 0
+
+    @property
+    def kind(self) -> str:
+        if self.name in CONCLUDING_SECTIONS:
+            return "conclusion"
+        return self.name
+
+
+class PaperTextCondenser:
+    # Squeezes extracted paper text into a token budget: drops running headers/footers, page numbers,
+    # hyphenation and the references, then fills the budget with the parts that say the most first.
+
+    def __init__(self, token_counter: TokenCounter):
+        self.token_counter = token_counter
+
+    @classmethod
+    def _normalize_line(cls, line: str) -> str:
+        # Running headers/footers usually only differ by their page number
+        return re.sub(r"\d+", "#", line.lower())
+
+    @classmethod
+    def remove_boilerplate(cls, pages: list[list[str]]) -> list[list[str]]:
+        edge_lines = Counter()
+        for lines in pages:
+            edges = lines[:PAGE_EDGE_LINES] + lines[-PAGE_EDGE_LINES:]
+            edge_lines.update({cls._normalize_line(line) for line in edges})
+
+        # Seen at the top or bottom of at least half the pages
+        repeated = (
+            {line for line, count in edge_lines.items() if count >= len(pages) / 2}
+            if len(pages) >= 3
+            else set()
+        )
+
+        cleaned = []
+        for page_number, lines in enumerate(pages):
+            kept = []
+            for i, line in enumerate(lines):
+                at_edge = i < PAGE_EDGE_LINES or i >= len(lines) - PAGE_EDGE_LINES
+                if PAGE_NUMBER.match(line):
+                    continue
+                # The running header is often the title, which is worth keeping once
+                if page_number > 0 and at_edge and cls._normalize_line(line) in repeated:
+                    continue
+                kept.append(line)
+            cleaned.append(kept)
+        return cleaned
+
+    @classmethod
+    def split_sections(cls, lines: list[str]) -> list[_Section]:
+        sections = [_Section("preamble", "")]
+        for line in lines:
+            match = SECTION_HEADING.match(line)
+            if match is None:
+                sections[-1].lines.append(line)
+                continue
+
+            name = match.group(1).lower()
+            rest = line[match.end() :].lstrip(" .:-\u2014\u2013")
+            if name == "abstract" and rest:
+                # Often "Abstract—" is followed by the text on the same line
+                sections.append(_Section(name, match.group(0)))
+                sections[-1].lines.append(rest)
+            elif (
+                len(line) <= MAX_HEADING_CHARS
+                and len(rest.split()) <= MAX_HEADING_EXTRA_WORDS
+                and not line.endswith(".")
+            ):
+                sections.append(_Section(name, line))
+            else:
+                sections[-1].lines.append(line)
+
+        return [section for section in sections if section.lines or section.heading]
+
+    @classmethod
+    def _join_lines(cls, lines: list[str]) -> str:
+        text = HYPHENATED_LINE_BREAK.sub(r"\1", "\n".join(lines))
+        return WHITESPACE.sub(" ", text).strip()
+
+    def _allocate(self, sections: list[_Section], budget: int):
+        # Headings, separators and "[...]" cost a little too, the text has to fit around them
+        # or the end (usually the conclusion) is what gets cut to make it fit
+        overhead = self.token_counter.count(
+            "\n\n".join(
+                f"{section.heading}\n [...]" if section.heading else " [...]"
+                for section in sections
+            )
+        )
+        budget = max(0, budget - overhead)
+        remaining = budget
+
+        # First make sure the important sections get their share. A kind's share is split between
+        # its sections (e.g. a "Summary of ..." and the conclusion), and whatever the shorter ones
+        # don't need goes to the others, so the shares never add up to more than the budget.
+        for kind, share in SECTION_SHARES.items():
+            of_kind = sorted(
+                (section for section in sections if section.kind == kind),
+                key=lambda section: section.tokens,
+            )
+            kind_budget = int(budget * share)
+            for i, section in enumerate(of_kind):
+                section.allocated = min(section.tokens, kind_budget // (len(of_kind) - i))
+                kind_budget -= section.allocated
+                remaining -= section.allocated
+
+        # Then top them up, and let everything else have what's left, most important first
+        priority = list(SECTION_SHARES)
+        ordered = sorted(
+            sections,
+            key=lambda section: (
+                priority.index(section.kind)
+                if section.kind in priority
+                else len(priority)
+            ),
+        )
+        for section in ordered:
+            if remaining <= 0:
+                break
+            extra = min(section.tokens - section.allocated, remaining)
+            section.allocated += extra
+            remaining -= extra
+
+    def _condense_unstructured(self, text: str, budget: int) -> str:
+        # No idea where anything is, but papers tend to start and end with the good parts
+        tail_budget = int(budget * UNSTRUCTURED_TAIL_SHARE)
+        head = self.token_counter.truncate(text, budget - tail_budget)
+        # The " [...] " between them comes out of the tail's share, or cutting the whole thing down
+        # to the budget afterwards would take it off the end
+        tail_budget -= self.token_counter.count(" [...] ")
+        rest = text[len(head) :]
+        if not rest.strip():
+            return head
+
+        words = rest.split(" ")
+        tail = ""
+        # Take whole words from the end until the tail budget is used up
+        low, high = 0, len(words)
+        while low < high:
+            middle = (low + high) // 2
+            candidate = " ".join(words[middle:])
+            if self.token_counter.count(candidate) <= tail_budget:
+                tail, high = candidate, middle
+            else:
+                low = middle + 1
+        return f"{head} [...] {tail}" if tail else head
+
+    def condense(self, text: str, budget: int) -> CondensedText:
+        pages = [
+            [line.strip() for line in page.splitlines() if line.strip()]
+            for page in text.split(PAGE_SEPARATOR)
+        ]
+        lines = [line for page in self.remove_boilerplate(pages) for line in page]
+
+        sections = []
+        lines_before = 0
+        for section in self.split_sections(lines):
+            if section.name in TRAILING_SECTIONS and lines_before >= len(lines) // 2:
+                break
+            lines_before += len(section.lines) + bool(section.heading)
+            if section.name in DROPPED_SECTIONS:
+                continue
+            section.text = self._join_lines(section.lines)
+            section.tokens = self.token_counter.count(section.text)
+            sections.append(section)
+
+        original_tokens = self.token_counter.count(text)
+        total_tokens = sum(section.tokens for section in sections)
+
+        if budget <= 0 or total_tokens <= budget:
+            parts = [
+                f"{section.heading}\n{section.text}" if section.heading else section.text
+                for section in sections
+            ]
+            condensed = "\n\n".join(part for part in parts if part)
+        elif not any(section.kind in SECTION_SHARES for section in sections[1:]):
+            condensed = self._condense_unstructured(
+                " ".join(section.text for section in sections), budget
+            )
+        else:
+            self._allocate(sections, budget)
+            parts = []
+            for section in sections:
+                if section.allocated <= 0:
+                    continue
+                section_text = self.token_counter.truncate(section.text, section.allocated)
+                if section.allocated < section.tokens:
+                    section_text += " [...]"
+                parts.append(
+                    f"{section.heading}\n{section_text}" if section.heading else section_text
+                )
+            # Keep the paper's own order so it still reads like a paper
+            condensed = "\n\n".join(parts)
+
+        # Headings and separators cost a little too
+        if budget > 0 and self.token_counter.count(condensed) > budget:
+            condensed = self.token_counter.truncate(condensed, budget)
+
+        return CondensedText(
+            text=condensed,
+            tokens=self.token_counter.count(condensed),
+            original_tokens=original_tokens,
+        )
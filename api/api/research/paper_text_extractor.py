@@ -1,51 +1,115 @@
 import abc
-import tempfile
+import time
 
-from api.config import PAPER_DOWNLOAD_TIMEOUT_SECONDS
-from pypdf import PdfReader
-import httpx
+from api.research.paper_cache import CachedPaperUrl, PaperCache
+from api.research.paper_downloader import PaperDownloader
+from api.research.pdf_text_parser import PDFTextParserPool
+from api.research.paper_text_condenser import PAGE_SEPARATOR
+from api.research.scheduler import PipelineStage, StageScheduler, stage_slot
+from api.telemetry.metrics import PAPER_TEXT_CACHE, PDF_PAGES_PARSED
+from api.telemetry.tracing import span
+from pydantic import BaseModel
+
+# Bump when extraction changes in a way that should invalidate cached text
+PDF_TEXT_EXTRACTION_VERSION = 2
+
+
+class PaperText(BaseModel):
+    url: str
+    text: str
+    # Hash of the downloaded content, None if the extractor doesn't know it
+    sha256: str | None = None
 
 
 class PaperTextExtractor(abc.ABC):
     @abc.abstractmethod
-    async def extract_paper_text_async(self, url: str, max_chars: int = -1) -> str:
+    async def extract_paper_text_async(
+        self, url: str, max_chars: int = -1
+    ) -> PaperText:
         pass
 
 
 class PDFPaperTextExtractor(PaperTextExtractor):
-    async def extract_paper_text_async(self, url: str, max_chars: int = -1) -> str:
-        # Download the paper
-        async with httpx.AsyncClient() as client:
-            response = await client.get(
-                url, follow_redirects=True, timeout=PAPER_DOWNLOAD_TIMEOUT_SECONDS
-            )
+    def __init__(
+        self,
+        downloader: PaperDownloader,
+        parser_pool: PDFTextParserPool,
+        cache: PaperCache | None = None,
+        scheduler: StageScheduler | None = None,
+    ):
+        self.downloader = downloader
+        self.parser_pool = parser_pool
+        self.cache = cache
+        self.scheduler = scheduler
 
-        # Write to a temporary file
-        temp_pdf = tempfile.TemporaryFile()
-        temp_pdf.write(response.content)
+    async def _parse_async(self, path: str, max_chars: int) -> str:
+        async with stage_slot(self.scheduler, PipelineStage.PARSE):
+            with span("parse") as parse_span:
+                text = await self.parser_pool.extract_text_async(path, max_chars)
+                pages = text.count(PAGE_SEPARATOR) + 1
+                parse_span.set(pages=pages, chars=len(text))
+        PDF_PAGES_PARSED.observe(pages)
+        return text
 
-        total_chars = 0
-        try:
-            # Copy to temporyt file
-            temp_pdf.write(response.content)
-            temp_pdf.seek(0)
+    async def extract_paper_text_async(
+        self, url: str, max_chars: int = -1
+    ) -> PaperText:
+        if self.cache is None:
+            return await self._download_and_extract_async(url, max_chars)
 
-            # Extract text from PDF
-            reader = PdfReader(temp_pdf)
-            pages = []
-            for page in reader.pages:
-                page_text = page.extract_text()
+        params = f"v{PDF_TEXT_EXTRACTION_VERSION}:{int(max_chars)}"
 
-                chars_to_go = int(max_chars - total_chars)
-                total_chars += len(page_text)
+        # Do we already know what's at this URL, and have we extracted it before?
+        cached_url = await self.cache.get_url_async(url)
+        cached_text = None
+        if cached_url is not None:
+            cached_text = await self.cache.get_text_async(cached_url.sha256, params)
 
-                if max_chars > 0 and total_chars > max_chars:
-                    pages.append(page_text[:chars_to_go])
-                    break
+        if cached_text is not None and self.cache.is_fresh(cached_url):
+            PAPER_TEXT_CACHE.inc(result="hit")
+            return PaperText(url=url, text=cached_text, sha256=cached_url.sha256)
+
+        # Only revalidate if we'd have something to use on a 304
+        validators = cached_url if cached_text is not None else None
+
+        async with self.downloader.download_async(
+            url,
+            etag=validators.etag if validators else None,
+            last_modified=validators.last_modified if validators else None,
+        ) as paper:
+            if paper.not_modified:
+                await self.cache.set_url_async(
+                    url, cached_url.model_copy(update={"checked_at": time.time()})
+                )
+                PAPER_TEXT_CACHE.inc(result="revalidated")
+                return PaperText(url=url, text=cached_text, sha256=cached_url.sha256)
+
+            await self.cache.set_url_async(
+                url,
+                CachedPaperUrl(
+                    sha256=paper.sha256,
+                    etag=paper.etag,
+                    last_modified=paper.last_modified,
+                    checked_at=time.time(),
+                ),
+            )
 
-                pages.append(page_text)
+            # Same content might have been extracted before from a different URL
+            text = await self.cache.get_text_async(paper.sha256, params)
+            if text is None:
+                PAPER_TEXT_CACHE.inc(result="miss")
+                text = await self._parse_async(paper.path, max_chars)
+                await self.cache.set_text_async(paper.sha256, params, text)
+            else:
+                PAPER_TEXT_CACHE.inc(result="same_content")
 
-        finally:
-            temp_pdf.close()
+            return PaperText(url=url, text=text, sha256=paper.sha256)
 
-        return "\n".join(pages)
+    async def _download_and_extract_async(
+        self, url: str, max_chars: int
+    ) -> PaperText:
+        # Download the paper to a temporary file, which is cleaned up when we're done with it
+        async with self.downloader.download_async(url) as paper:
+            # Extract text from PDF in the parser pool
+            text = await self._parse_async(paper.path, max_chars)
+            return PaperText(url=url, text=text, sha256=paper.sha256)
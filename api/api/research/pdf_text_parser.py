@@ -0,0 +1,126 @@
+import asyncio
+import multiprocessing
+import re
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+from api.config import PDF_PARSER_MAX_QUEUE_DEPTH, PDF_PARSER_POOL_SIZE
+from api.research.paper_text_condenser import PAGE_SEPARATOR
+
+# Once the references start there's nothing else worth reading (in the second half of the paper,
+# so a table of contents doesn't count)
+REFERENCES_HEADING = re.compile(
+    r"^\s*(?:\d+\.?\s*|[IVX]+\.\s*)?(?:references|bibliography)\s*$",
+    re.IGNORECASE | re.MULTILINE,
+)
+
+
+def _ping() -> bool:
+    return True
+
+
+def extract_pdf_text(path: str, max_chars: int = -1) -> str:
+    # Runs inside a worker process, so only the file path goes in and only the text comes out.
+    # Which is also the only place `pypdf` is needed, the API process never imports it.
+    from pypdf import PdfReader
+
+    reader = PdfReader(path)
+    pages = []
+    total_chars = 0
+    for page_number, page in enumerate(reader.pages):
+        page_text = page.extract_text().replace(PAGE_SEPARATOR, " ")
+
+        chars_to_go = int(max_chars - total_chars)
+        total_chars += len(page_text)
+
+        if max_chars > 0 and total_chars >= max_chars:
+            # Budget met, don't bother parsing the rest of the pages
+            pages.append(page_text[:chars_to_go])
+            break
+
+        pages.append(page_text)
+
+        if page_number >= len(reader.pages) // 2 and REFERENCES_HEADING.search(
+            page_text
+        ):
+            break
+
+    # Pages are kept apart so repeated headers and footers can be recognized later
+    return PAGE_SEPARATOR.join(pages)
+
+
+class PDFTextParserPool:
+    def __init__(
+        self,
+        pool_size: int = PDF_PARSER_POOL_SIZE,
+        max_queue_depth: int = PDF_PARSER_MAX_QUEUE_DEPTH,
+    ):
+        self.pool_size = pool_size
+        self.max_queue_depth = max_queue_depth
+        self._executor: ProcessPoolExecutor | None = None
+
+        # Only `pool_size + max_queue_depth` jobs are handed to the executor at once,
+        # everything else waits here so the executor's own queue can't grow without bound
+        self._admission = asyncio.Semaphore(pool_size + max_queue_depth)
+        self._submitted = 0
+        self._waiting = 0
+
+    @property
+    def queue_depth(self) -> int:
+        # Jobs handed to the pool that aren't running yet, plus jobs waiting to be handed over
+        return max(0, self._submitted - self.pool_size) + self._waiting
+
+    @property
+    def in_flight(self) -> int:
+        return min(self._submitted, self.pool_size)
+
+    def stats(self) -> dict:
+        return {
+            "pool_size": self.pool_size,
+            "max_queue_depth": self.max_queue_depth,
+            "in_flight": self.in_flight,
+            "queue_depth": self.queue_depth,
+        }
+
+    def _get_executor(self) -> ProcessPoolExecutor:
+        if self._executor is None:
+            # Spawn rather than fork, the parent has event loop and search threads running
+            self._executor = ProcessPoolExecutor(
+                max_workers=self.pool_size,
+                mp_context=multiprocessing.get_context("spawn"),
+            )
+        return self._executor
+
+    async def extract_text_async(self, path: str, max_chars: int = -1) -> str:
+        self._waiting += 1
+        try:
+            await self._admission.acquire()
+        finally:
+            self._waiting -= 1
+
+        self._submitted += 1
+        try:
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(
+                self._get_executor(), extract_pdf_text, path, max_chars
+            )
+        except BrokenProcessPool:
+            # A worker died (e.g. a pathological PDF blew up its memory), start fresh next time
+            self.shutdown(wait=False)
+            raise
+        finally:
+            self._submitted -= 1
+            self._admission.release()
+
+    async def warm_up_async(self):
+        # Workers are started on demand, so keep them all busy at once to get them all started
+        loop = asyncio.get_running_loop()
+        executor = self._get_executor()
+        await asyncio.gather(
+            *(loop.run_in_executor(executor, _ping) for _ in range(self.pool_size))
+        )
+
+    def shutdown(self, wait: bool = True):
+        if self._executor is not None:
+            self._executor.shutdown(wait=wait, cancel_futures=True)
+            self._executor = None
@@ -0,0 +1,16 @@
+import re
+import unicodedata
+
+# Bump when prompts that were normalized the same may not be any more, or the other way round
+PROMPT_NORMALIZER_VERSION = 2
+
+WHITESPACE = re.compile(r"\s+")
+# Only what ends a sentence, "C++" and "C#" aren't "C"
+TRAILING_PUNCTUATION = re.compile(r"[\s.,;:!?…]+$")
+
+
+def normalize_prompt(prompt: str) -> str:
+    # Prompts that only differ in case, spacing or how the sentence ends are asking for the same research.
+    # Any other punctuation might be what the prompt is about, so it's kept.
+    prompt = unicodedata.normalize("NFKC", prompt).lower().replace("’", "'")
+    return TRAILING_PUNCTUATION.sub("", WHITESPACE.sub(" ", prompt).strip())
@@ -0,0 +1,235 @@
+import asyncio
+import random
+
+from api.config import (
+    SEARCH_RATE_LIMIT_BACKOFF_BASE_SECONDS,
+    SEARCH_RATE_LIMIT_BACKOFF_MAX_SECONDS,
+    SEARCH_RATE_LIMIT_BURST,
+    SEARCH_RATE_LIMIT_CIRCUIT_BREAKER_COOLDOWN_SECONDS,
+    SEARCH_RATE_LIMIT_CIRCUIT_BREAKER_THRESHOLD,
+    SEARCH_RATE_LIMIT_DECREASE_FACTOR,
+    SEARCH_RATE_LIMIT_INCREASE_PER_MINUTE,
+    SEARCH_RATE_LIMIT_INITIAL_PER_MINUTE,
+    SEARCH_RATE_LIMIT_MAX_PER_MINUTE,
+    SEARCH_RATE_LIMIT_MIN_PER_MINUTE,
+    SEARCH_RATE_LIMIT_TARGET_LATENCY_SECONDS,
+)
+from api.research.context import current_research_id
+from api.research.scheduler import NO_RESEARCH, FairLimiter
+from api.research.shared_state import open_state
+
+
+class CircuitOpenError(Exception):
+    pass
+
+
+class AdaptiveRateLimiter:
+    # Token bucket whose refill rate is tuned from what the upstream tells us (AIMD):
+    # * every success under the target latency nudges the rate up by a fixed amount
+    # * a throttle (429) cuts it by a factor, and backs everybody off for a jittered while
+    # * slow responses are an early warning, so they shave a little off the rate too
+    # * enough throttles in a row open the circuit: calls fail fast until the cooldown is over,
+    #   then a single probe call decides whether to close it again
+    # Callers take turns per research (round robin) to get at the bucket.
+    # With `shared_path` all of that is shared with every other process using it, see `SharedState`.
+
+    # How much a slow (but successful) response cuts the rate by
+    SLOW_RESPONSE_DECREASE_FACTOR = 0.9
+
+    def __init__(
+        self,
+        *,
+        initial_rate_per_minute: float,
+        min_rate_per_minute: float,
+        max_rate_per_minute: float,
+        burst: int,
+        increase_per_minute: float,
+        decrease_factor: float,
+        target_latency_seconds: float,
+        circuit_breaker_threshold: int,
+        circuit_breaker_cooldown_seconds: float,
+        backoff_base_seconds: float,
+        backoff_max_seconds: float,
+        shared_path: str | None = None,
+    ):
+        self.min_rate_per_minute = min_rate_per_minute
+        self.max_rate_per_minute = max_rate_per_minute
+        self.burst = burst
+        self.increase_per_minute = increase_per_minute
+        self.decrease_factor = decrease_factor
+        self.target_latency_seconds = target_latency_seconds
+        self.circuit_breaker_threshold = circuit_breaker_threshold
+        self.circuit_breaker_cooldown_seconds = circuit_breaker_cooldown_seconds
+        self.backoff_base_seconds = backoff_base_seconds
+        self.backoff_max_seconds = backoff_max_seconds
+
+        # Refilled from the beginning of time, i.e. a full bucket. A probe is in flight until
+        # `probing_until`, if it never reports back somebody else gets to probe after that.
+        self._state = open_state(
+            shared_path,
+            {
+                "rate_per_minute": initial_rate_per_minute,
+                "tokens": float(burst),
+                "refilled_at": 0.0,
+                "backoff_until": 0.0,
+                "circuit_open_until": 0.0,
+                "probing_until": 0.0,
+                "consecutive_throttles": 0.0,
+            },
+        )
+
+        # One caller at a time waits on the bucket, the rest queue fairly behind it
+        self._turnstile = FairLimiter(1, 1)
+
+        self.acquired = 0
+        self.throttled = 0
+        self.rejected = 0
+
+    @classmethod
+    def for_search(cls, shared_path: str | None = None) -> "AdaptiveRateLimiter":
+        return cls(
+            initial_rate_per_minute=SEARCH_RATE_LIMIT_INITIAL_PER_MINUTE,
+            min_rate_per_minute=SEARCH_RATE_LIMIT_MIN_PER_MINUTE,
+            max_rate_per_minute=SEARCH_RATE_LIMIT_MAX_PER_MINUTE,
+            burst=SEARCH_RATE_LIMIT_BURST,
+            increase_per_minute=SEARCH_RATE_LIMIT_INCREASE_PER_MINUTE,
+            decrease_factor=SEARCH_RATE_LIMIT_DECREASE_FACTOR,
+            target_latency_seconds=SEARCH_RATE_LIMIT_TARGET_LATENCY_SECONDS,
+            circuit_breaker_threshold=SEARCH_RATE_LIMIT_CIRCUIT_BREAKER_THRESHOLD,
+            circuit_breaker_cooldown_seconds=SEARCH_RATE_LIMIT_CIRCUIT_BREAKER_COOLDOWN_SECONDS,
+            backoff_base_seconds=SEARCH_RATE_LIMIT_BACKOFF_BASE_SECONDS,
+            backoff_max_seconds=SEARCH_RATE_LIMIT_BACKOFF_MAX_SECONDS,
+            shared_path=shared_path,
+        )
+
+    @property
+    def rate_per_minute(self) -> float:
+        with self._state.locked() as state:
+            return state["rate_per_minute"]
+
+    @property
+    def circuit_state(self) -> str:
+        with self._state.locked() as state:
+            now = state.clock()
+            if now < state["probing_until"]:
+                return "half_open"
+            if now < state["circuit_open_until"]:
+                return "open"
+            return "closed"
+
+    def _refill(self, state):
+        now = state.clock()
+        rate_per_second = state["rate_per_minute"] / 60
+        state["tokens"] = min(
+            self.burst,
+            state["tokens"] + max(0.0, now - state["refilled_at"]) * rate_per_second,
+        )
+        state["refilled_at"] = now
+
+    def _check_circuit(self, state):
+        now = state.clock()
+        if now < state["probing_until"]:
+            # Somebody is already finding out whether upstream is happy again
+            self.rejected += 1
+            raise CircuitOpenError("Circuit half-open, waiting on probe")
+
+        if state["circuit_open_until"]:
+            if now < state["circuit_open_until"]:
+                self.rejected += 1
+                raise CircuitOpenError(
+                    f"Circuit open for another {state['circuit_open_until'] - now:.0f}s"
+                )
+            # Cooldown's over, let exactly one call through to test the water
+            state["probing_until"] = now + self.circuit_breaker_cooldown_seconds
+
+    def _try_take(self) -> float:
+        # Takes a token if there is one, otherwise says how long until there will be
+        with self._state.locked() as state:
+            delay = state["backoff_until"] - state.clock()
+            if delay > 0:
+                return delay
+            self._refill(state)
+            if state["tokens"] >= 1:
+                state["tokens"] -= 1
+                return 0.0
+            return (1 - state["tokens"]) / (state["rate_per_minute"] / 60)
+
+    async def acquire(self):
+        session = current_research_id.get() or NO_RESEARCH
+        await self._turnstile.acquire(session)
+        try:
+            with self._state.locked() as state:
+                self._check_circuit(state)
+
+            while (delay := self._try_take()) > 0:
+                await asyncio.sleep(delay)
+            self.acquired += 1
+        finally:
+            self._turnstile.release(session)
+
+    def record_success(self, latency_seconds: float):
+        with self._state.locked() as state:
+            state["consecutive_throttles"] = 0
+            state["probing_until"] = 0.0
+            state["circuit_open_until"] = 0.0
+
+            if latency_seconds <= self.target_latency_seconds:
+                state["rate_per_minute"] += self.increase_per_minute
+            else:
+                state["rate_per_minute"] *= self.SLOW_RESPONSE_DECREASE_FACTOR
+            self._clamp_rate(state)
+
+    def record_throttled(self):
+        self.throttled += 1
+        with self._state.locked() as state:
+            now = state.clock()
+            state["consecutive_throttles"] += 1
+            state["rate_per_minute"] *= self.decrease_factor
+            self._clamp_rate(state)
+
+            # Don't carry over a full bucket into whatever comes after the backoff
+            state["tokens"] = min(state["tokens"], 0.0)
+
+            # Exponential backoff with full jitter, so queued callers don't all retry in lockstep
+            backoff = min(
+                self.backoff_max_seconds,
+                self.backoff_base_seconds * 2 ** (state["consecutive_throttles"] - 1),
+            )
+            state["backoff_until"] = now + random.uniform(backoff / 2, backoff)
+
+            if (
+                now < state["probing_until"]
+                or state["consecutive_throttles"] >= self.circuit_breaker_threshold
+            ):
+                state["probing_until"] = 0.0
+                state["circuit_open_until"] = now + self.circuit_breaker_cooldown_seconds
+
+    def record_failure(self):
+        # Not upstream telling us to slow down, but a probe that failed still can't close the circuit
+        with self._state.locked() as state:
+            now = state.clock()
+            if now < state["probing_until"]:
+                state["probing_until"] = 0.0
+                state["circuit_open_until"] = now + self.circuit_breaker_cooldown_seconds
+
+    def _clamp_rate(self, state):
+        state["rate_per_minute"] = min(
+            self.max_rate_per_minute,
+            max(self.min_rate_per_minute, state["rate_per_minute"]),
+        )
+
+    def close(self):
+        self._state.close()
+
+    def stats(self) -> dict:
+        with self._state.locked() as state:
+            rate_per_minute, tokens = state["rate_per_minute"], state["tokens"]
+        return {
+            "rate_per_minute": rate_per_minute,
+            "tokens": tokens,
+            "circuit": self.circuit_state,
+            "queued": self._turnstile.queued,
+            "acquired": self.acquired,
+            "throttled": self.throttled,
+            "rejected": self.rejected,
+        }
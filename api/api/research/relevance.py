@@ -0,0 +1,253 @@
+import abc
+import re
+from collections import Counter
+from urllib.parse import urlsplit
+
+from api.config import (
+    PAPER_TEXT_MAX_CHARS,
+    RELEVANCE_FILTER_PAGES,
+    RELEVANCE_MAX_PAPERS_PER_RESEARCH,
+    RELEVANCE_THRESHOLD,
+    RELEVANCE_WORDS_PER_PAGE,
+)
+from api.research.paper_text_condenser import PAGE_SEPARATOR
+from api.research.paper_text_extractor import PaperText, PaperTextExtractor
+from api.research.single_flight import SingleFlight
+from api.research.url_normalizer import fetchable_paper_url, normalize_paper_url
+from api.telemetry.metrics import PAPERS_SKIPPED, RELEVANCE_SCORES
+from api.telemetry.tracing import span
+from pydantic import BaseModel
+
+WORD = re.compile(r"[a-z0-9]+")
+
+# Words that say nothing about what a prompt or a paper is about
+STOPWORDS = set(
+    """
+a about above after again all also am an and any are as at be because been before being below
+between both but by can could did do does doing down during each few for from further had has have
+having he her here hers him his how i if in into is it its itself just me more most my no nor not
+now of off on once only or other our out over own same she should so some such than that the their
+them then there these they this those through to too under until up very was we were what when
+where which while who whom why will with would you your
+interested interest want looking find research paper papers study studies effect effects recent
+""".split()
+)
+
+# BM25's usual parameters: how quickly repeats of a word stop counting, and how much long
+# documents are penalized for containing more words
+BM25_K1 = 1.2
+BM25_B = 0.75
+
+# Where papers live. Anything else might still be one, these just get the benefit of the doubt.
+ACADEMIC_HOSTS = (
+    "arxiv.org",
+    "doi.org",
+    "openreview.net",
+    "aclanthology.org",
+    "biorxiv.org",
+    "medrxiv.org",
+    "ncbi.nlm.nih.gov",
+    "europepmc.org",
+    "semanticscholar.org",
+    "springer.com",
+    "nature.com",
+    "sciencedirect.com",
+    "wiley.com",
+    "ieee.org",
+    "acm.org",
+    "mdpi.com",
+    "plos.org",
+    "frontiersin.org",
+    "ssrn.com",
+    "researchgate.net",
+    "jstor.org",
+    "neurips.cc",
+    "mlr.press",
+)
+ACADEMIC_HOST_BONUS = 0.1
+# PDFs the search turns up that are about the topic without being research on it
+OFF_TOPIC_PATH = re.compile(
+    r"syllabus|brochure|catalog(?:ue)?|datasheet|data-sheet|flyer|leaflet|handout|"
+    r"price-?list|newsletter|annual-?report|resume|curriculum-vitae|\bcv\b|menu|"
+    r"lecture|slides|homework|assignment|exam|course",
+    re.IGNORECASE,
+)
+OFF_TOPIC_PATH_PENALTY = 0.2
+# A paper says so on its first page
+ABSTRACT = re.compile(r"\babstract\b", re.IGNORECASE)
+ABSTRACT_BONUS = 0.05
+
+
+def tokenize(text: str) -> list[str]:
+    words = []
+    for word in WORD.findall(text.lower()):
+        if word in STOPWORDS or len(word) < 2:
+            continue
+        # Plurals are the one inflection that matters most for matching a prompt, and easy to undo
+        if word.endswith("ies") and len(word) > 4:
+            word = word[:-3] + "y"
+        elif word.endswith("s") and not word.endswith("ss") and len(word) > 3:
+            word = word[:-1]
+        words.append(word)
+    return words
+
+
+def first_pages(text: str, pages: int) -> str:
+    return PAGE_SEPARATOR.join(text.split(PAGE_SEPARATOR, pages)[:pages])
+
+
+def url_adjustment(url: str) -> float:
+    parts = urlsplit(url)
+    host = (parts.hostname or "").lower()
+    adjustment = 0.0
+    if any(host == academic or host.endswith("." + academic) for academic in ACADEMIC_HOSTS):
+        adjustment += ACADEMIC_HOST_BONUS
+    if OFF_TOPIC_PATH.search(parts.path):
+        adjustment -= OFF_TOPIC_PATH_PENALTY
+    return adjustment
+
+
+class RelevanceVerdict(BaseModel):
+    relevant: bool
+    score: float
+    # Why it isn't: "below_threshold" or "over_limit"
+    reason: str | None = None
+
+
+class ResearchRelevance:
+    # Scores the papers found for one research against its prompt and the search that found them,
+    # and lets the best through to be summarized.
+    #
+    # Papers arrive one at a time and are summarized as soon as they're let through, so "best" can't
+    # wait for all of them: the first `max_papers` that clear the threshold get in. Search results
+    # come best first, so that's close to the top k anyway.
+    #
+    # Every query word weighs the same, there's no IDF. Taken from the candidates themselves it
+    # backfired: they were all found for the topic, so the topic's own words came out as the least
+    # telling ones and words none of them had as the most, and scores fell as good papers arrived.
+    # A paper's score only depends on the paper, however many were scored before it.
+
+    def __init__(
+        self,
+        prompt: str,
+        threshold: float = RELEVANCE_THRESHOLD,
+        max_papers: int = RELEVANCE_MAX_PAPERS_PER_RESEARCH,
+        typical_length: int = RELEVANCE_FILTER_PAGES * RELEVANCE_WORDS_PER_PAGE,
+    ):
+        self.prompt_words = set(tokenize(prompt))
+        self.threshold = threshold
+        self.max_papers = max_papers
+        # What "long" is measured against: about how many words (less stopwords) the pages scored have.
+        # Fixed, rather than the average of the papers scored so far, for the same reason there's no IDF.
+        self.typical_length = max(1, typical_length)
+        self.admitted = 0
+        self.skipped: Counter[str] = Counter()
+
+    def _match(self, counts: Counter[str], length: int, query: set[str]) -> float:
+        # BM25 (without IDF), divided by what a document containing every query word (many times over)
+        # would score, so the threshold means the same however long the query is
+        if not query or not length:
+            return 0.0
+        length_norm = BM25_K1 * (1 - BM25_B + BM25_B * length / self.typical_length)
+        return sum(counts[word] / (counts[word] + length_norm) for word in query) / len(query)
+
+    def score(self, text: str, url: str, search_term: str) -> float:
+        words = tokenize(text)
+        counts = Counter(words)
+        # The prompt and the search term on their own, a paper only has to be about one of them.
+        # Together, words of the one a paper isn't about would drag it down.
+        lexical = max(
+            self._match(counts, len(words), self.prompt_words),
+            self._match(counts, len(words), set(tokenize(search_term))),
+        )
+
+        adjustment = url_adjustment(url)
+        if ABSTRACT.search(text):
+            adjustment += ABSTRACT_BONUS
+        return min(1.0, max(0.0, lexical + adjustment))
+
+    def judge(self, text: str, url: str, search_term: str) -> RelevanceVerdict:
+        score = self.score(text, url, search_term)
+        RELEVANCE_SCORES.observe(score)
+        reason = None
+        if score < self.threshold:
+            reason = "below_threshold"
+        elif self.max_papers > 0 and self.admitted >= self.max_papers:
+            reason = "over_limit"
+
+        if reason is not None:
+            self.skipped[reason] += 1
+            PAPERS_SKIPPED.inc(reason=reason)
+            return RelevanceVerdict(relevant=False, score=score, reason=reason)
+        self.admitted += 1
+        return RelevanceVerdict(relevant=True, score=score)
+
+
+class RelevanceFilter(abc.ABC):
+    @abc.abstractmethod
+    def for_research(self, prompt: str) -> ResearchRelevance:
+        pass
+
+    @abc.abstractmethod
+    async def check_async(
+        self, relevance: ResearchRelevance, url: str, search_term: str
+    ) -> RelevanceVerdict:
+        pass
+
+
+class TextRelevanceFilter(RelevanceFilter):
+    # Reads the paper's text before anybody pays to summarize it. It's extracted exactly the way the
+    # summarizer extracts it, so the summarizer finds it in the paper cache rather than downloading again.
+
+    def __init__(
+        self,
+        paper_text_extractor: PaperTextExtractor,
+        threshold: float = RELEVANCE_THRESHOLD,
+        max_papers_per_research: int = RELEVANCE_MAX_PAPERS_PER_RESEARCH,
+        pages: int = RELEVANCE_FILTER_PAGES,
+    ):
+        self.paper_text_extractor = paper_text_extractor
+        self.threshold = threshold
+        self.max_papers_per_research = max_papers_per_research
+        self.pages = pages
+        # Researches finding the same paper at the same time only extract it once
+        self.single_flight: SingleFlight[PaperText] = SingleFlight()
+        self.admitted = 0
+        self.skipped: Counter[str] = Counter()
+
+    def for_research(self, prompt: str) -> ResearchRelevance:
+        return ResearchRelevance(
+            prompt,
+            self.threshold,
+            self.max_papers_per_research,
+            self.pages * RELEVANCE_WORDS_PER_PAGE,
+        )
+
+    async def check_async(
+        self, relevance: ResearchRelevance, url: str, search_term: str
+    ) -> RelevanceVerdict:
+        # Coalesced on the normalized URL, downloaded from the one the search found (or an arXiv
+        # abstract's PDF), exactly like the summarizer downloads it so it finds it in the paper cache
+        paper_text = await self.single_flight.do(
+            normalize_paper_url(url),
+            lambda: self.paper_text_extractor.extract_paper_text_async(
+                fetchable_paper_url(url), PAPER_TEXT_MAX_CHARS
+            ),
+        )
+        with span("relevance", url=url) as relevance_span:
+            verdict = relevance.judge(
+                first_pages(paper_text.text, self.pages), url, search_term
+            )
+            relevance_span.set(score=round(verdict.score, 3), reason=verdict.reason)
+        if verdict.relevant:
+            self.admitted += 1
+        else:
+            self.skipped[verdict.reason] += 1
+        return verdict
+
+    def stats(self) -> dict:
+        return {
+            "admitted": self.admitted,
+            "skipped": dict(self.skipped),
+            "text_single_flight": self.single_flight.stats(),
+        }
@@ -0,0 +1,292 @@
+import asyncio
+import logging
+import time
+from typing import AsyncIterator
+import uuid
+
+from api.config import (
+    JOB_QUEUE_POLL_SECONDS,
+    RESEARCH_REUSE_ENABLED,
+    RESEARCH_REUSE_SECONDS,
+    RESEARCH_SESSION_RETENTION_SECONDS,
+    RESEARCH_STORE_FLUSH_EVENTS,
+    RESEARCH_STORE_FLUSH_SECONDS,
+    SSE_DELTA_SNAPSHOT_INTERVAL,
+)
+from api.jobs.queue import JobQueue, ResearchJob
+from api.research.prompt_normalizer import normalize_prompt
+from api.research.research_store import ResearchStore
+from api.research.researcher import Researcher
+from api.research.single_flight import SingleFlight
+from api.telemetry.metrics import RESEARCH_REUSED
+from api.types import Research, ResearchState, ResearchStatus, SnapshotEvent
+
+logger = logging.getLogger(__name__)
+
+
+class ResearchSession:
+    # A research running in this process: the (shared, mutable) research and the log of events so far.
+    # Any number of subscribers can follow along, each from wherever they got up to.
+
+    def __init__(
+        self, research: Research, snapshot_interval: int = SSE_DELTA_SNAPSHOT_INTERVAL
+    ):
+        self.research = research
+        self.status = ResearchStatus.RUNNING
+        self.snapshot_interval = snapshot_interval
+        # Serialized once when they happen, however many subscribers there are
+        self.events: list[str] = []
+        # Full snapshots taken right after every `snapshot_interval` events, by event sequence number
+        self.snapshots: dict[int, str] = {}
+        self._updated = asyncio.Event()
+
+    @property
+    def last_seq(self) -> int:
+        return len(self.events) - 1
+
+    @property
+    def finished(self) -> bool:
+        return self.status.finished
+
+    def state(self) -> ResearchState:
+        return ResearchState(
+            order=self.last_seq, status=self.status, research=self.research
+        )
+
+    def delta_order(self, seq: int) -> int:
+        # The order of event `seq` in the delta protocol. Snapshots take an order number too, one
+        # after every `snapshot_interval` events. Worked out from the sequence number so it's the
+        # same when replayed.
+        if self.snapshot_interval <= 0:
+            return seq
+        return seq + seq // self.snapshot_interval
+
+    def _notify(self):
+        self._updated.set()
+        self._updated = asyncio.Event()
+
+    def append(self, event_json: str) -> int:
+        self.events.append(event_json)
+        seq = self.last_seq
+        if self.snapshot_interval > 0 and (seq + 1) % self.snapshot_interval == 0:
+            self.snapshots[seq] = SnapshotEvent(research=self.research).dump_json()
+        self._notify()
+        return seq
+
+    def finish(self, status: ResearchStatus):
+        self.status = status
+        self._notify()
+
+    async def wait_async(self, after_seq: int):
+        # Until there's something after `after_seq`, or there never will be
+        while self.last_seq <= after_seq and not self.finished:
+            await self._updated.wait()
+
+
+class ResearchSessionManager:
+    # Queues research as jobs, runs the ones this process's workers pick up, and lets anybody
+    # follow any research: live if it's running here, through the store if it's running elsewhere.
+    # Everything is kept in the store, so it survives disconnects (and restarts).
+    #
+    # Submitting a prompt that's already queued or running (here or in any process sharing the store)
+    # joins that research instead, and a prompt that recently finished gets the finished research.
+    # Either way it's followed from its first event, like research of its own would be.
+
+    def __init__(
+        self,
+        researcher: Researcher,
+        store: ResearchStore,
+        job_queue: JobQueue,
+        *,
+        flush_events: int = RESEARCH_STORE_FLUSH_EVENTS,
+        flush_seconds: float = RESEARCH_STORE_FLUSH_SECONDS,
+        retention_seconds: float = RESEARCH_SESSION_RETENTION_SECONDS,
+        poll_seconds: float = JOB_QUEUE_POLL_SECONDS,
+        reuse_enabled: bool = RESEARCH_REUSE_ENABLED,
+        reuse_seconds: float = RESEARCH_REUSE_SECONDS,
+    ):
+        self.researcher = researcher
+        self.store = store
+        self.job_queue = job_queue
+        self.flush_events = flush_events
+        self.flush_seconds = flush_seconds
+        self.retention_seconds = retention_seconds
+        self.poll_seconds = poll_seconds
+        self.reuse_enabled = reuse_enabled
+        self.reuse_seconds = reuse_seconds
+        # The same prompt submitted at the same time is only looked up (and queued) once
+        self._submissions: SingleFlight[ResearchState] = SingleFlight()
+        self._sessions: dict[str, ResearchSession] = {}
+        # Set whenever a research starts running here, so anybody polling for it can switch to following it live
+        self._session_started = asyncio.Event()
+        self.running = 0
+        self.submitted = 0
+        self.reused = 0
+
+    async def submit_async(self, prompt: str, reuse: bool = True) -> ResearchState:
+        if not (reuse and self.reuse_enabled):
+            return await self._queue_async(prompt)
+        return await self._submissions.do(
+            normalize_prompt(prompt), lambda: self._submit_or_reuse_async(prompt)
+        )
+
+    async def _submit_or_reuse_async(self, prompt: str) -> ResearchState:
+        state = await self.store.find_reusable_async(prompt, self.reuse_seconds)
+        if state is None:
+            return await self._queue_async(prompt)
+
+        self.reused += 1
+        RESEARCH_REUSED.inc(status=state.status.value)
+        # The store is a flush behind research running here
+        session = self._sessions.get(state.research.id)
+        return session.state() if session is not None else state
+
+    async def _queue_async(self, prompt: str) -> ResearchState:
+        self.submitted += 1
+        research = Research(id=str(uuid.uuid4()), prompt=prompt, searches=[])
+        state = ResearchState(order=-1, status=ResearchStatus.QUEUED, research=research)
+
+        # Stored first, so it can be looked up (and followed) before a worker gets to it
+        await self.store.save_async(state, [])
+        await self.job_queue.submit_async(ResearchJob(id=research.id, prompt=prompt))
+        return state
+
+    def get_session(self, research_id: str) -> ResearchSession | None:
+        return self._sessions.get(research_id)
+
+    def stats(self) -> dict:
+        return {
+            "running": self.running,
+            "submitted": self.submitted,
+            "reused": self.reused,
+            # Submitted while the same prompt was being submitted, and given the same research
+            "coalesced": self._submissions.joined,
+        }
+
+    async def _flush_async(
+        self, session: ResearchSession, pending: list[tuple[int, str]]
+    ):
+        try:
+            await self.store.save_async(session.state(), pending)
+        except Exception as e:
+            # Subscribers in this process still get everything, only resuming later is affected
+            logger.warning("Failed to save research: %s: %r", session.research.id, e)
+
+    async def run_async(self, research_id: str, prompt: str) -> ResearchStatus:
+        session = ResearchSession(Research(id=research_id, prompt=prompt, searches=[]))
+        self._sessions[research_id] = session
+        self._session_started.set()
+        self._session_started = asyncio.Event()
+        self.running += 1
+
+        pending: list[tuple[int, str]] = []
+        last_flush = time.monotonic()
+        status = ResearchStatus.FAILED
+        try:
+            async for update in self.researcher.research_events_async(
+                prompt, research_id
+            ):
+                session.research = update.research
+                event_json = update.event.model_dump_json()
+                pending.append((session.append(event_json), event_json))
+
+                # Batched, one write per event would be a lot of writes
+                if (
+                    len(pending) >= self.flush_events
+                    or time.monotonic() - last_flush >= self.flush_seconds
+                ):
+                    await self._flush_async(session, pending)
+                    pending = []
+                    last_flush = time.monotonic()
+
+            status = ResearchStatus.COMPLETED
+        except asyncio.CancelledError:
+            status = ResearchStatus.INTERRUPTED
+            raise
+        except Exception:
+            logger.exception("Research failed: %s", research_id)
+        finally:
+            self.running -= 1
+            session.finish(status)
+            await self._flush_async(session, pending)
+
+            # Keep it around for a while for anybody catching up, the store has it after that
+            asyncio.get_running_loop().call_later(
+                self.retention_seconds, self._sessions.pop, research_id, None
+            )
+
+        return status
+
+    async def get_state_async(self, research_id: str) -> ResearchState | None:
+        session = self._sessions.get(research_id)
+        if session is not None:
+            return session.state()
+        return await self.store.get_async(research_id)
+
+    async def _wait_for_store_async(self):
+        # Until it's worth looking at the store again, or the research might have started running here
+        try:
+            await asyncio.wait_for(self._session_started.wait(), self.poll_seconds)
+        except TimeoutError:
+            pass
+
+    async def _session_events_async(
+        self, session: ResearchSession, after_seq: int
+    ) -> AsyncIterator[tuple[int, int, str, str | None]]:
+        seq = after_seq
+        while True:
+            while seq < session.last_seq:
+                seq += 1
+                order = session.delta_order(seq)
+                yield seq, order, session.events[seq], session.snapshots.get(seq)
+            if session.finished:
+                return
+            await session.wait_async(seq)
+
+    async def events_async(
+        self, research_id: str, after_seq: int = -1
+    ) -> AsyncIterator[tuple[int, int, str, str | None]]:
+        # Every event after `after_seq`: its sequence number, its order in the delta protocol, its JSON,
+        # and the JSON of a `SnapshotEvent` if one was taken right after it
+        seq = after_seq
+        while True:
+            session = self._sessions.get(research_id)
+            if session is not None:
+                async for event in self._session_events_async(session, seq):
+                    yield event
+                return
+
+            # Not running here (yet), all we've got is what's been stored. There are no snapshots
+            # in there, so no order numbers are set aside for them either.
+            state = await self.store.get_async(research_id)
+            for seq, event_json in await self.store.get_events_async(research_id, seq):
+                yield seq, seq, event_json, None
+            if state is None or state.finished:
+                return
+            await self._wait_for_store_async()
+
+    async def states_async(
+        self, research_id: str, after_seq: int = -1
+    ) -> AsyncIterator[ResearchState]:
+        # Only the latest state matters to the snapshot protocol, so a subscriber
+        # that fell behind skips straight to it rather than getting every one in between
+        seq = after_seq
+        while True:
+            session = self._sessions.get(research_id)
+            if session is not None:
+                state = session.state()
+            else:
+                state = await self.store.get_async(research_id)
+                if state is None:
+                    return
+
+            if state.order > seq:
+                seq = state.order
+                yield state
+            if state.finished:
+                return
+
+            if session is not None:
+                await session.wait_async(seq)
+            else:
+                await self._wait_for_store_async()
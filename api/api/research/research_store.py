@@ -0,0 +1,297 @@
+import abc
+import asyncio
+import os
+import sqlite3
+import threading
+import time
+
+from api.research.prompt_normalizer import normalize_prompt
+from api.types import Research, ResearchState, ResearchStatus
+
+
+class ResearchStore(abc.ABC):
+    # Keeps every research (finished or not) and the log of events that built it up,
+    # events are the JSON of a `ResearchEvent` and numbered from 0 per research
+
+    @abc.abstractmethod
+    async def save_async(self, state: ResearchState, events: list[tuple[int, str]]):
+        pass
+
+    @abc.abstractmethod
+    async def get_async(self, research_id: str) -> ResearchState | None:
+        pass
+
+    @abc.abstractmethod
+    async def get_events_async(
+        self, research_id: str, after_seq: int = -1
+    ) -> list[tuple[int, str]]:
+        pass
+
+    @abc.abstractmethod
+    async def find_reusable_async(
+        self, prompt: str, max_age_seconds: float
+    ) -> ResearchState | None:
+        # The latest research for the same (normalized) prompt that's queued or running,
+        # or that completed within `max_age_seconds`
+        pass
+
+    @abc.abstractmethod
+    async def mark_interrupted_async(self, research_ids: list[str] | None = None) -> int:
+        # For research whose process died before it finished, all unfinished research if no ids are given
+        pass
+
+    async def close_async(self):
+        pass
+
+
+class InMemoryResearchStore(ResearchStore):
+    def __init__(self):
+        self._states: dict[str, str] = {}
+        self._events: dict[str, dict[int, str]] = {}
+        # Research ids by normalized prompt, with when they were last saved
+        self._by_prompt: dict[str, dict[str, float]] = {}
+
+    async def save_async(self, state: ResearchState, events: list[tuple[int, str]]):
+        # Stored as JSON, so nobody can mutate what's been saved
+        self._states[state.research.id] = state.dump_json()
+        self._events.setdefault(state.research.id, {}).update(events)
+        self._by_prompt.setdefault(normalize_prompt(state.research.prompt), {})[
+            state.research.id
+        ] = time.time()
+
+    async def get_async(self, research_id: str) -> ResearchState | None:
+        state = self._states.get(research_id)
+        return ResearchState.model_validate_json(state) if state else None
+
+    async def get_events_async(
+        self, research_id: str, after_seq: int = -1
+    ) -> list[tuple[int, str]]:
+        events = self._events.get(research_id, {})
+        return sorted((seq, event) for seq, event in events.items() if seq > after_seq)
+
+    async def find_reusable_async(
+        self, prompt: str, max_age_seconds: float
+    ) -> ResearchState | None:
+        research_ids = self._by_prompt.get(normalize_prompt(prompt), {})
+        for research_id, updated_at in sorted(
+            research_ids.items(), key=lambda item: item[1], reverse=True
+        ):
+            state = ResearchState.model_validate_json(self._states[research_id])
+            if not state.finished or (
+                state.status == ResearchStatus.COMPLETED
+                and time.time() - updated_at <= max_age_seconds
+            ):
+                return state
+        return None
+
+    async def mark_interrupted_async(self, research_ids: list[str] | None = None) -> int:
+        interrupted = 0
+        for research_id, state_json in self._states.items():
+            if research_ids is not None and research_id not in research_ids:
+                continue
+            state = ResearchState.model_validate_json(state_json)
+            if not state.finished:
+                state.status = ResearchStatus.INTERRUPTED
+                self._states[research_id] = state.model_dump_json()
+                interrupted += 1
+        return interrupted
+
+
+class SQLiteResearchStore(ResearchStore):
+    def __init__(self, path: str):
+        self.path = path
+        self._connection: sqlite3.Connection | None = None
+        self._lock = threading.Lock()
+
+    def _connect(self) -> sqlite3.Connection:
+        if self._connection is None:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+
+            connection = sqlite3.connect(
+                self.path, check_same_thread=False, isolation_level=None
+            )
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            connection.execute(
+                """
+                CREATE TABLE IF NOT EXISTS research (
+                    id TEXT PRIMARY KEY,
+                    prompt TEXT NOT NULL,
+                    status TEXT NOT NULL,
+                    seq INTEGER NOT NULL,
+                    research TEXT NOT NULL,
+                    updated_at REAL NOT NULL,
+                    prompt_key TEXT
+                )
+                """
+            )
+            # Stores from before research was reused don't have it
+            columns = {row[1] for row in connection.execute("PRAGMA table_info(research)")}
+            if "prompt_key" not in columns:
+                try:
+                    connection.execute("ALTER TABLE research ADD COLUMN prompt_key TEXT")
+                except sqlite3.OperationalError as e:
+                    # Another process got there first
+                    if "duplicate column" not in str(e):
+                        raise
+                # So research from before can be reused too. Whoever else is migrating it at the
+                # same time fills in the same keys.
+                rows = connection.execute(
+                    "SELECT id, prompt FROM research WHERE prompt_key IS NULL"
+                ).fetchall()
+                connection.executemany(
+                    "UPDATE research SET prompt_key = ? WHERE id = ?",
+                    [(normalize_prompt(prompt), research_id) for research_id, prompt in rows],
+                )
+            connection.execute(
+                "CREATE INDEX IF NOT EXISTS research_prompt_key ON research (prompt_key, updated_at)"
+            )
+            connection.execute(
+                """
+                CREATE TABLE IF NOT EXISTS research_events (
+                    research_id TEXT NOT NULL,
+                    seq INTEGER NOT NULL,
+                    event TEXT NOT NULL,
+                    PRIMARY KEY (research_id, seq)
+                )
+                """
+            )
+            self._connection = connection
+        return self._connection
+
+    def _save(
+        self, state: ResearchState, research_json: str, events: list[tuple[int, str]]
+    ):
+        with self._lock:
+            connection = self._connect()
+            # One transaction, so the events and the research they add up to are always in step
+            connection.execute("BEGIN")
+            try:
+                connection.executemany(
+                    "INSERT OR REPLACE INTO research_events (research_id, seq, event) VALUES (?, ?, ?)",
+                    [(state.research.id, seq, event) for seq, event in events],
+                )
+                connection.execute(
+                    "INSERT OR REPLACE INTO research (id, prompt, status, seq, research, updated_at, prompt_key) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                    (
+                        state.research.id,
+                        state.research.prompt,
+                        state.status.value,
+                        state.order,
+                        research_json,
+                        time.time(),
+                        normalize_prompt(state.research.prompt),
+                    ),
+                )
+                connection.execute("COMMIT")
+            except BaseException:
+                connection.execute("ROLLBACK")
+                raise
+
+    def _get(self, research_id: str) -> ResearchState | None:
+        with self._lock:
+            row = (
+                self._connect()
+                .execute(
+                    "SELECT status, seq, research FROM research WHERE id = ?",
+                    (research_id,),
+                )
+                .fetchone()
+            )
+        if row is None:
+            return None
+
+        status, seq, research_json = row
+        return ResearchState(
+            order=seq,
+            status=ResearchStatus(status),
+            research=Research.model_validate_json(research_json),
+        )
+
+    def _find_reusable(self, prompt: str, max_age_seconds: float) -> ResearchState | None:
+        with self._lock:
+            row = (
+                self._connect()
+                .execute(
+                    """
+                    SELECT status, seq, research FROM research
+                    WHERE prompt_key = ? AND (status IN (?, ?) OR (status = ? AND updated_at >= ?))
+                    ORDER BY updated_at DESC LIMIT 1
+                    """,
+                    (
+                        normalize_prompt(prompt),
+                        ResearchStatus.QUEUED.value,
+                        ResearchStatus.RUNNING.value,
+                        ResearchStatus.COMPLETED.value,
+                        time.time() - max_age_seconds,
+                    ),
+                )
+                .fetchone()
+            )
+        if row is None:
+            return None
+
+        status, seq, research_json = row
+        return ResearchState(
+            order=seq,
+            status=ResearchStatus(status),
+            research=Research.model_validate_json(research_json),
+        )
+
+    def _get_events(self, research_id: str, after_seq: int) -> list[tuple[int, str]]:
+        with self._lock:
+            return (
+                self._connect()
+                .execute(
+                    "SELECT seq, event FROM research_events WHERE research_id = ? AND seq > ? ORDER BY seq",
+                    (research_id, after_seq),
+                )
+                .fetchall()
+            )
+
+    def _mark_interrupted(self, research_ids: list[str] | None) -> int:
+        unfinished = (ResearchStatus.QUEUED.value, ResearchStatus.RUNNING.value)
+        with self._lock:
+            connection = self._connect()
+            if research_ids is None:
+                return connection.execute(
+                    "UPDATE research SET status = ? WHERE status IN (?, ?)",
+                    (ResearchStatus.INTERRUPTED.value, *unfinished),
+                ).rowcount
+
+            return sum(
+                connection.execute(
+                    "UPDATE research SET status = ? WHERE id = ? AND status IN (?, ?)",
+                    (ResearchStatus.INTERRUPTED.value, research_id, *unfinished),
+                ).rowcount
+                for research_id in research_ids
+            )
+
+    async def save_async(self, state: ResearchState, events: list[tuple[int, str]]):
+        # Serialized here, the research may well be changed on the event loop while we write
+        research_json = state.research.dump_json()
+        await asyncio.to_thread(self._save, state, research_json, events)
+
+    async def get_async(self, research_id: str) -> ResearchState | None:
+        return await asyncio.to_thread(self._get, research_id)
+
+    async def get_events_async(
+        self, research_id: str, after_seq: int = -1
+    ) -> list[tuple[int, str]]:
+        return await asyncio.to_thread(self._get_events, research_id, after_seq)
+
+    async def find_reusable_async(
+        self, prompt: str, max_age_seconds: float
+    ) -> ResearchState | None:
+        return await asyncio.to_thread(self._find_reusable, prompt, max_age_seconds)
+
+    async def mark_interrupted_async(self, research_ids: list[str] | None = None) -> int:
+        return await asyncio.to_thread(self._mark_interrupted, research_ids)
+
+    async def close_async(self):
+        with self._lock:
+            if self._connection is not None:
+                self._connection.close()
+                self._connection = None
@@ -1,19 +1,55 @@
 import abc
-from aiostream import stream
+import asyncio
+import logging
 from typing import AsyncIterator
 import uuid
-from api.config import RESULTS_PER_SEARCH_TERM, SEARCH_TERMS_PER_RESEARCH
+from api.config import (
+    PAPER_INDEX_MAX_RESULTS,
+    RESULTS_PER_SEARCH_TERM,
+    SEARCH_TERMS_PER_RESEARCH,
+)
+from api.research.context import current_research_id
+from api.research.paper_index import PaperIndex
 from api.research.paper_summary_generator import PaperSummary, PaperSummaryGenerator
+from api.research.relevance import RelevanceFilter, ResearchRelevance
+from api.research.scheduler import PipelineStage, StageScheduler, stage_slot
 from api.research.search_term_generator import SearchTermGenerator
+from api.research.url_normalizer import normalize_paper_url
 from api.research.web_searcher import WebSearcher
-from api.types import Research, Search
+from api.telemetry.tracing import span
+from api.types import (
+    Paper,
+    PaperAddedEvent,
+    PaperFailedEvent,
+    PaperReadingStartedEvent,
+    PaperSkippedEvent,
+    PaperUpdatedEvent,
+    Research,
+    ResearchStartedEvent,
+    ResearchUpdate,
+    Search,
+    SearchAddedEvent,
+)
+
+logger = logging.getLogger(__name__)
+
+# What the search of papers read before is shown as, next to the web searches
+KNOWN_PAPERS_QUERY = "Papers read before"
 
 
 class Researcher(abc.ABC):
     @abc.abstractmethod
-    async def research_async(self, prompt: str) -> AsyncIterator[Research]:
+    async def research_events_async(
+        self, prompt: str, research_id: str | None = None
+    ) -> AsyncIterator[ResearchUpdate]:
         pass
 
+    async def research_async(
+        self, prompt: str, research_id: str | None = None
+    ) -> AsyncIterator[Research]:
+        async for update in self.research_events_async(prompt, research_id):
+            yield update.research
+
 
 class GooglePDFResearcher(Researcher):
     def __init__(
@@ -21,67 +57,268 @@ class GooglePDFResearcher(Researcher):
         search_term_generator: SearchTermGenerator,
         web_searcher: WebSearcher,
         paper_summary_generator: PaperSummaryGenerator,
+        scheduler: StageScheduler | None = None,
+        relevance_filter: RelevanceFilter | None = None,
+        paper_index: PaperIndex | None = None,
     ):
         self.search_term_generator = search_term_generator
         self.web_searcher = web_searcher
         self.paper_summary_generator = paper_summary_generator
+        self.scheduler = scheduler
+        self.relevance_filter = relevance_filter
+        self.paper_index = paper_index
+
+    async def _search_urls_async(self, query: str) -> AsyncIterator[str]:
+        # Hold the search slot for as long as the searcher is paginating
+        async with stage_slot(self.scheduler, PipelineStage.SEARCH):
+            try:
+                with span("search", query=query) as search_span:
+                    results = 0
+                    async for url in self.web_searcher.top_urls_async(
+                        query, n=RESULTS_PER_SEARCH_TERM
+                    ):
+                        results += 1
+                        search_span.set(results=results)
+                        yield url
+            except Exception as e:
+                # e.g. throttled, keep whatever this search found and let the others carry on
+                logger.warning("Search failed: %s: %r", query, e)
 
     async def _research_search_term_async(
-        self, research: Research, search: Search
-    ) -> AsyncIterator[Research]:
-        print("Querying search term: ", search.query)
+        self,
+        research: Research,
+        search: Search,
+        search_index: int,
+        papers_by_url: dict[str, asyncio.Future[Paper | None]],
+        relevance: ResearchRelevance | None = None,
+    ) -> AsyncIterator[ResearchUpdate]:
+        logger.info("Querying search term: %s", search.query)
 
-        # First thing we do is yield the current state of the Research object
         # The arguments are passed by reference, so we just have to modify them
-        # and then yield `research` to update the frontend
-        yield research
+        # and then yield `research` (along with what changed) to update the frontend
+
+        def _paper_added(paper: Paper) -> ResearchUpdate:
+            search.papers.append(paper)
+            return ResearchUpdate(
+                research=research,
+                event=PaperAddedEvent(
+                    search_index=search_index,
+                    paper_index=len(search.papers) - 1,
+                    paper=paper,
+                ),
+            )
+
+        def _paper_index(paper: Paper) -> int:
+            return next(i for i, p in enumerate(search.papers) if p is paper)
+
+        def _paper_updated(paper: Paper) -> ResearchUpdate:
+            return ResearchUpdate(
+                research=research,
+                event=PaperUpdatedEvent(
+                    search_index=search_index,
+                    paper_index=_paper_index(paper),
+                    paper=paper,
+                ),
+            )
+
+        async def _read_paper(url: str) -> AsyncIterator[ResearchUpdate]:
+            normalized_url = normalize_paper_url(url)
+            known_paper = papers_by_url.get(normalized_url)
+            if known_paper is not None:
+                # Another search in this research already found this paper, so
+                # reuse the very same `Paper` rather than reading it again
+                paper = await known_paper
+                if paper is not None and not any(p is paper for p in search.papers):
+                    yield _paper_added(paper)
+                return
 
-        async def _read_paper(url: str) -> AsyncIterator[Research]:
-            print("Reading paper: ", url)
-            yield research
+            known_paper = asyncio.get_running_loop().create_future()
+            papers_by_url[normalized_url] = known_paper
+            try:
+                async for update in _read_new_paper(url, known_paper):
+                    yield update
+            finally:
+                # Nothing usable came of it (failed, or cancelled), don't leave duplicates hanging
+                if not known_paper.done():
+                    known_paper.set_result(None)
+
+        async def _read_new_paper(
+            url: str, known_paper: asyncio.Future[Paper | None]
+        ) -> AsyncIterator[ResearchUpdate]:
+            logger.info("Reading paper: %s", url)
+            yield ResearchUpdate(
+                research=research,
+                event=PaperReadingStartedEvent(search_index=search_index, url=url),
+            )
 
-            # Try to read the paper and extract the relevant information
+            # Try to read the paper and extract the relevant information.
+            # The paper shows up as soon as we know its title, and is filled in as the summary is written.
+            paper = None
             try:
-                paper_summary = await self.paper_summary_generator.read_paper_async(url)
+                # From finding the paper to the last of its summary, however much of that was shared
+                with span("paper", url=url) as paper_span:
+                    if relevance is not None:
+                        # Don't pay for summarizing a syllabus or a brochure
+                        verdict = await self.relevance_filter.check_async(
+                            relevance, url, search.query
+                        )
+                        if not verdict.relevant:
+                            logger.info(
+                                "Skipping paper: %s: %s (%.2f)", url, verdict.reason, verdict.score
+                            )
+                            paper_span.set(skipped=verdict.reason)
+                            yield ResearchUpdate(
+                                research=research,
+                                event=PaperSkippedEvent(
+                                    search_index=search_index,
+                                    url=url,
+                                    score=verdict.score,
+                                    reason=verdict.reason,
+                                ),
+                            )
+                            return
+
+                    async for paper_summary in self.paper_summary_generator.stream_paper_async(
+                        url
+                    ):
+                        if paper is None:
+                            paper = PaperSummary.to_paper(paper_summary, url)
+                            yield _paper_added(paper)
+                            continue
+
+                        updated = PaperSummary.to_paper(paper_summary, url)
+                        paper.title = updated.title
+                        paper.summary = updated.summary
+                        paper.authors = updated.authors
+                        paper.publisher = updated.publisher
+                        yield _paper_updated(paper)
             except Exception as e:
-                print("Failed to read paper:", e)
+                logger.warning("Failed to read paper: %s: %r", url, e)
+                paper_index = None
+                if paper is not None:
+                    # Don't leave a half-written summary behind
+                    paper_index = _paper_index(paper)
+                    del search.papers[paper_index]
+                yield ResearchUpdate(
+                    research=research,
+                    event=PaperFailedEvent(
+                        search_index=search_index,
+                        url=url,
+                        error=str(e),
+                        paper_index=paper_index,
+                    ),
+                )
                 return
 
-            # Add to the search results
-            search.papers.append(PaperSummary.to_paper(paper_summary, url))
+            # Let any duplicates in other searches have it too
+            known_paper.set_result(paper)
 
-            # Yield the updated research object with the paper details
-            yield research
+        # Imported when research first needs it, rather than when the app starts
+        from aiostream import stream
 
         # Search the web using the search term
         # TBH, not sure if the google client streams in results, but it does
         # use an iterator interface so I'll assume it does stream and that we
         # should start "reading the paper" as soon as each search result is ready
         paper_stream = stream.flatmap(
-            self.web_searcher.top_urls_async(search.query, n=RESULTS_PER_SEARCH_TERM),
+            self._search_urls_async(search.query),
             _read_paper,
         )
 
         # Yield results from stream as they come in
         async with paper_stream.stream() as streamer:
             # Assume we're always modifying references and yielding the `research` object
-            async for research in streamer:
-                yield research
+            async for update in streamer:
+                yield update
+
+    async def _known_papers_async(
+        self,
+        research: Research,
+        papers_by_url: dict[str, asyncio.Future[Paper | None]],
+    ) -> AsyncIterator[ResearchUpdate]:
+        # Papers read before that match the prompt, shown as a search of their own straight away.
+        # Live searches finding them too reuse them rather than reading them again.
+        try:
+            with span("known_papers") as known_papers_span:
+                hits = await self.paper_index.search_async(
+                    research.prompt, PAPER_INDEX_MAX_RESULTS
+                )
+                known_papers_span.set(results=len(hits))
+        except Exception as e:
+            logger.warning("Searching papers read before failed: %r", e)
+            return
+
+        papers = []
+        for hit in hits:
+            normalized_url = normalize_paper_url(hit.url)
+            if normalized_url in papers_by_url:
+                # A live search got to it first
+                continue
+            paper = PaperSummary.to_paper(hit.summary, hit.url)
+            known_paper = asyncio.get_running_loop().create_future()
+            known_paper.set_result(paper)
+            papers_by_url[normalized_url] = known_paper
+            papers.append(paper)
+        if not papers:
+            return
 
-    async def research_async(self, prompt: str) -> AsyncIterator[Research]:
+        search = Search(query=KNOWN_PAPERS_QUERY, papers=[])
+        research.searches.append(search)
+        search_index = len(research.searches) - 1
+        yield ResearchUpdate(
+            research=research,
+            event=SearchAddedEvent(search_index=search_index, query=search.query),
+        )
+        for paper in papers:
+            search.papers.append(paper)
+            yield ResearchUpdate(
+                research=research,
+                event=PaperAddedEvent(
+                    search_index=search_index,
+                    paper_index=len(search.papers) - 1,
+                    paper=paper,
+                ),
+            )
+
+    async def research_events_async(
+        self, prompt: str, research_id: str | None = None
+    ) -> AsyncIterator[ResearchUpdate]:
         # Initialize research context
-        research = Research(id=str(uuid.uuid4()), prompt=prompt, searches=[])
-        yield research
+        research = Research(
+            id=research_id or str(uuid.uuid4()), prompt=prompt, searches=[]
+        )
+        papers_by_url: dict[str, asyncio.Future[Paper | None]] = {}
+        relevance = (
+            self.relevance_filter.for_research(prompt)
+            if self.relevance_filter is not None
+            else None
+        )
+        # For whatever happens before the search terms get their own tasks, e.g. generating them
+        current_research_id.set(research.id)
+        yield ResearchUpdate(
+            research=research,
+            event=ResearchStartedEvent(id=research.id, prompt=prompt),
+        )
 
-        async def _handle_search_term(search_term: str) -> AsyncIterator[Research]:
+        async def _handle_search_term(search_term: str) -> AsyncIterator[ResearchUpdate]:
             # Kick-off a search-term-processing stream for each search term generated
             # This starts _immediately_ after the search term is streamed from the LLM.
+            # Each one runs in its own task, so the research id is seen by everything it kicks off.
+            current_research_id.set(research.id)
             search = Search(query=search_term, papers=[])
             research.searches.append(search)
-            yield research
+            search_index = len(research.searches) - 1
+            yield ResearchUpdate(
+                research=research,
+                event=SearchAddedEvent(search_index=search_index, query=search_term),
+            )
+
+            async for update in self._research_search_term_async(
+                research, search, search_index, papers_by_url, relevance
+            ):
+                yield update
 
-            async for search in self._research_search_term_async(research, search):
-                yield search
+        from aiostream import stream
 
         # Generate search terms
         search_stream = stream.flatmap(
@@ -90,8 +327,20 @@ class GooglePDFResearcher(Researcher):
             ),
             _handle_search_term,
         )
+        if self.paper_index is not None:
+            # Alongside the live searches, which take a while to find anything anyway
+            search_stream = stream.merge(
+                self._known_papers_async(research, papers_by_url), search_stream
+            )
 
         # Yield results from stream as they come in
-        async with search_stream.stream() as streamer:
-            async for research in streamer:
-                yield research
+        with span("research", research_id=research.id) as research_span:
+            async with search_stream.stream() as streamer:
+                async for update in streamer:
+                    yield update
+
+            if relevance is not None:
+                research_span.set(
+                    papers_admitted=relevance.admitted,
+                    papers_skipped=sum(relevance.skipped.values()),
+                )
@@ -0,0 +1,212 @@
+import asyncio
+import contextlib
+import time
+from collections import OrderedDict, deque
+from enum import Enum
+from typing import AsyncContextManager, AsyncIterator
+
+from api.config import (
+    DOWNLOAD_CONCURRENCY,
+    DOWNLOAD_CONCURRENCY_PER_RESEARCH,
+    PARSE_CONCURRENCY,
+    PARSE_CONCURRENCY_PER_RESEARCH,
+    SEARCH_CONCURRENCY,
+    SEARCH_CONCURRENCY_PER_RESEARCH,
+    SUMMARIZE_CONCURRENCY,
+    SUMMARIZE_CONCURRENCY_PER_RESEARCH,
+)
+from api.research.context import current_research_id
+from api.telemetry.metrics import STAGE_QUEUE_SECONDS
+
+# Work done outside of any research (e.g. warm-up) is queued as if it were one research
+NO_RESEARCH = "<none>"
+
+
+class PipelineStage(str, Enum):
+    SEARCH = "search"
+    DOWNLOAD = "download"
+    PARSE = "parse"
+    SUMMARIZE = "summarize"
+
+
+class WaitStats:
+    # Keep a window of recent waits for percentiles, lifetime totals for everything else
+    WINDOW = 1024
+
+    def __init__(self):
+        self.count = 0
+        self.total_seconds = 0.0
+        self.max_seconds = 0.0
+        self._recent: deque[float] = deque(maxlen=self.WINDOW)
+
+    def record(self, seconds: float):
+        self.count += 1
+        self.total_seconds += seconds
+        self.max_seconds = max(self.max_seconds, seconds)
+        self._recent.append(seconds)
+
+    def percentile(self, fraction: float) -> float:
+        if not self._recent:
+            return 0.0
+        recent = sorted(self._recent)
+        return recent[min(len(recent) - 1, int(fraction * len(recent)))]
+
+    def to_dict(self) -> dict:
+        return {
+            "count": self.count,
+            "mean_seconds": self.total_seconds / self.count if self.count else 0.0,
+            "p50_seconds": self.percentile(0.5),
+            "p95_seconds": self.percentile(0.95),
+            "p99_seconds": self.percentile(0.99),
+            "max_seconds": self.max_seconds,
+        }
+
+
+class FairLimiter:
+    # A semaphore with a global limit and a per-session limit. When a slot frees up, sessions
+    # with queued work take turns (round robin) rather than first-come-first-served,
+    # so one research with 30 papers can't starve one that just started.
+
+    def __init__(self, limit: int, per_session_limit: int):
+        self.limit = limit
+        self.per_session_limit = per_session_limit
+        self.active_total = 0
+        self._active: dict[str, int] = {}
+        self._waiters: OrderedDict[str, deque[asyncio.Future]] = OrderedDict()
+
+    @property
+    def queued(self) -> int:
+        return sum(len(waiters) for waiters in self._waiters.values())
+
+    def _has_capacity(self, session: str) -> bool:
+        return (
+            self.active_total < self.limit
+            and self._active.get(session, 0) < self.per_session_limit
+        )
+
+    def _grant(self, session: str):
+        self.active_total += 1
+        self._active[session] = self._active.get(session, 0) + 1
+
+    async def acquire(self, session: str):
+        if self._has_capacity(session) and session not in self._waiters:
+            self._grant(session)
+            return
+
+        waiter = asyncio.get_running_loop().create_future()
+        self._waiters.setdefault(session, deque()).append(waiter)
+        try:
+            await waiter
+        except asyncio.CancelledError:
+            if waiter.done() and not waiter.cancelled():
+                # Got the slot just as we were cancelled, hand it on
+                self.release(session)
+            else:
+                self._remove_waiter(session, waiter)
+            raise
+
+    def _remove_waiter(self, session: str, waiter: asyncio.Future):
+        waiters = self._waiters.get(session)
+        if waiters is None:
+            return
+        with contextlib.suppress(ValueError):
+            waiters.remove(waiter)
+        if not waiters:
+            del self._waiters[session]
+
+    def release(self, session: str):
+        self.active_total -= 1
+        self._active[session] -= 1
+        if not self._active[session]:
+            del self._active[session]
+        self._dispatch()
+
+    def _dispatch(self):
+        while self.active_total < self.limit:
+            for session, waiters in self._waiters.items():
+                if self._active.get(session, 0) < self.per_session_limit:
+                    break
+            else:
+                # Everybody waiting is at their per-session limit
+                return
+
+            waiter = waiters.popleft()
+            if waiters:
+                # Back of the line for this session's next turn
+                self._waiters.move_to_end(session)
+            else:
+                del self._waiters[session]
+
+            if not waiter.done():
+                self._grant(session)
+                waiter.set_result(None)
+
+
+class StageScheduler:
+    def __init__(self, limits: dict[PipelineStage, tuple[int, int]]):
+        self.limiters = {
+            stage: FairLimiter(limit, per_research_limit)
+            for stage, (limit, per_research_limit) in limits.items()
+        }
+        self.wait_stats = {stage: WaitStats() for stage in limits}
+
+    @classmethod
+    def from_config(cls) -> "StageScheduler":
+        return cls(
+            {
+                PipelineStage.SEARCH: (
+                    SEARCH_CONCURRENCY,
+                    SEARCH_CONCURRENCY_PER_RESEARCH,
+                ),
+                PipelineStage.DOWNLOAD: (
+                    DOWNLOAD_CONCURRENCY,
+                    DOWNLOAD_CONCURRENCY_PER_RESEARCH,
+                ),
+                PipelineStage.PARSE: (PARSE_CONCURRENCY, PARSE_CONCURRENCY_PER_RESEARCH),
+                PipelineStage.SUMMARIZE: (
+                    SUMMARIZE_CONCURRENCY,
+                    SUMMARIZE_CONCURRENCY_PER_RESEARCH,
+                ),
+            }
+        )
+
+    @contextlib.asynccontextmanager
+    async def slot(
+        self, stage: PipelineStage, research_id: str | None = None
+    ) -> AsyncIterator[None]:
+        limiter = self.limiters.get(stage)
+        if limiter is None:
+            yield
+            return
+
+        session = research_id or current_research_id.get() or NO_RESEARCH
+        started = time.monotonic()
+        await limiter.acquire(session)
+        waited = time.monotonic() - started
+        self.wait_stats[stage].record(waited)
+        STAGE_QUEUE_SECONDS.observe(waited, stage=stage.value)
+        try:
+            yield
+        finally:
+            limiter.release(session)
+
+    def stats(self) -> dict:
+        return {
+            stage.value: {
+                "limit": limiter.limit,
+                "per_research_limit": limiter.per_session_limit,
+                "active": limiter.active_total,
+                "queued": limiter.queued,
+                "queue_wait": self.wait_stats[stage].to_dict(),
+            }
+            for stage, limiter in self.limiters.items()
+        }
+
+
+def stage_slot(
+    scheduler: StageScheduler | None, stage: PipelineStage
+) -> AsyncContextManager:
+    # Components can be used without a scheduler, in which case nothing is limited
+    if scheduler is None:
+        return contextlib.nullcontext()
+    return scheduler.slot(stage)
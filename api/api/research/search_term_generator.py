@@ -1,9 +1,18 @@
 import abc
+import logging
+import time
 from typing import AsyncIterator
 
+from api.cache.store import CacheStats, CacheStore
+from api.config import SEARCH_TERMS_CACHE_TTL_SECONDS
 from api.llm.openai_client import OpenAIClientWrapper, OpenAIModel, OpenAIParams
 from api.llm.prompt_builder import PromptBuilder
 from api.llm.streams import LineByLineStreamParser
+from api.research.prompt_normalizer import PROMPT_NORMALIZER_VERSION, normalize_prompt
+from api.telemetry.tracing import span
+from pydantic import BaseModel
+
+logger = logging.getLogger(__name__)
 
 
 class SearchTermGenerator(abc.ABC):
@@ -26,7 +35,7 @@ class OpenAIPDFSearchTermGenerator(SearchTermGenerator):
     async def generate_search_terms_async(
         self, user_topic: str, n: int = 10
     ) -> AsyncIterator[str]:
-        print("Generating search terms...")
+        logger.info("Generating search terms...")
         response_iterator = self.openai_client.stream_completion_async(
             model=OpenAIModel.GPT_3_5_TURBO_0125,
             prompt=PromptBuilder.system(
@@ -56,9 +65,68 @@ class OpenAIPDFSearchTermGenerator(SearchTermGenerator):
         )
 
         index = 0
-        async for response in self.stream_parser.parse_stream_async(response_iterator):
-            print("Yielding search term: ", response)
-            yield f"{response} filetype:pdf"
-            index += 1
-            if index >= n:
-                return
+        with span("search_terms") as search_terms_span:
+            async for response in self.stream_parser.parse_stream_async(
+                response_iterator
+            ):
+                logger.info("Yielding search term: %s", response)
+                yield f"{response} filetype:pdf"
+                index += 1
+                search_terms_span.set(terms=index)
+                if index >= n:
+                    return
+
+
+class CachedSearchTerms(BaseModel):
+    terms: list[str]
+    generated_at: float
+
+
+class CachingSearchTermGenerator(SearchTermGenerator):
+    # Remembers the search terms generated for each prompt, so the same prompt researched again
+    # (by anybody, in any process sharing the cache) goes straight to searching
+
+    NAMESPACE = "search_terms"
+
+    def __init__(
+        self,
+        search_term_generator: SearchTermGenerator,
+        store: CacheStore,
+        ttl_seconds: float = SEARCH_TERMS_CACHE_TTL_SECONDS,
+    ):
+        self.search_term_generator = search_term_generator
+        self.store = store
+        self.ttl_seconds = ttl_seconds
+        self.stats = CacheStats()
+
+    async def generate_search_terms_async(
+        self, user_topic: str, n: int = 10
+    ) -> AsyncIterator[str]:
+        key = f"p{PROMPT_NORMALIZER_VERSION}:{int(n)}:{normalize_prompt(user_topic)}"
+        value = await self.store.get_async(self.NAMESPACE, key)
+        cached = CachedSearchTerms.model_validate_json(value) if value else None
+        if cached is not None and time.time() - cached.generated_at < self.ttl_seconds:
+            self.stats.record(True)
+            for term in cached.terms:
+                yield term
+            return
+
+        self.stats.record(False)
+
+        # Stream them through as they're generated, and only remember them if we saw them all
+        terms = []
+        async for term in self.search_term_generator.generate_search_terms_async(
+            user_topic, n
+        ):
+            terms.append(term)
+            yield term
+
+        if terms:
+            cached = CachedSearchTerms(terms=terms, generated_at=time.time())
+            await self.store.set_async(
+                self.NAMESPACE, key, cached.model_dump_json().encode()
+            )
+            self.stats.sets += 1
+
+    def stats_dict(self) -> dict:
+        return self.stats.to_dict()
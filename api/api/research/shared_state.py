@@ -0,0 +1,90 @@
+import fcntl
+import mmap
+import os
+import threading
+import time
+import zlib
+from contextlib import contextmanager
+from typing import Iterator
+
+
+class LocalState(dict):
+    # State for one process only, the event loop is all the locking it needs
+
+    clock = staticmethod(time.monotonic)
+
+    @contextmanager
+    def locked(self) -> Iterator["LocalState"]:
+        yield self
+
+    def close(self):
+        pass
+
+
+class SharedState:
+    # A few numbers shared by every process on the box that opens the same file, e.g. the state of a
+    # rate limit, so several workers keep to it together rather than each using all of it.
+    # The file is memory-mapped and only read or written under an exclusive lock on it. It's held for
+    # microseconds at a time, so it's fine to take on the event loop.
+    #
+    # Times are wall-clock, monotonic clocks don't survive a reboot and the file does.
+
+    clock = staticmethod(time.time)
+
+    def __init__(self, path: str, initial: dict[str, float]):
+        self.path = path
+        # Cell 0 says which numbers are kept in which cell, so a file left by a version that kept
+        # different ones is started over rather than misread
+        self._indexes = {name: index + 1 for index, name in enumerate(initial)}
+        layout = float(zlib.crc32(",".join(initial).encode()))
+        size = 8 * (len(initial) + 1)
+
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+        # The file lock is per process, threads in it take turns on this first
+        self._thread_lock = threading.Lock()
+
+        fcntl.flock(self._fd, fcntl.LOCK_EX)
+        try:
+            if os.fstat(self._fd).st_size < size:
+                os.ftruncate(self._fd, size)
+            self._mmap = mmap.mmap(self._fd, size)
+            self._cells = memoryview(self._mmap).cast("d")
+            if self._cells[0] != layout:
+                for name, index in self._indexes.items():
+                    self._cells[index] = initial[name]
+                self._cells[0] = layout
+        finally:
+            fcntl.flock(self._fd, fcntl.LOCK_UN)
+
+    @contextmanager
+    def locked(self) -> Iterator["SharedState"]:
+        with self._thread_lock:
+            fcntl.flock(self._fd, fcntl.LOCK_EX)
+            try:
+                yield self
+            finally:
+                fcntl.flock(self._fd, fcntl.LOCK_UN)
+
+    def __getitem__(self, name: str) -> float:
+        return self._cells[self._indexes[name]]
+
+    def __setitem__(self, name: str, value: float):
+        self._cells[self._indexes[name]] = value
+
+    def close(self):
+        if self._fd < 0:
+            return
+        self._cells.release()
+        self._mmap.close()
+        os.close(self._fd)
+        self._fd = -1
+
+
+def open_state(path: str | None, initial: dict[str, float]) -> LocalState | SharedState:
+    # Shared through `path` if there is one, otherwise just this process's
+    if path is None:
+        return LocalState(initial)
+    return SharedState(path, initial)
@@ -0,0 +1,59 @@
+import asyncio
+from typing import Awaitable, Callable, Generic, TypeVar
+
+Result = TypeVar("Result")
+
+
+class _Flight:
+    def __init__(self, task: asyncio.Task):
+        self.task = task
+        self.waiters = 0
+
+
+class SingleFlight(Generic[Result]):
+    # Coalesces concurrent calls with the same key: the first caller starts the work,
+    # everybody else awaits the same task instead of starting their own.
+
+    def __init__(self):
+        self._flights: dict[str, _Flight] = {}
+        self.started = 0
+        self.joined = 0
+
+    @property
+    def in_flight(self) -> int:
+        return len(self._flights)
+
+    def _forget(self, key: str, task: asyncio.Task):
+        flight = self._flights.get(key)
+        if flight is not None and flight.task is task:
+            del self._flights[key]
+
+    async def do(self, key: str, work: Callable[[], Awaitable[Result]]) -> Result:
+        flight = self._flights.get(key)
+        if flight is None:
+            task = asyncio.ensure_future(work())
+            task.add_done_callback(lambda done: self._forget(key, done))
+            flight = _Flight(task)
+            self._flights[key] = flight
+            self.started += 1
+        else:
+            self.joined += 1
+
+        flight.waiters += 1
+        try:
+            # Shielded so one caller going away doesn't cancel the work for everybody else
+            return await asyncio.shield(flight.task)
+        except asyncio.CancelledError:
+            if flight.waiters == 1 and not flight.task.done():
+                # Last one interested, no point finishing the work
+                flight.task.cancel()
+            raise
+        finally:
+            flight.waiters -= 1
+
+    def stats(self) -> dict:
+        return {
+            "started": self.started,
+            "joined": self.joined,
+            "in_flight": self.in_flight,
+        }
@@ -0,0 +1,73 @@
+import re
+from urllib.parse import parse_qsl, urlencode, urlsplit, urlunsplit
+
+# Query parameters that only exist for tracking and never change the document
+TRACKING_PARAMS = {
+    "fbclid",
+    "gclid",
+    "dclid",
+    "msclkid",
+    "yclid",
+    "igshid",
+    "mc_cid",
+    "mc_eid",
+    "_ga",
+    "_gl",
+    "ref",
+    "ref_src",
+    "referrer",
+    "sa",
+    "ved",
+    "usg",
+}
+
+ARXIV_HOSTS = {"arxiv.org", "www.arxiv.org", "export.arxiv.org"}
+
+# /abs/2101.00001, /abs/2101.00001v2, /pdf/2101.00001v2.pdf, /pdf/hep-th/9901001 ...
+ARXIV_PATH = re.compile(r"^/(?:abs|pdf)/(?P<id>.+?)(?:\.pdf)?/?$")
+
+
+def _is_tracking_param(name: str) -> bool:
+    name = name.lower()
+    return name in TRACKING_PARAMS or name.startswith("utm_")
+
+
+def _arxiv_pdf_url(host: str, path: str) -> str | None:
+    if host not in ARXIV_HOSTS:
+        return None
+    match = ARXIV_PATH.match(path)
+    # The abstract page is HTML, the PDF is what we can actually read
+    return f"https://arxiv.org/pdf/{match['id']}" if match else None
+
+
+def fetchable_paper_url(url: str) -> str:
+    # Where to download a paper found at `url`: the URL itself, whatever else normalizing it would
+    # change might change what the server sends back. Except arXiv's abstract pages, for their PDF.
+    parts = urlsplit(url.strip())
+    return _arxiv_pdf_url((parts.hostname or "").lower(), parts.path) or url
+
+
+def normalize_paper_url(url: str) -> str:
+    # Different search results often point at the same paper with slightly different URLs.
+    # This is the key they're told apart by, see `fetchable_paper_url` for what to download.
+    parts = urlsplit(url.strip())
+    scheme = (parts.scheme or "https").lower()
+    host = (parts.hostname or "").lower()
+
+    arxiv_pdf_url = _arxiv_pdf_url(host, parts.path)
+    if arxiv_pdf_url is not None:
+        return arxiv_pdf_url
+
+    netloc = host
+    default_port = {"http": 80, "https": 443}.get(scheme)
+    if parts.port and parts.port != default_port:
+        netloc = f"{host}:{parts.port}"
+
+    query = sorted(
+        (name, value)
+        for name, value in parse_qsl(parts.query, keep_blank_values=True)
+        if not _is_tracking_param(name)
+    )
+
+    # Fragments never reach the server, so they never change the document
+    return urlunsplit((scheme, netloc, parts.path or "/", urlencode(query), ""))
@@ -1,8 +1,33 @@
 import abc
+import asyncio
+import logging
+import threading
+import time
 from typing import AsyncIterator
+from urllib.error import HTTPError
 
-from api.config import GOOGLE_SEARCH_PAUSE_SECONDS
-from googlesearch import search
+from api.cache.store import CacheStats, CacheStore
+from api.config import (
+    GOOGLE_SEARCH_PAUSE_SECONDS,
+    SEARCH_CACHE_STALE_SECONDS,
+    SEARCH_CACHE_TTL_SECONDS,
+)
+from api.research.rate_limiter import AdaptiveRateLimiter
+from api.telemetry.metrics import WEB_SEARCH_RESULTS, WEB_SEARCHES
+from pydantic import BaseModel
+
+logger = logging.getLogger(__name__)
+
+GOOGLE_SEARCH_USER_AGENT = "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/123.0.0.0 Safari/537.36"
+
+_SEARCH_FINISHED = object()
+
+# Google answers with a 429, or a 503 "sorry" page, when it wants us to slow down
+THROTTLED_STATUS_CODES = {429, 503}
+
+
+class SearchThrottledError(Exception):
+    pass
 
 
 class WebSearcher(abc.ABC):
@@ -15,13 +40,204 @@ class GoogleWebSearcher(WebSearcher):
     def __init__(self):
         self.pause = GOOGLE_SEARCH_PAUSE_SECONDS
 
+    def _search_in_thread(
+        self,
+        query: str,
+        n: int,
+        loop: asyncio.AbstractEventLoop,
+        results: asyncio.Queue,
+        cancelled: threading.Event,
+    ):
+        # `googlesearch.search` does blocking HTTP and `time.sleep(pause)` between pages,
+        # so it runs on its own thread and hands each URL back to the event loop as it's found
+        def _put(item):
+            try:
+                loop.call_soon_threadsafe(results.put_nowait, item)
+            except RuntimeError:
+                # The event loop has already shut down, nobody is listening anymore
+                cancelled.set()
+
+        try:
+            # Imported here, on the thread and only if Google is actually searched
+            from googlesearch import search
+
+            for url in search(
+                query,
+                num=n,
+                stop=n,
+                pause=self.pause,
+                user_agent=GOOGLE_SEARCH_USER_AGENT,
+            ):
+                if cancelled.is_set():
+                    return
+                _put(url)
+        except HTTPError as e:
+            if e.code in THROTTLED_STATUS_CODES:
+                _put(SearchThrottledError(f"Google search throttled ({e.code})"))
+            else:
+                _put(e)
+        except Exception as e:
+            _put(e)
+        finally:
+            _put(_SEARCH_FINISHED)
+
+    async def top_urls_async(self, query: str, n: int = 10) -> AsyncIterator[str]:
+        logger.info("Searching google for: %s", query)
+        loop = asyncio.get_running_loop()
+        results: asyncio.Queue = asyncio.Queue()
+        cancelled = threading.Event()
+
+        thread = threading.Thread(
+            target=self._search_in_thread,
+            args=(query, n, loop, results, cancelled),
+            name="google-search",
+            daemon=True,
+        )
+        thread.start()
+
+        try:
+            while True:
+                item = await results.get()
+                if item is _SEARCH_FINISHED:
+                    return
+                if isinstance(item, Exception):
+                    raise item
+                yield item
+        finally:
+            # If the consumer stops early (or is cancelled), let the thread bail out
+            # before it fetches another page of results
+            cancelled.set()
+
+
+class RateLimitedWebSearcher(WebSearcher):
+    # Puts a (shared) adaptive rate limiter in front of any searcher, and tells it how upstream responded
+
+    def __init__(self, web_searcher: WebSearcher, rate_limiter: AdaptiveRateLimiter):
+        self.web_searcher = web_searcher
+        self.rate_limiter = rate_limiter
+
+    async def top_urls_async(self, query: str, n: int = 10) -> AsyncIterator[str]:
+        await self.rate_limiter.acquire()
+
+        started = time.monotonic()
+        recorded = False
+        results = 0
+        try:
+            async for url in self.web_searcher.top_urls_async(query, n):
+                if not recorded:
+                    # Time to first result is what users feel, and what slows down first when throttled
+                    self.rate_limiter.record_success(time.monotonic() - started)
+                    recorded = True
+                results += 1
+                yield url
+
+            if not recorded:
+                self.rate_limiter.record_success(time.monotonic() - started)
+            WEB_SEARCHES.inc(outcome="ok")
+            WEB_SEARCH_RESULTS.observe(results)
+        except SearchThrottledError:
+            self.rate_limiter.record_throttled()
+            WEB_SEARCHES.inc(outcome="throttled")
+            raise
+        except Exception:
+            # Only the search failing counts. The consumer closing or cancelling the search before
+            # its first result (GeneratorExit, CancelledError) says nothing about upstream.
+            if not recorded:
+                self.rate_limiter.record_failure()
+                WEB_SEARCHES.inc(outcome="failed")
+            raise
+
+
+class CachedSearchResults(BaseModel):
+    urls: list[str]
+    fetched_at: float
+
+
+class CachingWebSearcher(WebSearcher):
+    # Remembers the ordered results for each query. Within the TTL they're served straight
+    # from the cache, for a while after that they're still served but refreshed in the background.
+
+    NAMESPACE = "search_results"
+
+    def __init__(
+        self,
+        web_searcher: WebSearcher,
+        store: CacheStore,
+        ttl_seconds: float = SEARCH_CACHE_TTL_SECONDS,
+        stale_seconds: float = SEARCH_CACHE_STALE_SECONDS,
+    ):
+        self.web_searcher = web_searcher
+        self.store = store
+        self.ttl_seconds = ttl_seconds
+        self.stale_seconds = stale_seconds
+        self.stats = CacheStats()
+        self.stale_hits = 0
+        self._refreshes: dict[str, asyncio.Task] = {}
+
+    @classmethod
+    def normalize_query(cls, query: str) -> str:
+        return " ".join(query.lower().split())
+
+    async def _get_async(self, key: str) -> CachedSearchResults | None:
+        value = await self.store.get_async(self.NAMESPACE, key)
+        return CachedSearchResults.model_validate_json(value) if value else None
+
+    async def _set_async(self, key: str, urls: list[str]):
+        results = CachedSearchResults(urls=urls, fetched_at=time.time())
+        await self.store.set_async(
+            self.NAMESPACE, key, results.model_dump_json().encode()
+        )
+
+    async def _refresh_async(self, key: str, query: str, n: int):
+        try:
+            urls = [url async for url in self.web_searcher.top_urls_async(query, n)]
+            await self._set_async(key, urls)
+        except Exception as e:
+            # Still have the stale results, try again next time somebody asks
+            logger.warning("Background search refresh failed: %s: %r", query, e)
+
+    def _refresh_in_background(self, key: str, query: str, n: int):
+        if key in self._refreshes:
+            return
+        task = asyncio.create_task(self._refresh_async(key, query, n))
+        self._refreshes[key] = task
+        task.add_done_callback(lambda _: self._refreshes.pop(key, None))
+
     async def top_urls_async(self, query: str, n: int = 10) -> AsyncIterator[str]:
-        print("Searching google for: ", query)
-        for url in search(
-            query,
-            num=n,
-            stop=n,
-            pause=self.pause,
-            user_agent="Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/123.0.0.0 Safari/537.36",
-        ):
+        key = f"{int(n)}:{self.normalize_query(query)}"
+        cached = await self._get_async(key)
+
+        if cached is not None:
+            age = time.time() - cached.fetched_at
+            if age < self.ttl_seconds + self.stale_seconds:
+                self.stats.record(True)
+                if age >= self.ttl_seconds:
+                    self.stale_hits += 1
+                    self._refresh_in_background(key, query, n)
+
+                for url in cached.urls:
+                    yield url
+                return
+
+        self.stats.record(False)
+
+        # Stream live results through as they arrive, and only remember them if we saw them all
+        urls = []
+        async for url in self.web_searcher.top_urls_async(query, n):
+            urls.append(url)
             yield url
+
+        await self._set_async(key, urls)
+        self.stats.sets += 1
+
+    async def aclose(self):
+        for task in list(self._refreshes.values()):
+            task.cancel()
+        await asyncio.gather(*self._refreshes.values(), return_exceptions=True)
+
+    def stats_dict(self) -> dict:
+        return {
+            **self.stats.to_dict(),
+            "stale_hits": self.stale_hits,
+            "refreshing": len(self._refreshes),
+        }
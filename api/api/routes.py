@@ -1,8 +1,17 @@
+import asyncio
+from enum import Enum
 from typing import Annotated, AsyncIterator
-from api.deps import get_researcher
-from api.research.researcher import Researcher
-from api.types import ResearchSnapshot
-from fastapi import APIRouter, Depends
+from api.config import BATCH_CONCURRENCY, PROFILER_ENABLED
+from api.container import AppContainer
+from api.deps import get_container, get_research_sessions
+from api.research.batch_runner import BatchReport, BatchRequest, BatchResult
+from api.research.research_session import ResearchSessionManager
+from api.telemetry.diagnostics import ProfilerBusyError
+from api.telemetry.metrics import REGISTRY
+from api.telemetry.tracing import TRACER, ResearchTrace
+from api.types import ResearchDelta, ResearchSnapshot, ResearchState
+from fastapi import APIRouter, Depends, Header, HTTPException, Query
+from fastapi.responses import PlainTextResponse, StreamingResponse
 from sse_starlette.sse import EventSourceResponse
 
 router = APIRouter()
@@ -10,27 +19,219 @@ router = APIRouter()
 END_STREAM_SENTINAL = "<<HALT>>"
 
 
+class StreamProtocol(str, Enum):
+    # Full `ResearchSnapshot` on every update, what the UI uses
+    SNAPSHOT = "snapshot"
+    # Typed incremental `ResearchDelta` events, with a full snapshot every so often for resync
+    DELTA = "delta"
+
+
+def _event_id(research_id: str, seq: int) -> str:
+    # Comes back as `Last-Event-ID` when the browser reconnects, which is all we need to resume
+    return f"{research_id}:{seq}"
+
+
+def _parse_event_id(event_id: str | None) -> tuple[str, int] | None:
+    if not event_id:
+        return None
+    research_id, _, seq = event_id.rpartition(":")
+    if not research_id or not seq.lstrip("-").isdigit():
+        return None
+    return research_id, int(seq)
+
+
 async def generate_messages(
-    user_prompt: str, researcher: Researcher
-) -> AsyncIterator[ResearchSnapshot]:
-    index = 0
-    async for research_update in researcher.research_async(user_prompt):
-        yield ResearchSnapshot(order=index, research=research_update).model_dump_json()
-        index += 1
+    sessions: ResearchSessionManager, research_id: str, after_seq: int = -1
+) -> AsyncIterator[dict | str]:
+    async for state in sessions.states_async(research_id, after_seq):
+        yield {
+            "id": _event_id(research_id, state.order),
+            # Only the papers that changed since the last one are encoded again
+            "data": ResearchSnapshot(order=state.order, research=state.research).dump_json(),
+        }
 
     yield END_STREAM_SENTINAL
 
 
+async def generate_delta_messages(
+    sessions: ResearchSessionManager,
+    research_id: str,
+    after_seq: int = -1,
+) -> AsyncIterator[dict | str]:
+    async for seq, order, event_json, snapshot_json in sessions.events_async(
+        research_id, after_seq
+    ):
+        # Events are already serialized, so this is just `ResearchDelta.model_dump_json()` without redoing that
+        yield {
+            "id": _event_id(research_id, seq),
+            "data": f'{{"order":{order},"event":{event_json}}}',
+        }
+
+        # Every so often send everything, so a client that missed or misapplied an event can resync.
+        # It's ordered like any other event and reflects every event before it.
+        if snapshot_json is not None:
+            yield {
+                "id": _event_id(research_id, seq),
+                "data": f'{{"order":{order + 1},"event":{snapshot_json}}}',
+            }
+
+    yield END_STREAM_SENTINAL
+
+
+def _stream_research(
+    sessions: ResearchSessionManager,
+    research_id: str,
+    after_seq: int,
+    protocol: StreamProtocol,
+) -> EventSourceResponse:
+    if protocol == StreamProtocol.DELTA:
+        event_generator = generate_delta_messages(sessions, research_id, after_seq)
+    else:
+        event_generator = generate_messages(sessions, research_id, after_seq)
+    return EventSourceResponse(event_generator)
+
+
 @router.get(
     "/research/create",
     summary="Endpoint for receiving a user prompt and returning server-sent events",
-    response_model=ResearchSnapshot,  # Enables generating typescript types from OpenAPI schema
+    response_model=ResearchSnapshot
+    | ResearchDelta,  # Enables generating typescript types from OpenAPI schema
 )
 async def research_create(
-    researcher: Annotated[Researcher, Depends(get_researcher)], prompt: str
+    sessions: Annotated[ResearchSessionManager, Depends(get_research_sessions)],
+    prompt: str,
+    protocol: StreamProtocol = StreamProtocol.SNAPSHOT,
+    # Research the prompt again, even if it's being (or was recently) researched already
+    fresh: bool = False,
+    last_event_id: Annotated[str | None, Header()] = None,
 ) -> EventSourceResponse:
-    event_generator = generate_messages(prompt, researcher)
-    return EventSourceResponse(event_generator)
+    # The browser reconnecting after a dropped connection, carry on where it left off
+    resume = _parse_event_id(last_event_id)
+    if resume is not None and await sessions.get_state_async(resume[0]) is not None:
+        research_id, after_seq = resume
+    else:
+        state = await sessions.submit_async(prompt, reuse=not fresh)
+        research_id, after_seq = state.research.id, -1
+
+    return _stream_research(sessions, research_id, after_seq, protocol)
+
+
+@router.post(
+    "/research",
+    summary="Queue research for a prompt, follow it with `/research/{research_id}/events`",
+)
+async def research_submit(
+    sessions: Annotated[ResearchSessionManager, Depends(get_research_sessions)],
+    prompt: str,
+    fresh: bool = False,
+) -> ResearchState:
+    return await sessions.submit_async(prompt, reuse=not fresh)
+
+
+@router.post(
+    "/research/batch",
+    summary="Research many prompts at once, streams a JSON line per prompt as each one finishes, then a report",
+    response_model=BatchResult | BatchReport,
+)
+async def research_batch(
+    container: Annotated[AppContainer, Depends(get_container)],
+    batch: BatchRequest,
+) -> StreamingResponse:
+    batch_runner = container.build_batch_runner(
+        batch.concurrency or BATCH_CONCURRENCY
+    )
+
+    async def _lines() -> AsyncIterator[str]:
+        async for line in batch_runner.run_async(batch.prompts):
+            yield line.model_dump_json() + "\n"
+
+    return StreamingResponse(_lines(), media_type="application/x-ndjson")
+
+
+@router.get(
+    "/research/{research_id}",
+    summary="The research so far (or finished), and whether it's still running",
+)
+async def research_get(
+    sessions: Annotated[ResearchSessionManager, Depends(get_research_sessions)],
+    research_id: str,
+) -> ResearchState:
+    state = await sessions.get_state_async(research_id)
+    if state is None:
+        raise HTTPException(status_code=404, detail="Research not found")
+    return state
+
+
+@router.get(
+    "/research/{research_id}/events",
+    summary="Server-sent events for an existing research, from `after` (or `Last-Event-ID`) onwards",
+    response_model=ResearchSnapshot | ResearchDelta,
+)
+async def research_events(
+    sessions: Annotated[ResearchSessionManager, Depends(get_research_sessions)],
+    research_id: str,
+    protocol: StreamProtocol = StreamProtocol.SNAPSHOT,
+    after: int = -1,
+    last_event_id: Annotated[str | None, Header()] = None,
+) -> EventSourceResponse:
+    if await sessions.get_state_async(research_id) is None:
+        raise HTTPException(status_code=404, detail="Research not found")
+
+    resume = _parse_event_id(last_event_id)
+    if resume is not None and resume[0] == research_id:
+        after = resume[1]
+
+    return _stream_research(sessions, research_id, after, protocol)
+
+
+@router.get(
+    "/research/{research_id}/trace",
+    summary="How long each stage took for each paper, for research run by this process",
+)
+async def research_trace(research_id: str) -> ResearchTrace:
+    trace = TRACER.store.get(research_id) if TRACER.store is not None else None
+    if trace is None:
+        raise HTTPException(status_code=404, detail="No trace for this research here")
+    return trace
+
+
+@router.get("/metrics", summary="Counters and histograms in Prometheus text format")
+async def metrics() -> PlainTextResponse:
+    if not REGISTRY.enabled:
+        raise HTTPException(status_code=404, detail="Metrics are disabled")
+    return PlainTextResponse(
+        REGISTRY.render(), media_type="text/plain; version=0.0.4; charset=utf-8"
+    )
+
+
+@router.get(
+    "/debug/profile",
+    summary="Sample the running server's stacks for a while, in flamegraph.pl's folded format",
+)
+async def debug_profile(
+    container: Annotated[AppContainer, Depends(get_container)],
+    seconds: Annotated[float, Query(gt=0)] = 10,
+    hz: Annotated[float, Query(gt=0, le=1000)] = 100,
+    # Otherwise just the event loop, which is where a slow server usually is
+    all_threads: bool = False,
+) -> PlainTextResponse:
+    if not PROFILER_ENABLED:
+        raise HTTPException(status_code=404, detail="The profiler is disabled")
+    loop_thread_id = container.event_loop_monitor.loop_thread_id
+    thread_ids = None if all_threads or loop_thread_id is None else {loop_thread_id}
+    try:
+        # Sampled from another thread, so the loop is profiled doing its usual work
+        folded = await asyncio.to_thread(
+            container.profiler.profile, seconds, hz, thread_ids
+        )
+    except ProfilerBusyError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    return PlainTextResponse(folded)
+
+
+@router.get("/stats", summary="Concurrency, queue and cache statistics for sizing")
+async def stats(container: Annotated[AppContainer, Depends(get_container)]):
+    return container.stats()
 
 
 @router.get("/")
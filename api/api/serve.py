@@ -0,0 +1,53 @@
+import argparse
+import os
+
+import dotenv
+
+# Several processes only make sense sharing the queue and the rate limits, so they're the
+# defaults here. Set before `api.config` is read, anything set explicitly still wins: `.env` is
+# loaded first, since it doesn't override what's already in the environment.
+dotenv.load_dotenv()
+os.environ.setdefault("JOB_QUEUE_BACKEND", "sqlite")
+os.environ.setdefault("SHARED_LIMITS_ENABLED", "true")
+
+import uvicorn  # noqa: E402
+
+from api.config import (  # noqa: E402
+    JOB_QUEUE_BACKEND,
+    RESEARCH_STORE_ENABLED,
+    SHARED_LIMITS_ENABLED,
+)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Serve the API from several worker processes sharing the queue, caches and rate limits"
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=os.cpu_count() or 1,
+        help="How many processes serve requests (and run research)",
+    )
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=5000)
+    args = parser.parse_args()
+
+    if args.workers > 1:
+        # A stream can land on a different worker than the one running its research,
+        # they only meet in the queue and the store
+        if JOB_QUEUE_BACKEND != "sqlite":
+            parser.error("Several workers need a shared queue, set JOB_QUEUE_BACKEND=sqlite")
+        if not RESEARCH_STORE_ENABLED:
+            parser.error("Several workers need the research store, set RESEARCH_STORE_ENABLED=true")
+        if not SHARED_LIMITS_ENABLED:
+            parser.error(
+                "Several workers would each use the whole rate limit, set SHARED_LIMITS_ENABLED=true"
+            )
+
+    # Workers are spawned and import the app themselves, that's what `api.app` starting fast is for
+    uvicorn.run("api.app:app", host=args.host, port=args.port, workers=args.workers)
+
+
+if __name__ == "__main__":
+    main()
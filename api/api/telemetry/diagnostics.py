@@ -0,0 +1,184 @@
+import asyncio
+import logging
+import sys
+import threading
+import time
+import traceback
+from collections import Counter as Tally
+from types import FrameType
+
+from api.config import (
+    EVENT_LOOP_LAG_INTERVAL_SECONDS,
+    EVENT_LOOP_SLOW_CALLBACK_SECONDS,
+    PROFILER_MAX_SECONDS,
+)
+from api.research.scheduler import WaitStats
+from api.telemetry.metrics import REGISTRY
+
+logger = logging.getLogger(__name__)
+
+EVENT_LOOP_LAG_SECONDS = REGISTRY.histogram(
+    "event_loop_lag_seconds",
+    "How late the event loop ran a callback that was due",
+    buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5),
+)
+EVENT_LOOP_BLOCKED = REGISTRY.counter(
+    "event_loop_blocked",
+    "Times a single callback blocked the event loop for longer than the threshold",
+)
+
+# How deep a stack the profiler keeps, the bottom of a very deep one says enough
+PROFILER_MAX_DEPTH = 128
+
+
+def _describe_task(task: asyncio.Task | None) -> str:
+    if task is None:
+        # A plain callback, e.g. from `call_soon`, rather than a coroutine
+        return "<callback>"
+    coro = task.get_coro()
+    name = getattr(coro, "__qualname__", None) or repr(coro)
+    return f"{name} ({task.get_name()})"
+
+
+class EventLoopMonitor:
+    # Measures event-loop lag all the time, and catches whatever blocks the loop in the act.
+    # A task on the loop checks in every `interval`; a watchdog thread notices when it's late by more
+    # than `slow_callback_seconds` and logs what the loop thread is stuck in, stack and all.
+    # Unlike asyncio's debug mode, that costs nothing per callback.
+
+    def __init__(
+        self,
+        interval: float = EVENT_LOOP_LAG_INTERVAL_SECONDS,
+        slow_callback_seconds: float = EVENT_LOOP_SLOW_CALLBACK_SECONDS,
+    ):
+        self.interval = interval
+        self.slow_callback_seconds = slow_callback_seconds
+        self.lag = WaitStats()
+        self.blocked = 0
+        self._loop: asyncio.AbstractEventLoop | None = None
+        self._loop_thread_id: int | None = None
+        self._heartbeat = time.monotonic()
+        self._task: asyncio.Task | None = None
+        self._stopped = threading.Event()
+        self._watchdog: threading.Thread | None = None
+
+    @property
+    def loop_thread_id(self) -> int | None:
+        return self._loop_thread_id
+
+    async def _run_async(self):
+        while True:
+            started = time.monotonic()
+            self._heartbeat = started
+            await asyncio.sleep(self.interval)
+            lag = max(0.0, time.monotonic() - started - self.interval)
+            self.lag.record(lag)
+            EVENT_LOOP_LAG_SECONDS.observe(lag)
+
+    def _watch(self):
+        blocked_since = None
+        while not self._stopped.wait(self.slow_callback_seconds / 4):
+            now = time.monotonic()
+            overdue = now - self._heartbeat - self.interval
+            if overdue < self.slow_callback_seconds:
+                if blocked_since is not None:
+                    logger.warning(
+                        "Event loop was blocked for %.3fs", now - blocked_since
+                    )
+                    blocked_since = None
+                continue
+            if blocked_since is not None:
+                # Already said what it's stuck in
+                continue
+
+            blocked_since = self._heartbeat + self.interval
+            self.blocked += 1
+            EVENT_LOOP_BLOCKED.inc()
+            frame = sys._current_frames().get(self._loop_thread_id)
+            stack = "".join(traceback.format_stack(frame)) if frame else ""
+            logger.warning(
+                "Event loop blocked for %.3fs so far by %s\n%s",
+                overdue,
+                _describe_task(asyncio.current_task(self._loop)),
+                stack,
+            )
+
+    def start(self):
+        self._loop = asyncio.get_running_loop()
+        self._loop_thread_id = threading.get_ident()
+        self._heartbeat = time.monotonic()
+        self._stopped.clear()
+        self._task = asyncio.create_task(self._run_async())
+        if self.slow_callback_seconds > 0:
+            self._watchdog = threading.Thread(
+                target=self._watch, name="event-loop-watchdog", daemon=True
+            )
+            self._watchdog.start()
+
+    async def stop_async(self):
+        self._stopped.set()
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        if self._watchdog is not None:
+            await asyncio.to_thread(self._watchdog.join)
+            self._watchdog = None
+
+    def stats(self) -> dict:
+        return {"lag": self.lag.to_dict(), "blocked": self.blocked}
+
+
+class ProfilerBusyError(Exception):
+    pass
+
+
+class SamplingProfiler:
+    # Samples the stacks of a running process from a background thread and counts them up in the
+    # "folded" format flamegraph.pl, speedscope and friends read: one line per distinct stack,
+    # frames root first separated by ";", then the number of samples it was seen in.
+    # Only one profile at a time, sampling every thread's stack isn't free.
+
+    def __init__(self, max_seconds: float = PROFILER_MAX_SECONDS):
+        self.max_seconds = max_seconds
+        self._lock = threading.Lock()
+
+    @classmethod
+    def _fold(cls, frame: FrameType) -> str:
+        frames = []
+        while frame is not None and len(frames) < PROFILER_MAX_DEPTH:
+            code = frame.f_code
+            frames.append(f"{code.co_qualname} ({code.co_filename}:{code.co_firstlineno})")
+            frame = frame.f_back
+        return ";".join(reversed(frames))
+
+    def _sample(self, seconds: float, hz: float, thread_ids: set[int] | None) -> Tally:
+        stacks = Tally()
+        this_thread = threading.get_ident()
+        thread_names = {thread.ident: thread.name for thread in threading.enumerate()}
+        period = 1 / hz
+        deadline = time.monotonic() + seconds
+        while time.monotonic() < deadline:
+            started = time.monotonic()
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == this_thread:
+                    continue
+                if thread_ids is not None and thread_id not in thread_ids:
+                    continue
+                thread_name = thread_names.get(thread_id, str(thread_id))
+                stacks[f"{thread_name};{self._fold(frame)}"] += 1
+            time.sleep(max(0.0, period - (time.monotonic() - started)))
+        return stacks
+
+    def profile(self, seconds: float, hz: float, thread_ids: set[int] | None = None) -> str:
+        # Blocks for `seconds`, so run it off the event loop
+        if not self._lock.acquire(blocking=False):
+            raise ProfilerBusyError("A profile is already being taken")
+        try:
+            stacks = self._sample(min(seconds, self.max_seconds), hz, thread_ids)
+        finally:
+            self._lock.release()
+        return "".join(f"{stack} {count}\n" for stack, count in stacks.most_common())
@@ -0,0 +1,26 @@
+import logging
+
+from api.config import LOG_LEVEL
+from api.research.context import current_research_id
+
+LOG_FORMAT = "%(asctime)s %(levelname)s %(name)s [%(research_id)s] %(message)s"
+
+
+class ResearchIdFilter(logging.Filter):
+    # Every line logged while working on a research says which one, however deep down it's logged from
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        record.research_id = current_research_id.get() or "-"
+        return True
+
+
+def configure_logging(level: str = LOG_LEVEL):
+    handler = logging.StreamHandler()
+    handler.addFilter(ResearchIdFilter())
+    handler.setFormatter(logging.Formatter(LOG_FORMAT))
+
+    root = logging.getLogger()
+    root.handlers = [handler]
+    root.setLevel(level.upper())
+    # Every request and connection otherwise
+    logging.getLogger("httpx").setLevel(logging.WARNING)
@@ -0,0 +1,253 @@
+import bisect
+import math
+from typing import Callable, Iterable
+
+from api.config import METRICS_ENABLED
+
+# Seconds, from a cache hit to a slow LLM call
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+BYTES_BUCKETS = tuple(2**i for i in range(10, 28, 2))
+COUNT_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000)
+TOKEN_BUCKETS = (10, 50, 100, 250, 500, 1000, 2000, 4000, 8000, 16000)
+
+
+def _format_value(value: float) -> str:
+    if value == math.inf:
+        return "+Inf"
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+def _escape_label_value(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names: tuple[str, ...], values: tuple[str, ...]) -> str:
+    if not names:
+        return ""
+    pairs = ",".join(
+        f'{name}="{_escape_label_value(str(value))}"' for name, value in zip(names, values)
+    )
+    return "{" + pairs + "}"
+
+
+class _Metric:
+    TYPE = ""
+
+    def __init__(self, name: str, help: str, labelnames: tuple[str, ...] = (), enabled: bool = True):
+        self.name = name
+        self.help = help
+        self.labelnames = labelnames
+        self.enabled = enabled
+
+    def _key(self, labels: dict) -> tuple[str, ...]:
+        return tuple(str(labels.get(name, "")) for name in self.labelnames)
+
+    def samples(self) -> Iterable[tuple[str, str, float]]:
+        # (name suffix, formatted labels, value)
+        return ()
+
+    def render(self) -> str:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.TYPE}"]
+        lines += [
+            f"{self.name}{suffix}{labels} {_format_value(value)}"
+            for suffix, labels, value in self.samples()
+        ]
+        return "\n".join(lines)
+
+
+class Counter(_Metric):
+    TYPE = "counter"
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._values: dict[tuple[str, ...], float] = {}
+
+    def inc(self, amount: float = 1, **labels):
+        if not self.enabled:
+            return
+        key = self._key(labels)
+        self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels) -> float:
+        return self._values.get(self._key(labels), 0)
+
+    def samples(self) -> Iterable[tuple[str, str, float]]:
+        # Prometheus wants the `_total` suffix on the samples, not on the name
+        for key, value in sorted(self._values.items()):
+            yield "_total", _format_labels(self.labelnames, key), value
+
+
+class Histogram(_Metric):
+    TYPE = "histogram"
+
+    def __init__(self, *args, buckets: tuple[float, ...] = DURATION_BUCKETS, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.buckets = tuple(buckets)
+        # Per label set: a count per bucket (not cumulative, that's worked out when rendering), sum and count
+        self._values: dict[tuple[str, ...], list] = {}
+
+    def observe(self, value: float, **labels):
+        if not self.enabled:
+            return
+        key = self._key(labels)
+        entry = self._values.get(key)
+        if entry is None:
+            entry = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+        entry[0][bisect.bisect_left(self.buckets, value)] += 1
+        entry[1] += value
+        entry[2] += 1
+
+    def count(self, **labels) -> int:
+        entry = self._values.get(self._key(labels))
+        return entry[2] if entry else 0
+
+    def samples(self) -> Iterable[tuple[str, str, float]]:
+        for key, (bucket_counts, total, count) in sorted(self._values.items()):
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (math.inf,), bucket_counts):
+                cumulative += bucket_count
+                yield (
+                    "_bucket",
+                    _format_labels(self.labelnames + ("le",), key + (_format_value(bound),)),
+                    cumulative,
+                )
+            labels = _format_labels(self.labelnames, key)
+            yield "_sum", labels, total
+            yield "_count", labels, count
+
+
+class Gauge(_Metric):
+    # Only ever read when rendering, from whatever `collect` returns then, so it costs nothing in between
+    TYPE = "gauge"
+
+    def __init__(self, *args, collect: Callable[[], dict[tuple[str, ...], float]], **kwargs):
+        super().__init__(*args, **kwargs)
+        self.collect = collect
+
+    def samples(self) -> Iterable[tuple[str, str, float]]:
+        for key, value in sorted(self.collect().items()):
+            yield "", _format_labels(self.labelnames, key), value
+
+
+class MetricsRegistry:
+    # Everything is updated on the event loop, so there's no locking. When disabled every
+    # `inc`/`observe` is a single attribute check, and nothing is kept.
+
+    def __init__(self, enabled: bool = METRICS_ENABLED):
+        self.enabled = enabled
+        self._metrics: dict[str, _Metric] = {}
+
+    def _register(self, metric: _Metric) -> _Metric:
+        existing = self._metrics.get(metric.name)
+        if existing is not None:
+            return existing
+        self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name: str, help: str, labelnames: tuple[str, ...] = ()) -> Counter:
+        return self._register(Counter(name, help, labelnames, enabled=self.enabled))
+
+    def histogram(
+        self,
+        name: str,
+        help: str,
+        labelnames: tuple[str, ...] = (),
+        buckets: tuple[float, ...] = DURATION_BUCKETS,
+    ) -> Histogram:
+        return self._register(
+            Histogram(name, help, labelnames, enabled=self.enabled, buckets=buckets)
+        )
+
+    def gauge(
+        self,
+        name: str,
+        help: str,
+        labelnames: tuple[str, ...],
+        collect: Callable[[], dict[tuple[str, ...], float]],
+    ) -> Gauge:
+        # Replaces any gauge of the same name, e.g. when the app is restarted in the same process
+        gauge = Gauge(name, help, labelnames, enabled=self.enabled, collect=collect)
+        self._metrics[name] = gauge
+        return gauge
+
+    def render(self) -> str:
+        # Prometheus text exposition format, version 0.0.4
+        return "\n".join(metric.render() for metric in self._metrics.values()) + "\n"
+
+
+REGISTRY = MetricsRegistry()
+
+STAGE_SECONDS = REGISTRY.histogram(
+    "research_stage_seconds",
+    "Time spent in each stage of research, by outcome",
+    ("stage", "outcome"),
+)
+STAGE_FAILURES = REGISTRY.counter(
+    "research_stage_failures",
+    "Stages that failed, by the type of error",
+    ("stage", "error"),
+)
+STAGE_QUEUE_SECONDS = REGISTRY.histogram(
+    "research_stage_queue_seconds",
+    "Time spent waiting for a slot in each stage",
+    ("stage",),
+)
+PAPER_DOWNLOAD_BYTES = REGISTRY.histogram(
+    "paper_download_bytes", "Size of downloaded papers", buckets=BYTES_BUCKETS
+)
+PDF_PAGES_PARSED = REGISTRY.histogram(
+    "pdf_pages_parsed", "Pages of text extracted from each PDF", buckets=COUNT_BUCKETS
+)
+PAPER_TEXT_CACHE = REGISTRY.counter(
+    "paper_text_cache", "Paper text served from the cache or extracted", ("result",)
+)
+LLM_REQUESTS = REGISTRY.counter(
+    "llm_requests", "Requests made to the LLM", ("model", "mode", "outcome")
+)
+LLM_PROMPT_TOKENS = REGISTRY.counter(
+    "llm_prompt_tokens", "Tokens sent to the LLM", ("model",)
+)
+LLM_COMPLETION_TOKENS = REGISTRY.counter(
+    "llm_completion_tokens", "Tokens received from the LLM", ("model",)
+)
+LLM_PROMPT_TOKENS_PER_REQUEST = REGISTRY.histogram(
+    "llm_prompt_tokens_per_request",
+    "Tokens sent to the LLM in each request",
+    ("model",),
+    buckets=TOKEN_BUCKETS,
+)
+WEB_SEARCHES = REGISTRY.counter("web_searches", "Searches made upstream", ("outcome",))
+WEB_SEARCH_RESULTS = REGISTRY.histogram(
+    "web_search_results", "URLs found by each upstream search", buckets=COUNT_BUCKETS
+)
+RELEVANCE_SCORES = REGISTRY.histogram(
+    "paper_relevance_score",
+    "How relevant each paper found looked before summarizing it",
+    buckets=(0.05, 0.1, 0.15, 0.2, 0.3, 0.4, 0.5, 0.6, 0.8, 1),
+)
+PAPERS_SKIPPED = REGISTRY.counter(
+    "papers_skipped", "Papers found but not summarized, by why", ("reason",)
+)
+LLM_ADMISSION_SECONDS = REGISTRY.histogram(
+    "llm_admission_seconds", "Time LLM calls waited for the token and request budget"
+)
+LLM_RETRIES = REGISTRY.counter(
+    "llm_retries", "LLM calls tried again, by the error that made them", ("model", "reason")
+)
+LLM_HEDGES = REGISTRY.counter(
+    "llm_hedges", "Duplicate LLM calls sent for slow ones, and how many answered first", ("model", "outcome")
+)
+PAPER_SUMMARY_BATCH_PAPERS = REGISTRY.histogram(
+    "paper_summary_batch_papers", "Papers summarized in each batched request", buckets=COUNT_BUCKETS
+)
+PAPER_SUMMARY_BATCH_MISSES = REGISTRY.counter(
+    "paper_summary_batch_misses",
+    "Papers a batched response left out or got wrong, and were summarized on their own",
+)
+RESEARCH_REUSED = REGISTRY.counter(
+    "research_reused",
+    "Research submitted for a prompt that was already being researched, or recently was, by its status",
+    ("status",),
+)
@@ -0,0 +1,181 @@
+import asyncio
+import logging
+import time
+from collections import OrderedDict
+
+from api.config import (
+    METRICS_ENABLED,
+    TRACE_MAX_RESEARCHES,
+    TRACE_MAX_SPANS_PER_RESEARCH,
+    TRACING_ENABLED,
+)
+from api.research.context import current_research_id
+from api.telemetry.metrics import STAGE_FAILURES, STAGE_SECONDS
+from pydantic import BaseModel
+
+logger = logging.getLogger(__name__)
+
+
+class SpanRecord(BaseModel):
+    stage: str
+    # Wall clock, so spans from different stages of the same paper can be lined up
+    started_at: float
+    seconds: float
+    # "ok", "error" or "cancelled"
+    outcome: str
+    error: str | None = None
+    attributes: dict[str, str | int | float | bool | None] = {}
+
+
+class StageSummary(BaseModel):
+    count: int = 0
+    failures: int = 0
+    total_seconds: float = 0
+    max_seconds: float = 0
+
+
+class ResearchTrace(BaseModel):
+    research_id: str
+    spans: list[SpanRecord]
+    # Spans past `TRACE_MAX_SPANS_PER_RESEARCH`, only counted in `stages`
+    dropped: int
+    stages: dict[str, StageSummary]
+
+
+class _ResearchSpans:
+    def __init__(self):
+        self.spans: list[SpanRecord] = []
+        self.dropped = 0
+        self.stages: dict[str, StageSummary] = {}
+
+
+class TraceStore:
+    # The spans of the most recent researches in this process, oldest forgotten first
+
+    def __init__(
+        self,
+        max_researches: int = TRACE_MAX_RESEARCHES,
+        max_spans_per_research: int = TRACE_MAX_SPANS_PER_RESEARCH,
+    ):
+        self.max_researches = max_researches
+        self.max_spans_per_research = max_spans_per_research
+        self._researches: OrderedDict[str, _ResearchSpans] = OrderedDict()
+
+    def record(self, research_id: str, span: SpanRecord):
+        research = self._researches.get(research_id)
+        if research is None:
+            research = self._researches[research_id] = _ResearchSpans()
+            while len(self._researches) > self.max_researches:
+                self._researches.popitem(last=False)
+
+        summary = research.stages.setdefault(span.stage, StageSummary())
+        summary.count += 1
+        summary.failures += span.outcome == "error"
+        summary.total_seconds += span.seconds
+        summary.max_seconds = max(summary.max_seconds, span.seconds)
+
+        if len(research.spans) < self.max_spans_per_research:
+            research.spans.append(span)
+        else:
+            research.dropped += 1
+
+    def get(self, research_id: str) -> ResearchTrace | None:
+        research = self._researches.get(research_id)
+        if research is None:
+            return None
+        return ResearchTrace(
+            research_id=research_id,
+            spans=research.spans,
+            dropped=research.dropped,
+            stages=research.stages,
+        )
+
+
+class _NoopSpan:
+    def __enter__(self) -> "_NoopSpan":
+        return self
+
+    def __exit__(self, *args):
+        return False
+
+    def set(self, **attributes):
+        pass
+
+
+NOOP_SPAN = _NoopSpan()
+
+
+class Span:
+    # Times a stage of the pipeline: into the stage histograms, and into the trace of the
+    # research it's for (the current one, unless told otherwise) with whatever attributes it was given
+
+    __slots__ = ("tracer", "stage", "research_id", "attributes", "_started", "_started_at")
+
+    def __init__(self, tracer: "Tracer", stage: str, research_id: str | None, attributes: dict):
+        self.tracer = tracer
+        self.stage = stage
+        self.research_id = research_id
+        self.attributes = attributes
+
+    def set(self, **attributes):
+        self.attributes.update(attributes)
+
+    def __enter__(self) -> "Span":
+        self._started_at = time.time()
+        self._started = time.monotonic()
+        return self
+
+    def __exit__(self, exc_type, exc, traceback):
+        seconds = time.monotonic() - self._started
+        error = None
+        if exc_type is None:
+            outcome = "ok"
+        elif issubclass(exc_type, (asyncio.CancelledError, GeneratorExit)):
+            # Nobody wanted the result anymore, that's not a failure
+            outcome = "cancelled"
+        else:
+            outcome = "error"
+            error = exc_type.__name__
+            STAGE_FAILURES.inc(stage=self.stage, error=error)
+        STAGE_SECONDS.observe(seconds, stage=self.stage, outcome=outcome)
+
+        research_id = self.research_id or current_research_id.get()
+        if self.tracer.store is not None and research_id is not None:
+            self.tracer.store.record(
+                research_id,
+                SpanRecord(
+                    stage=self.stage,
+                    started_at=self._started_at,
+                    seconds=seconds,
+                    outcome=outcome,
+                    error=error,
+                    attributes=self.attributes,
+                ),
+            )
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug(
+                "%s %s in %.3fs %s", self.stage, outcome, seconds, self.attributes
+            )
+        return False
+
+
+class Tracer:
+    def __init__(
+        self,
+        tracing_enabled: bool = TRACING_ENABLED,
+        metrics_enabled: bool = METRICS_ENABLED,
+    ):
+        self.enabled = tracing_enabled or metrics_enabled
+        self.store = TraceStore() if tracing_enabled else None
+
+    def span(self, stage: str, research_id: str | None = None, **attributes) -> Span | _NoopSpan:
+        if not self.enabled:
+            return NOOP_SPAN
+        return Span(self, stage, research_id, attributes)
+
+
+TRACER = Tracer()
+
+
+def span(stage: str, research_id: str | None = None, **attributes) -> Span | _NoopSpan:
+    return TRACER.span(stage, research_id, **attributes)
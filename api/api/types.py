@@ -1,4 +1,18 @@
-from pydantic import BaseModel
+from enum import Enum
+from typing import Annotated, Literal, Union
+
+from pydantic import BaseModel, Field
+from pydantic_core import to_json
+
+# The snapshot protocol sends the whole research on every update, most of it papers that haven't
+# changed since the last one. So each paper keeps its JSON once it's been encoded, and the rest is
+# put together around it. `dump_json()` is byte for byte what `model_dump_json()` gives.
+# Everything goes into one list joined once at the end, joining at every level copies it all again.
+
+
+def _json_string(value: str) -> str:
+    # Escaped exactly like pydantic escapes a `str` field
+    return to_json(value).decode()
 
 
 class Paper(BaseModel):
@@ -8,18 +22,205 @@ class Paper(BaseModel):
     authors: list[str] | None = None
     publisher: str | None = None
 
+    _json: str | None = None
+
+    def __setattr__(self, name: str, value):
+        super().__setattr__(name, value)
+        # Changed (e.g. more of the summary's been written), encoded again next time.
+        # Fields are only ever replaced, never changed in place, so this sees every change.
+        # The cache is read and written in `__pydantic_private__` directly, going through pydantic's
+        # `__getattr__` for it every time would cost more than encoding the paper again.
+        if name in Paper.model_fields:
+            self.__pydantic_private__["_json"] = None
+
+    def __eq__(self, other) -> bool:
+        # The same paper whether or not either of them has been encoded yet
+        if not isinstance(other, Paper):
+            return NotImplemented
+        return type(self) is type(other) and self.__dict__ == other.__dict__
+
+    def model_copy(self, *, update: dict | None = None, deep: bool = False) -> "Paper":
+        # An update doesn't go through `__setattr__`
+        copy = super().model_copy(update=update, deep=deep)
+        if update:
+            copy.__pydantic_private__["_json"] = None
+        return copy
+
+    def dump_json(self) -> str:
+        cache = self.__pydantic_private__
+        data = cache["_json"]
+        if data is None:
+            data = cache["_json"] = self.model_dump_json()
+        return data
+
+    def _dump_json_parts(self, parts: list[str]):
+        parts.append(self.dump_json())
+
 
 class Search(BaseModel):
     query: str
     papers: list[Paper]
 
+    def _dump_json_parts(self, parts: list[str]):
+        parts.append(f'{{"query":{_json_string(self.query)},"papers":[')
+        for index, paper in enumerate(self.papers):
+            if index:
+                parts.append(",")
+            paper._dump_json_parts(parts)
+        parts.append("]}")
+
 
 class Research(BaseModel):
     id: str
     prompt: str
     searches: list[Search]
 
+    def _dump_json_parts(self, parts: list[str]):
+        parts.append(
+            f'{{"id":{_json_string(self.id)},"prompt":{_json_string(self.prompt)},"searches":['
+        )
+        for index, search in enumerate(self.searches):
+            if index:
+                parts.append(",")
+            search._dump_json_parts(parts)
+        parts.append("]}")
+
+    def dump_json(self) -> str:
+        parts: list[str] = []
+        self._dump_json_parts(parts)
+        return "".join(parts)
+
 
 class ResearchSnapshot(BaseModel):
     order: int
     research: Research
+
+    def dump_json(self) -> str:
+        parts = [f'{{"order":{self.order},"research":']
+        self.research._dump_json_parts(parts)
+        parts.append("}")
+        return "".join(parts)
+
+
+class ResearchStatus(str, Enum):
+    QUEUED = "queued"
+    RUNNING = "running"
+    COMPLETED = "completed"
+    FAILED = "failed"
+    # Was still running when the server (or worker) running it stopped
+    INTERRUPTED = "interrupted"
+
+    @property
+    def finished(self) -> bool:
+        return self not in (ResearchStatus.QUEUED, ResearchStatus.RUNNING)
+
+
+class ResearchState(BaseModel):
+    # `order` is the sequence number of the last event reflected in `research`
+    order: int
+    status: ResearchStatus
+    research: Research
+
+    @property
+    def finished(self) -> bool:
+        return self.status.finished
+
+    def dump_json(self) -> str:
+        parts = [
+            f'{{"order":{self.order},"status":{_json_string(self.status.value)},"research":'
+        ]
+        self.research._dump_json_parts(parts)
+        parts.append("}")
+        return "".join(parts)
+
+
+# Incremental events for the delta streaming protocol.
+# Each one only carries what changed, searches and papers are addressed by their index.
+class ResearchStartedEvent(BaseModel):
+    type: Literal["research_started"] = "research_started"
+    id: str
+    prompt: str
+
+
+class SearchAddedEvent(BaseModel):
+    type: Literal["search_added"] = "search_added"
+    search_index: int
+    query: str
+
+
+class PaperReadingStartedEvent(BaseModel):
+    type: Literal["paper_reading_started"] = "paper_reading_started"
+    search_index: int
+    url: str
+
+
+class PaperAddedEvent(BaseModel):
+    type: Literal["paper_added"] = "paper_added"
+    search_index: int
+    paper_index: int
+    paper: Paper
+
+
+class PaperUpdatedEvent(BaseModel):
+    # More of the paper's summary has been written, `paper` replaces what was at `paper_index`
+    type: Literal["paper_updated"] = "paper_updated"
+    search_index: int
+    paper_index: int
+    paper: Paper
+
+
+class PaperFailedEvent(BaseModel):
+    type: Literal["paper_failed"] = "paper_failed"
+    search_index: int
+    url: str
+    error: str
+    # Set when a partially summarized paper had already been added, it's removed
+    # from the search (so the papers after it move down by one)
+    paper_index: int | None = None
+
+
+class PaperSkippedEvent(BaseModel):
+    # Didn't look relevant enough to be worth summarizing
+    type: Literal["paper_skipped"] = "paper_skipped"
+    search_index: int
+    url: str
+    score: float
+    # "below_threshold", or "over_limit" when the research already has as many papers as it gets
+    reason: str
+
+
+class SnapshotEvent(BaseModel):
+    type: Literal["snapshot"] = "snapshot"
+    research: Research
+
+    def dump_json(self) -> str:
+        parts = ['{"type":"snapshot","research":']
+        self.research._dump_json_parts(parts)
+        parts.append("}")
+        return "".join(parts)
+
+
+ResearchEvent = Annotated[
+    Union[
+        ResearchStartedEvent,
+        SearchAddedEvent,
+        PaperReadingStartedEvent,
+        PaperAddedEvent,
+        PaperUpdatedEvent,
+        PaperFailedEvent,
+        PaperSkippedEvent,
+        SnapshotEvent,
+    ],
+    Field(discriminator="type"),
+]
+
+
+class ResearchDelta(BaseModel):
+    order: int
+    event: ResearchEvent
+
+
+class ResearchUpdate(BaseModel):
+    # What the researcher yields: the event that just happened and the (shared, mutable) research it happened to
+    research: Research
+    event: ResearchEvent
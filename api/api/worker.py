@@ -0,0 +1,55 @@
+import argparse
+import asyncio
+import logging
+import signal
+
+from api.config import JOB_QUEUE_BACKEND, RESEARCH_WORKERS
+from api.container import AppContainer
+from api.telemetry.logs import configure_logging
+
+logger = logging.getLogger(__name__)
+
+
+async def run_workers(concurrency: int):
+    # Same shared clients, caches and pools as the API, just nothing serving HTTP
+    container = AppContainer(research_workers=concurrency)
+    stopped = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for signum in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(signum, stopped.set)
+
+    try:
+        await container.start_async()
+        await container.warm_up_async()
+        logger.info(
+            "Research worker %s running %d jobs at a time",
+            container.research_workers.worker_id,
+            concurrency,
+        )
+        await stopped.wait()
+    finally:
+        logger.info("Research worker stopping")
+        await container.aclose()
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Run research jobs from the shared queue, alongside (or instead of) the API's own workers"
+    )
+    parser.add_argument(
+        "--concurrency",
+        type=int,
+        default=RESEARCH_WORKERS,
+        help="How many research jobs to run at once",
+    )
+    args = parser.parse_args()
+
+    if JOB_QUEUE_BACKEND != "sqlite":
+        parser.error("Workers need a shared queue, set JOB_QUEUE_BACKEND=sqlite")
+
+    configure_logging()
+    asyncio.run(run_workers(args.concurrency))
+
+
+if __name__ == "__main__":
+    main()
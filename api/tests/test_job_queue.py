@@ -0,0 +1,124 @@
+import asyncio
+
+from api.jobs.queue import InMemoryJobQueue, ResearchJob, SQLiteJobQueue
+
+
+def _job(number: int) -> ResearchJob:
+    return ResearchJob(id=f"research-{number}", prompt=f"prompt {number}")
+
+
+def test_claims_in_the_order_submitted(tmp_path):
+    async def _run():
+        queue = SQLiteJobQueue(str(tmp_path / "jobs.sqlite3"))
+        for number in range(3):
+            await queue.submit_async(_job(number))
+        claimed = [await queue.claim_async("worker") for _ in range(3)]
+        await queue.close_async()
+        return claimed
+
+    assert asyncio.run(_run()) == [_job(0), _job(1), _job(2)]
+
+
+def test_a_job_is_only_claimed_once_across_processes(tmp_path):
+    async def _run():
+        path = str(tmp_path / "jobs.sqlite3")
+        # Separate connections to the same file, like separate processes
+        queues = [SQLiteJobQueue(path, poll_seconds=0.01) for _ in range(4)]
+        for number in range(20):
+            await queues[0].submit_async(_job(number))
+
+        claims = [
+            queue.claim_async(f"worker-{i}") for i in range(5) for queue in queues
+        ]
+        claimed = await asyncio.wait_for(asyncio.gather(*claims), 5)
+        for queue in queues:
+            await queue.close_async()
+        return claimed
+
+    claimed = asyncio.run(_run())
+    assert sorted(job.id for job in claimed) == sorted(_job(n).id for n in range(20))
+
+
+def test_claim_waits_for_a_submission(tmp_path):
+    async def _run():
+        queue = SQLiteJobQueue(str(tmp_path / "jobs.sqlite3"), poll_seconds=60)
+        claim = asyncio.create_task(queue.claim_async("worker"))
+        await asyncio.sleep(0.05)
+        assert not claim.done()
+        # Submitted in this process, so it doesn't wait for the next poll
+        await queue.submit_async(_job(1))
+        job = await asyncio.wait_for(claim, 5)
+        await queue.close_async()
+        return job
+
+    assert asyncio.run(_run()) == _job(1)
+
+
+def test_expired_leases_are_dropped(tmp_path):
+    async def _run():
+        # Every lease has already run out by the time it's checked
+        queue = SQLiteJobQueue(str(tmp_path / "jobs.sqlite3"), lease_seconds=-1)
+        await queue.submit_async(_job(1))
+        await queue.submit_async(_job(2))
+        await queue.claim_async("worker")
+        expired = await queue.expire_leases_async()
+        # Queued jobs have no lease to lose
+        claimed = await queue.claim_async("worker")
+        await queue.close_async()
+        return expired, claimed, queue.stats()
+
+    expired, claimed, stats = asyncio.run(_run())
+    assert expired == ["research-1"]
+    assert claimed == _job(2)
+    assert stats["expired"] == 1
+
+
+def test_heartbeat_extends_only_its_own_lease(tmp_path):
+    async def _run():
+        path = str(tmp_path / "jobs.sqlite3")
+        expiring = SQLiteJobQueue(path, lease_seconds=-1)
+        renewing = SQLiteJobQueue(path, lease_seconds=60)
+        await expiring.submit_async(_job(1))
+        await expiring.submit_async(_job(2))
+        await expiring.claim_async("worker-1")
+        await expiring.claim_async("worker-2")
+
+        await renewing.heartbeat_async("research-1", "worker-1")
+        # Somebody else's job, it's not theirs to keep alive
+        await renewing.heartbeat_async("research-2", "worker-1")
+        expired = await expiring.expire_leases_async()
+        await expiring.close_async()
+        await renewing.close_async()
+        return expired
+
+    assert asyncio.run(_run()) == ["research-2"]
+
+
+def test_finished_jobs_are_forgotten(tmp_path):
+    async def _run():
+        queue = SQLiteJobQueue(str(tmp_path / "jobs.sqlite3"), lease_seconds=-1)
+        await queue.submit_async(_job(1))
+        await queue.claim_async("worker")
+        await queue.finish_async("research-1")
+        expired = await queue.expire_leases_async()
+        await queue.close_async()
+        return expired, queue.stats()
+
+    expired, stats = asyncio.run(_run())
+    assert expired == []
+    assert stats["finished"] == 1
+
+
+def test_in_memory_queue_claims_in_order():
+    async def _run():
+        queue = InMemoryJobQueue()
+        await queue.submit_async(_job(1))
+        await queue.submit_async(_job(2))
+        claimed = [await queue.claim_async("worker") for _ in range(2)]
+        await queue.finish_async("research-1")
+        return claimed, queue.stats()
+
+    claimed, stats = asyncio.run(_run())
+    assert claimed == [_job(1), _job(2)]
+    assert stats["running"] == 1
+    assert stats["queued"] == 0
@@ -0,0 +1,55 @@
+import json
+
+import pytest
+from pydantic import BaseModel
+
+from api.llm.json_parser import IncrementalJsonArrayParser, parse_json_object
+
+RESPONSE = json.dumps(
+    {
+        "papers": [
+            {"title": "A [bracketed] title", "summary": 'Says "}" and \\"'},
+            {"title": "Nested", "summary": "ok", "tags": [{"a": [1, 2]}, {"b": {}}]},
+            {"title": "Last", "summary": "done"},
+        ],
+        "other": [{"not": "an element"}],
+    }
+)
+
+
+def _feed_in_chunks(parser: IncrementalJsonArrayParser, data: str, size: int) -> list[str]:
+    elements = []
+    for start in range(0, len(data), size):
+        elements.extend(parser.feed(data[start : start + size]))
+    return elements
+
+
+@pytest.mark.parametrize("size", [1, 2, 7, len(RESPONSE)])
+def test_finds_every_element_of_the_first_array_however_its_split(size):
+    elements = _feed_in_chunks(IncrementalJsonArrayParser(), RESPONSE, size)
+    assert [json.loads(element) for element in elements] == json.loads(RESPONSE)["papers"]
+
+
+def test_elements_come_out_as_soon_as_theyre_complete():
+    parser = IncrementalJsonArrayParser()
+    assert parser.feed('{"papers": [{"title": "One"}, {"title": "Tw') == ['{"title": "One"}']
+    assert parser.feed('o"}') == ['{"title": "Two"}']
+    assert parser.feed("]}") == []
+
+
+def test_ignores_scalars_in_the_array():
+    parser = IncrementalJsonArrayParser()
+    assert parser.feed('{"papers": [1, "two", {"three": 3}, null]}') == ['{"three": 3}']
+
+
+def test_top_level_array():
+    parser = IncrementalJsonArrayParser()
+    assert parser.feed('[{"a": 1},{"b": 2}]') == ['{"a": 1}', '{"b": 2}']
+
+
+class Paper(BaseModel):
+    title: str
+
+
+def test_parse_json_object_unwraps_markdown():
+    assert parse_json_object('```json\n{"title": "T"}\n```', Paper) == Paper(title="T")
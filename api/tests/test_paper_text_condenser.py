@@ -0,0 +1,117 @@
+from api.llm.tokens import ApproximateTokenCounter
+from api.research.paper_text_condenser import PAGE_SEPARATOR, PaperTextCondenser
+
+
+def _condenser() -> PaperTextCondenser:
+    return PaperTextCondenser(ApproximateTokenCounter())
+
+
+def _paragraph(word: str, lines: int) -> str:
+    return "\n".join(f"{word} {word} {word} {word} {word}." for _ in range(lines))
+
+
+def _paper(*sections: tuple[str, str]) -> str:
+    return "\n".join(f"{heading}\n{text}" if heading else text for heading, text in sections)
+
+
+def test_removes_running_headers_and_page_numbers():
+    pages = [
+        "\n".join(["Journal of Things", _paragraph(word, 3), str(number)])
+        for number, word in enumerate(["alpha", "beta", "gamma", "delta"], 1)
+    ]
+    condensed = _condenser().condense(PAGE_SEPARATOR.join(pages), 0)
+    # The title's kept once, from the first page
+    assert condensed.text.count("Journal of Things") == 1
+    assert "delta delta" in condensed.text
+    assert not any(line.strip().isdigit() for line in condensed.text.splitlines())
+
+
+def test_joins_hyphenated_line_breaks():
+    condensed = _condenser().condense("Abstract\nthe experi-\nment worked.", 0)
+    assert "the experiment worked." in condensed.text
+
+
+def test_drops_everything_from_the_references_on():
+    text = _paper(
+        ("", "A Paper"),
+        ("Introduction", _paragraph("intro", 10)),
+        ("Conclusion", _paragraph("conclude", 10)),
+        ("References", "[1] Somebody, Something, 2020."),
+        ("Appendix", _paragraph("extra", 2)),
+    )
+    condensed = _condenser().condense(text, 0)
+    assert "conclude" in condensed.text
+    assert "Somebody" not in condensed.text
+    assert "extra" not in condensed.text
+
+
+def test_references_in_a_table_of_contents_dont_end_the_paper():
+    text = _paper(
+        ("", "A Paper\nContents"),
+        ("1 Introduction", ""),
+        ("References", ""),
+        ("Introduction", _paragraph("intro", 10)),
+        ("Conclusion", _paragraph("conclude", 10)),
+        ("References", "[1] Somebody, Something, 2020."),
+    )
+    condensed = _condenser().condense(text, 0)
+    assert "intro" in condensed.text
+    assert "conclude" in condensed.text
+    assert "Somebody" not in condensed.text
+
+
+def test_drops_acknowledgements():
+    text = _paper(
+        ("Introduction", _paragraph("intro", 5)),
+        ("Acknowledgements", "Thanks to our funders."),
+        ("Results", _paragraph("result", 5)),
+    )
+    condensed = _condenser().condense(text, 0)
+    assert "funders" not in condensed.text
+    assert "result" in condensed.text
+
+
+def test_fits_the_budget_keeping_each_important_section():
+    text = _paper(
+        ("", "A Paper"),
+        ("Abstract", _paragraph("abstract", 50)),
+        ("Introduction", _paragraph("intro", 50)),
+        ("Methods", _paragraph("method", 200)),
+        ("Results", _paragraph("result", 200)),
+        ("Conclusion", _paragraph("conclude", 50)),
+    )
+    condensed = _condenser().condense(text, 500)
+    assert condensed.tokens <= 500
+    assert condensed.original_tokens > 500
+    for word in ("A Paper", "abstract", "intro", "conclude"):
+        assert word in condensed.text
+    # In the paper's own order
+    assert condensed.text.index("Introduction") < condensed.text.index("Conclusion")
+
+
+def test_concluding_sections_share_the_conclusions_budget():
+    text = _paper(
+        ("Abstract", _paragraph("abstract", 50)),
+        ("Methods", _paragraph("method", 200)),
+        ("Summary", _paragraph("summary", 100)),
+        ("Conclusion", _paragraph("conclude", 100)),
+    )
+    condensed = _condenser().condense(text, 400)
+    assert condensed.tokens <= 400
+    assert "summary" in condensed.text
+    assert "conclude" in condensed.text
+
+
+def test_unstructured_text_keeps_its_start_and_end():
+    text = " ".join(f"word{i}" for i in range(2000))
+    condensed = _condenser().condense(text, 200)
+    assert condensed.tokens <= 200
+    assert condensed.text.startswith("word0 ")
+    assert condensed.text.endswith("word1999")
+    assert " [...] " in condensed.text
+
+
+def test_text_within_budget_is_left_alone():
+    text = _paper(("Abstract", "Short."), ("Conclusion", "Also short."))
+    condensed = _condenser().condense(text, 1000)
+    assert condensed.text == "Abstract\nShort.\n\nConclusion\nAlso short."
@@ -0,0 +1,34 @@
+import pytest
+
+from api.research.prompt_normalizer import normalize_prompt
+
+
+@pytest.mark.parametrize(
+    "prompt",
+    [
+        "Effects of caffeine on sleep",
+        "effects of caffeine on sleep.",
+        "  EFFECTS of\tcaffeine\n on sleep?! ",
+        "Effects of caffeine on sleep…",
+        "Ｅffects of caffeine on sleep",
+    ],
+)
+def test_case_spacing_and_sentence_endings_dont_matter(prompt):
+    assert normalize_prompt(prompt) == "effects of caffeine on sleep"
+
+
+def test_curly_apostrophes_are_straightened():
+    assert normalize_prompt("Alzheimer’s treatments") == "alzheimer's treatments"
+
+
+@pytest.mark.parametrize(
+    "prompt, other",
+    [
+        ("C++ compilers", "C compilers"),
+        ("C# generics", "C generics"),
+        ("Is P = NP", "Is P NP"),
+        ("3.5 mm jacks", "35 mm jacks"),
+    ],
+)
+def test_symbols_are_kept(prompt, other):
+    assert normalize_prompt(prompt) != normalize_prompt(other)
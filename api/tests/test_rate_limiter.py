@@ -0,0 +1,152 @@
+import asyncio
+
+import pytest
+
+from api.research.rate_limiter import AdaptiveRateLimiter, CircuitOpenError
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+def _limiter(clock: FakeClock | None = None, **overrides) -> AdaptiveRateLimiter:
+    settings = dict(
+        initial_rate_per_minute=60,
+        min_rate_per_minute=6,
+        max_rate_per_minute=120,
+        burst=2,
+        increase_per_minute=10,
+        decrease_factor=0.5,
+        target_latency_seconds=1.0,
+        circuit_breaker_threshold=3,
+        circuit_breaker_cooldown_seconds=30,
+        backoff_base_seconds=0.001,
+        backoff_max_seconds=0.001,
+    )
+    limiter = AdaptiveRateLimiter(**{**settings, **overrides})
+    if clock is not None:
+        limiter._state.clock = clock
+    return limiter
+
+
+def test_success_increases_rate_additively_up_to_the_max():
+    limiter = _limiter()
+    limiter.record_success(0.1)
+    assert limiter.rate_per_minute == 70
+    for _ in range(10):
+        limiter.record_success(0.1)
+    assert limiter.rate_per_minute == 120
+
+
+def test_slow_success_shaves_the_rate():
+    limiter = _limiter()
+    limiter.record_success(5.0)
+    assert limiter.rate_per_minute == pytest.approx(
+        60 * AdaptiveRateLimiter.SLOW_RESPONSE_DECREASE_FACTOR
+    )
+
+
+def test_throttle_decreases_rate_multiplicatively_down_to_the_min():
+    limiter = _limiter(circuit_breaker_threshold=100)
+    limiter.record_throttled()
+    assert limiter.rate_per_minute == 30
+    for _ in range(10):
+        limiter.record_throttled()
+    assert limiter.rate_per_minute == 6
+
+
+def test_bucket_refills_at_the_rate():
+    clock = FakeClock()
+    limiter = _limiter(clock)
+    # A full bucket to start with
+    assert limiter._try_take() == 0
+    assert limiter._try_take() == 0
+    # 60 a minute, one a second
+    assert limiter._try_take() == pytest.approx(1.0)
+    clock.now += 1.0
+    assert limiter._try_take() == 0
+
+
+def test_circuit_opens_after_consecutive_throttles():
+    async def _run():
+        clock = FakeClock()
+        limiter = _limiter(clock)
+        for _ in range(3):
+            limiter.record_throttled()
+        assert limiter.circuit_state == "open"
+        with pytest.raises(CircuitOpenError):
+            await limiter.acquire()
+        assert limiter.rejected == 1
+
+    asyncio.run(_run())
+
+
+def test_success_resets_consecutive_throttles():
+    limiter = _limiter()
+    limiter.record_throttled()
+    limiter.record_throttled()
+    limiter.record_success(0.1)
+    limiter.record_throttled()
+    assert limiter.circuit_state == "closed"
+
+
+def test_circuit_lets_one_probe_through_after_cooldown():
+    async def _run():
+        clock = FakeClock()
+        limiter = _limiter(clock)
+        for _ in range(3):
+            limiter.record_throttled()
+
+        clock.now += 31
+        await limiter.acquire()
+        assert limiter.circuit_state == "half_open"
+        # Everybody else waits for the probe to report back
+        with pytest.raises(CircuitOpenError):
+            await limiter.acquire()
+
+        limiter.record_success(0.1)
+        assert limiter.circuit_state == "closed"
+        await limiter.acquire()
+
+    asyncio.run(_run())
+
+
+@pytest.mark.parametrize("record", ["record_throttled", "record_failure"])
+def test_failed_probe_opens_the_circuit_again(record):
+    async def _run():
+        clock = FakeClock()
+        limiter = _limiter(clock)
+        for _ in range(3):
+            limiter.record_throttled()
+
+        clock.now += 31
+        await limiter.acquire()
+        getattr(limiter, record)()
+        assert limiter.circuit_state == "open"
+
+    asyncio.run(_run())
+
+
+def test_failure_outside_a_probe_changes_nothing():
+    limiter = _limiter()
+    limiter.record_failure()
+    assert limiter.rate_per_minute == 60
+    assert limiter.circuit_state == "closed"
+
+
+def test_shared_state_is_shared_between_limiters(tmp_path):
+    path = str(tmp_path / "search.limit")
+    first = _limiter(shared_path=path)
+    second = _limiter(shared_path=path)
+    try:
+        first.record_throttled()
+        assert second.rate_per_minute == 30
+        second.record_success(0.1)
+        assert first.rate_per_minute == 40
+    finally:
+        first.close()
+        second.close()
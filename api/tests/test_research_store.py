@@ -0,0 +1,113 @@
+import asyncio
+import sqlite3
+import time
+
+import pytest
+
+from api.research.research_store import InMemoryResearchStore, SQLiteResearchStore
+from api.types import Research, ResearchState, ResearchStatus
+
+
+def _state(research_id: str, prompt: str, status: ResearchStatus) -> ResearchState:
+    return ResearchState(
+        order=0, status=status, research=Research(id=research_id, prompt=prompt, searches=[])
+    )
+
+
+@pytest.fixture(params=["memory", "sqlite"])
+def store(request, tmp_path):
+    if request.param == "memory":
+        store = InMemoryResearchStore()
+    else:
+        store = SQLiteResearchStore(str(tmp_path / "research.sqlite3"))
+    yield store
+    asyncio.run(store.close_async())
+
+
+def _find(store, prompt: str, max_age_seconds: float = 60) -> str | None:
+    state = asyncio.run(store.find_reusable_async(prompt, max_age_seconds))
+    return state.research.id if state else None
+
+
+def test_finds_running_research_for_the_same_prompt(store):
+    asyncio.run(store.save_async(_state("r1", "Quantum computing!", ResearchStatus.RUNNING), []))
+    assert _find(store, "  quantum   Computing") == "r1"
+    assert _find(store, "quantum computers") is None
+
+
+def test_finds_completed_research_only_while_its_recent(store):
+    asyncio.run(store.save_async(_state("r1", "topic", ResearchStatus.COMPLETED), []))
+    assert _find(store, "topic") == "r1"
+    time.sleep(0.02)
+    assert _find(store, "topic", max_age_seconds=0.01) is None
+
+
+@pytest.mark.parametrize("status", [ResearchStatus.FAILED, ResearchStatus.INTERRUPTED])
+def test_never_reuses_research_that_didnt_finish(store, status):
+    asyncio.run(store.save_async(_state("r1", "topic", status), []))
+    assert _find(store, "topic") is None
+
+
+def test_finds_the_latest(store):
+    asyncio.run(store.save_async(_state("r1", "topic", ResearchStatus.COMPLETED), []))
+    time.sleep(0.01)
+    asyncio.run(store.save_async(_state("r2", "Topic.", ResearchStatus.COMPLETED), []))
+    assert _find(store, "topic") == "r2"
+
+
+def test_interrupted_research_isnt_reused(store):
+    asyncio.run(store.save_async(_state("r1", "topic", ResearchStatus.RUNNING), []))
+    assert asyncio.run(store.mark_interrupted_async()) == 1
+    assert _find(store, "topic") is None
+
+
+def test_events_after_a_sequence_number(store):
+    state = _state("r1", "topic", ResearchStatus.RUNNING)
+    asyncio.run(store.save_async(state, [(0, "a"), (1, "b")]))
+    asyncio.run(store.save_async(state, [(2, "c")]))
+    assert asyncio.run(store.get_events_async("r1", 0)) == [(1, "b"), (2, "c")]
+
+
+def test_adds_prompt_keys_to_a_store_from_before(tmp_path):
+    path = str(tmp_path / "research.sqlite3")
+    connection = sqlite3.connect(path)
+    connection.execute(
+        """
+        CREATE TABLE research (
+            id TEXT PRIMARY KEY,
+            prompt TEXT NOT NULL,
+            status TEXT NOT NULL,
+            seq INTEGER NOT NULL,
+            research TEXT NOT NULL,
+            updated_at REAL NOT NULL
+        )
+        """
+    )
+    old = _state("old", "Old Topic?", ResearchStatus.COMPLETED)
+    connection.execute(
+        "INSERT INTO research VALUES (?, ?, ?, ?, ?, ?)",
+        ("old", old.research.prompt, old.status.value, 0, old.research.dump_json(), time.time()),
+    )
+    connection.commit()
+    connection.close()
+
+    async def _run():
+        store = SQLiteResearchStore(path)
+        # Another process opening it too, it's only migrated once
+        other = SQLiteResearchStore(path)
+        await other.get_async("old")
+        try:
+            await store.save_async(_state("new", "new topic", ResearchStatus.RUNNING), [])
+            return (
+                await store.get_async("old"),
+                await store.find_reusable_async("old topic", 60),
+                await store.find_reusable_async("new topic", 60),
+            )
+        finally:
+            await store.close_async()
+            await other.close_async()
+
+    old_state, reused_old, reused_new = asyncio.run(_run())
+    assert old_state == old
+    assert reused_old.research.id == "old"
+    assert reused_new.research.id == "new"
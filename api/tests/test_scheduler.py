@@ -0,0 +1,79 @@
+import asyncio
+
+from api.research.scheduler import FairLimiter
+
+
+async def _drain(limiter: FairLimiter, order: list[str], session: str):
+    await limiter.acquire(session)
+    order.append(session)
+    # Hold the slot until everybody who's going to has queued up behind it
+    await asyncio.sleep(0)
+    limiter.release(session)
+
+
+def test_acquires_straight_away_within_limits():
+    async def _run():
+        limiter = FairLimiter(limit=2, per_session_limit=2)
+        await limiter.acquire("a")
+        await limiter.acquire("b")
+        assert limiter.active_total == 2
+        assert limiter.queued == 0
+
+    asyncio.run(_run())
+
+
+def test_per_session_limit_leaves_room_for_others():
+    async def _run():
+        limiter = FairLimiter(limit=3, per_session_limit=1)
+        await limiter.acquire("a")
+        second_a = asyncio.create_task(limiter.acquire("a"))
+        await asyncio.sleep(0)
+        # "a" has to wait for its own slot, "b" doesn't
+        await asyncio.wait_for(limiter.acquire("b"), 1)
+        assert not second_a.done()
+        assert limiter.queued == 1
+
+        limiter.release("a")
+        await asyncio.wait_for(second_a, 1)
+        assert limiter.active_total == 2
+
+    asyncio.run(_run())
+
+
+def test_sessions_take_turns():
+    async def _run():
+        limiter = FairLimiter(limit=1, per_session_limit=1)
+        await limiter.acquire("busy")
+        order: list[str] = []
+        # A research with lots of work queued first, then one that just started
+        tasks = [asyncio.create_task(_drain(limiter, order, "busy")) for _ in range(4)]
+        await asyncio.sleep(0)
+        tasks.append(asyncio.create_task(_drain(limiter, order, "new")))
+        await asyncio.sleep(0)
+
+        limiter.release("busy")
+        await asyncio.wait_for(asyncio.gather(*tasks), 1)
+        # The new research gets the second slot, not the fifth
+        assert order == ["busy", "new", "busy", "busy", "busy"]
+        assert limiter.active_total == 0
+
+    asyncio.run(_run())
+
+
+def test_cancelled_waiter_gives_up_its_place():
+    async def _run():
+        limiter = FairLimiter(limit=1, per_session_limit=1)
+        await limiter.acquire("a")
+        cancelled = asyncio.create_task(limiter.acquire("b"))
+        waiting = asyncio.create_task(limiter.acquire("c"))
+        await asyncio.sleep(0)
+
+        cancelled.cancel()
+        await asyncio.sleep(0)
+        assert limiter.queued == 1
+
+        limiter.release("a")
+        await asyncio.wait_for(waiting, 1)
+        assert limiter.active_total == 1
+
+    asyncio.run(_run())
@@ -0,0 +1,75 @@
+import pytest
+
+from api.types import (
+    Paper,
+    Research,
+    ResearchSnapshot,
+    ResearchState,
+    ResearchStatus,
+    Search,
+    SnapshotEvent,
+)
+
+AWKWARD = 'Quotes " and \\ backslashes, </script>, emoji 🧪, ünïcode,   and \n newlines'
+
+
+def _research() -> Research:
+    return Research(
+        id="r1",
+        prompt=AWKWARD,
+        searches=[
+            Search(
+                query=AWKWARD,
+                papers=[
+                    Paper(title=AWKWARD, summary="s", url="https://example.com/a.pdf"),
+                    Paper(
+                        title="t",
+                        summary=AWKWARD,
+                        url="https://example.com/b.pdf",
+                        authors=["A", AWKWARD],
+                        publisher="P",
+                    ),
+                ],
+            ),
+            Search(query="empty", papers=[]),
+        ],
+    )
+
+
+@pytest.mark.parametrize(
+    "model",
+    [
+        _research(),
+        Research(id="", prompt="", searches=[]),
+        ResearchSnapshot(order=3, research=_research()),
+        ResearchState(order=3, status=ResearchStatus.RUNNING, research=_research()),
+        SnapshotEvent(research=_research()),
+    ],
+    ids=lambda model: type(model).__name__,
+)
+def test_dump_json_is_model_dump_json(model):
+    assert model.dump_json() == model.model_dump_json()
+
+
+def test_paper_is_encoded_again_once_it_changes():
+    research = _research()
+    paper = research.searches[0].papers[0]
+    research.dump_json()
+
+    paper.summary = "more of the summary"
+    assert research.dump_json() == research.model_dump_json()
+    assert '"summary":"more of the summary"' in research.dump_json()
+
+
+def test_copies_are_encoded_again_when_updated():
+    paper = Paper(title="t", summary="s", url="u")
+    paper.dump_json()
+    copy = paper.model_copy(update={"summary": "changed"})
+    assert copy.dump_json() == copy.model_dump_json()
+    assert paper.dump_json() == paper.model_dump_json()
+
+
+def test_papers_are_equal_whether_or_not_theyve_been_encoded():
+    encoded = Paper(title="t", summary="s", url="u")
+    encoded.dump_json()
+    assert encoded == Paper(title="t", summary="s", url="u")
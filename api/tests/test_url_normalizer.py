@@ -0,0 +1,71 @@
+import pytest
+
+from api.research.url_normalizer import fetchable_paper_url, normalize_paper_url
+
+
+@pytest.mark.parametrize(
+    "url",
+    [
+        "https://arxiv.org/abs/2101.00001v2",
+        "http://arxiv.org/pdf/2101.00001v2",
+        "https://www.arxiv.org/pdf/2101.00001v2.pdf",
+        "https://export.arxiv.org/abs/2101.00001v2/",
+    ],
+)
+def test_arxiv_abstracts_and_pdfs_are_the_same_paper(url):
+    assert normalize_paper_url(url) == "https://arxiv.org/pdf/2101.00001v2"
+
+
+def test_arxiv_old_style_ids():
+    assert (
+        normalize_paper_url("https://arxiv.org/abs/hep-th/9901001")
+        == "https://arxiv.org/pdf/hep-th/9901001"
+    )
+
+
+def test_drops_tracking_params_and_fragment():
+    assert (
+        normalize_paper_url(
+            "https://example.com/paper.pdf?utm_source=x&id=3&gclid=y&a=1#page=2"
+        )
+        == "https://example.com/paper.pdf?a=1&id=3"
+    )
+
+
+def test_lowercases_scheme_and_host_but_not_path():
+    assert (
+        normalize_paper_url("HTTPS://Example.COM/Papers/A.pdf")
+        == "https://example.com/Papers/A.pdf"
+    )
+
+
+def test_drops_default_ports_only():
+    assert normalize_paper_url("https://example.com:443/a.pdf") == "https://example.com/a.pdf"
+    assert normalize_paper_url("http://example.com:80/a.pdf") == "http://example.com/a.pdf"
+    assert (
+        normalize_paper_url("https://example.com:8443/a.pdf")
+        == "https://example.com:8443/a.pdf"
+    )
+
+
+def test_keeps_blank_params():
+    assert (
+        normalize_paper_url("https://example.com/get?download")
+        == "https://example.com/get?download="
+    )
+
+
+def test_empty_path_is_root():
+    assert normalize_paper_url("https://example.com") == "https://example.com/"
+
+
+def test_fetchable_url_is_the_url_found():
+    url = "HTTPS://Example.COM/paper.pdf?utm_source=x#page=2"
+    assert fetchable_paper_url(url) == url
+
+
+def test_fetchable_url_of_an_arxiv_abstract_is_its_pdf():
+    assert (
+        fetchable_paper_url("https://arxiv.org/abs/2101.00001")
+        == "https://arxiv.org/pdf/2101.00001"
+    )
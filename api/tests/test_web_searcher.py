@@ -0,0 +1,85 @@
+import asyncio
+from typing import AsyncIterator
+
+import pytest
+
+from api.research.web_searcher import (
+    RateLimitedWebSearcher,
+    SearchThrottledError,
+    WebSearcher,
+)
+
+
+class FakeWebSearcher(WebSearcher):
+    def __init__(self, urls: list[str], error: Exception | None = None, delay: float = 0):
+        self.urls = urls
+        self.error = error
+        self.delay = delay
+
+    async def top_urls_async(self, query: str, n: int = 10) -> AsyncIterator[str]:
+        await asyncio.sleep(self.delay)
+        for url in self.urls[:n]:
+            yield url
+        if self.error is not None:
+            raise self.error
+
+
+class RecordingRateLimiter:
+    def __init__(self):
+        self.recorded: list[str] = []
+
+    async def acquire(self):
+        pass
+
+    def record_success(self, latency_seconds: float):
+        self.recorded.append("success")
+
+    def record_throttled(self):
+        self.recorded.append("throttled")
+
+    def record_failure(self):
+        self.recorded.append("failure")
+
+
+async def _search(searcher: WebSearcher) -> list[str]:
+    return [url async for url in searcher.top_urls_async("query")]
+
+
+def test_records_success_once():
+    limiter = RecordingRateLimiter()
+    searcher = RateLimitedWebSearcher(FakeWebSearcher(["a", "b"]), limiter)
+    assert asyncio.run(_search(searcher)) == ["a", "b"]
+    assert limiter.recorded == ["success"]
+
+
+def test_records_success_without_results():
+    limiter = RecordingRateLimiter()
+    searcher = RateLimitedWebSearcher(FakeWebSearcher([]), limiter)
+    assert asyncio.run(_search(searcher)) == []
+    assert limiter.recorded == ["success"]
+
+
+@pytest.mark.parametrize(
+    "error, recorded",
+    [(SearchThrottledError("429"), ["throttled"]), (ValueError("broken"), ["failure"])],
+)
+def test_records_how_the_search_failed(error, recorded):
+    limiter = RecordingRateLimiter()
+    searcher = RateLimitedWebSearcher(FakeWebSearcher([], error), limiter)
+    with pytest.raises(type(error)):
+        asyncio.run(_search(searcher))
+    assert limiter.recorded == recorded
+
+
+def test_records_nothing_when_cancelled_before_a_result():
+    async def _run():
+        limiter = RecordingRateLimiter()
+        searcher = RateLimitedWebSearcher(FakeWebSearcher(["a"], delay=10), limiter)
+        task = asyncio.create_task(_search(searcher))
+        await asyncio.sleep(0.01)
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+        return limiter.recorded
+
+    assert asyncio.run(_run()) == []
@@ -9,6 +9,22 @@ export interface paths {
     /** Endpoint for receiving a user prompt and returning server-sent events */
     get: operations["research_create_research_create_get"];
   };
+  "/research": {
+    /** Queue research for a prompt, follow it with `/research/{research_id}/events` */
+    post: operations["research_submit_research_post"];
+  };
+  "/research/batch": {
+    /** Research many prompts at once, streams a JSON line per prompt as each one finishes, then a report */
+    post: operations["research_batch_research_batch_post"];
+  };
+  "/research/{research_id}": {
+    /** The research so far (or finished), and whether it's still running */
+    get: operations["research_get_research__research_id__get"];
+  };
+  "/research/{research_id}/events": {
+    /** Server-sent events for an existing research, from `after` (or `Last-Event-ID`) onwards */
+    get: operations["research_events_research__research_id__events_get"];
+  };
   "/": {
     /** Default */
     get: operations["default__get"];
@@ -19,6 +35,63 @@ export type webhooks = Record<string, never>;
 
 export interface components {
   schemas: {
+    /** BatchReport */
+    BatchReport: {
+      /**
+       * Type
+       * @default report
+       * @constant
+       */
+      type?: "report";
+      /** Prompts */
+      prompts: number;
+      /** Completed */
+      completed: number;
+      /** Failed */
+      failed: number;
+      /** Papers */
+      papers: number;
+      /** Unique Papers */
+      unique_papers: number;
+      /** Paper Reads */
+      paper_reads: number;
+      /** Summary Llm Calls */
+      summary_llm_calls: number;
+      /** Llm Calls Saved */
+      llm_calls_saved: number;
+      /** Seconds */
+      seconds: number;
+      /** Papers Per Second */
+      papers_per_second: number;
+      /** Prompts Per Minute */
+      prompts_per_minute: number;
+    };
+    /** BatchRequest */
+    BatchRequest: {
+      /** Prompts */
+      prompts: string[];
+      /** Concurrency */
+      concurrency?: number | null;
+    };
+    /** BatchResult */
+    BatchResult: {
+      /**
+       * Type
+       * @default result
+       * @constant
+       */
+      type?: "result";
+      /** Index */
+      index: number;
+      /** Prompt */
+      prompt: string;
+      status: components["schemas"]["ResearchStatus"];
+      /** Error */
+      error?: string | null;
+      /** Seconds */
+      seconds: number;
+      research?: components["schemas"]["Research"] | null;
+    };
     /** HTTPValidationError */
     HTTPValidationError: {
       /** Detail */
@@ -37,6 +110,81 @@ export interface components {
       /** Publisher */
       publisher?: string | null;
     };
+    /** PaperAddedEvent */
+    PaperAddedEvent: {
+      /**
+       * Type
+       * @default paper_added
+       * @constant
+       */
+      type?: "paper_added";
+      /** Search Index */
+      search_index: number;
+      /** Paper Index */
+      paper_index: number;
+      paper: components["schemas"]["Paper"];
+    };
+    /** PaperFailedEvent */
+    PaperFailedEvent: {
+      /**
+       * Type
+       * @default paper_failed
+       * @constant
+       */
+      type?: "paper_failed";
+      /** Search Index */
+      search_index: number;
+      /** Url */
+      url: string;
+      /** Error */
+      error: string;
+      /** Paper Index */
+      paper_index?: number | null;
+    };
+    /** PaperSkippedEvent */
+    PaperSkippedEvent: {
+      /**
+       * Type
+       * @default paper_skipped
+       * @constant
+       */
+      type?: "paper_skipped";
+      /** Search Index */
+      search_index: number;
+      /** Url */
+      url: string;
+      /** Score */
+      score: number;
+      /** Reason */
+      reason: string;
+    };
+    /** PaperUpdatedEvent */
+    PaperUpdatedEvent: {
+      /**
+       * Type
+       * @default paper_updated
+       * @constant
+       */
+      type?: "paper_updated";
+      /** Search Index */
+      search_index: number;
+      /** Paper Index */
+      paper_index: number;
+      paper: components["schemas"]["Paper"];
+    };
+    /** PaperReadingStartedEvent */
+    PaperReadingStartedEvent: {
+      /**
+       * Type
+       * @default paper_reading_started
+       * @constant
+       */
+      type?: "paper_reading_started";
+      /** Search Index */
+      search_index: number;
+      /** Url */
+      url: string;
+    };
     /** Research */
     Research: {
       /** Id */
@@ -46,12 +194,44 @@ export interface components {
       /** Searches */
       searches: components["schemas"]["Search"][];
     };
+    /** ResearchDelta */
+    ResearchDelta: {
+      /** Order */
+      order: number;
+      /** Event */
+      event: components["schemas"]["ResearchStartedEvent"] | components["schemas"]["SearchAddedEvent"] | components["schemas"]["PaperReadingStartedEvent"] | components["schemas"]["PaperAddedEvent"] | components["schemas"]["PaperUpdatedEvent"] | components["schemas"]["PaperFailedEvent"] | components["schemas"]["PaperSkippedEvent"] | components["schemas"]["SnapshotEvent"];
+    };
     /** ResearchSnapshot */
     ResearchSnapshot: {
       /** Order */
       order: number;
       research: components["schemas"]["Research"];
     };
+    /** ResearchState */
+    ResearchState: {
+      /** Order */
+      order: number;
+      status: components["schemas"]["ResearchStatus"];
+      research: components["schemas"]["Research"];
+    };
+    /**
+     * ResearchStatus
+     * @enum {string}
+     */
+    ResearchStatus: "queued" | "running" | "completed" | "failed" | "interrupted";
+    /** ResearchStartedEvent */
+    ResearchStartedEvent: {
+      /**
+       * Type
+       * @default research_started
+       * @constant
+       */
+      type?: "research_started";
+      /** Id */
+      id: string;
+      /** Prompt */
+      prompt: string;
+    };
     /** Search */
     Search: {
       /** Query */
@@ -59,6 +239,34 @@ export interface components {
       /** Papers */
       papers: components["schemas"]["Paper"][];
     };
+    /** SearchAddedEvent */
+    SearchAddedEvent: {
+      /**
+       * Type
+       * @default search_added
+       * @constant
+       */
+      type?: "search_added";
+      /** Search Index */
+      search_index: number;
+      /** Query */
+      query: string;
+    };
+    /** SnapshotEvent */
+    SnapshotEvent: {
+      /**
+       * Type
+       * @default snapshot
+       * @constant
+       */
+      type?: "snapshot";
+      research: components["schemas"]["Research"];
+    };
+    /**
+     * StreamProtocol
+     * @enum {string}
+     */
+    StreamProtocol: "snapshot" | "delta";
     /** ValidationError */
     ValidationError: {
       /** Location */
@@ -87,13 +295,112 @@ export interface operations {
     parameters: {
       query: {
         prompt: string;
+        protocol?: components["schemas"]["StreamProtocol"];
+      };
+      header?: {
+        "last-event-id"?: string | null;
+      };
+    };
+    responses: {
+      /** @description Successful Response */
+      200: {
+        content: {
+          "application/json": components["schemas"]["ResearchSnapshot"] | components["schemas"]["ResearchDelta"];
+        };
+      };
+      /** @description Validation Error */
+      422: {
+        content: {
+          "application/json": components["schemas"]["HTTPValidationError"];
+        };
+      };
+    };
+  };
+  /** Queue research for a prompt, follow it with `/research/{research_id}/events` */
+  research_submit_research_post: {
+    parameters: {
+      query: {
+        prompt: string;
+      };
+    };
+    responses: {
+      /** @description Successful Response */
+      200: {
+        content: {
+          "application/json": components["schemas"]["ResearchState"];
+        };
+      };
+      /** @description Validation Error */
+      422: {
+        content: {
+          "application/json": components["schemas"]["HTTPValidationError"];
+        };
+      };
+    };
+  };
+  /** Research many prompts at once, streams a JSON line per prompt as each one finishes, then a report */
+  research_batch_research_batch_post: {
+    requestBody: {
+      content: {
+        "application/json": components["schemas"]["BatchRequest"];
+      };
+    };
+    responses: {
+      /** @description Successful Response */
+      200: {
+        content: {
+          "application/json": components["schemas"]["BatchResult"] | components["schemas"]["BatchReport"];
+        };
+      };
+      /** @description Validation Error */
+      422: {
+        content: {
+          "application/json": components["schemas"]["HTTPValidationError"];
+        };
+      };
+    };
+  };
+  /** The research so far (or finished), and whether it's still running */
+  research_get_research__research_id__get: {
+    parameters: {
+      path: {
+        research_id: string;
+      };
+    };
+    responses: {
+      /** @description Successful Response */
+      200: {
+        content: {
+          "application/json": components["schemas"]["ResearchState"];
+        };
+      };
+      /** @description Validation Error */
+      422: {
+        content: {
+          "application/json": components["schemas"]["HTTPValidationError"];
+        };
+      };
+    };
+  };
+  /** Server-sent events for an existing research, from `after` (or `Last-Event-ID`) onwards */
+  research_events_research__research_id__events_get: {
+    parameters: {
+      query?: {
+        protocol?: components["schemas"]["StreamProtocol"];
+        after?: number;
+      };
+      header?: {
+        "last-event-id"?: string | null;
+      };
+      path: {
+        research_id: string;
       };
     };
     responses: {
       /** @description Successful Response */
       200: {
         content: {
-          "application/json": components["schemas"]["ResearchSnapshot"];
+          "application/json": components["schemas"]["ResearchSnapshot"] | components["schemas"]["ResearchDelta"];
         };
       };
       /** @description Validation Error */